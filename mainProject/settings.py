@@ -64,3 +64,9 @@ GRAPHENE = {
     ]
 }
 
+
+CURRENCY_RATES = {
+    "TTL_SECONDS": int(os.getenv("CURRENCY_RATES_TTL_SECONDS", 24 * 60 * 60)),
+    "LRU_MAX_ENTRIES": int(os.getenv("CURRENCY_RATES_LRU_MAX_ENTRIES", 64)),
+    "DB_RETENTION_DAYS": None,
+}
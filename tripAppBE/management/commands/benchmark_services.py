@@ -0,0 +1,175 @@
+import statistics
+import time
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import override_settings
+
+from tripAppBE.management.commands.partition_by_trip import is_partitioned
+from tripAppBE.models import Cost, Splited, Trip, TripParticipant
+from tripAppBE.services import cost_service, split_service
+from tripAppBE.services.ledger_service import rebuild_ledger
+from tripAppBE.services.transfer_service import get_suggested_transfers
+
+# koszty, w których uczestniczy mierzony uczestnik – stałe niezależnie od rozmiaru tripu
+INVOLVED_COSTS = 200
+SPLITS_PER_COST = 4
+
+
+class Rollback(Exception):
+    pass
+
+
+class _SplitParticipant(dict):
+    """
+    Jak SplitParticipantInput z mutacji: dict z dostępem przez atrybuty.
+    """
+    __getattr__ = dict.get
+
+
+# nazwa → seed → wywołanie mierzone
+SCENARIOS = {
+    "summary": lambda seed: lambda: cost_service.get_cost_sum_for_participant_per_trip_bulk(
+        seed["busy_participant_id"], seed["trip_id"]
+    ),
+    "trip_balances": lambda seed: lambda: cost_service.get_trip_balances(seed["trip_id"]),
+    "payback": lambda seed: lambda: cost_service.get_payback_participant_relation_per_trip_bulk(
+        seed["trip_id"], seed["participant_id"]
+    ),
+    # uczestnik w co ~5. koszcie, rozłożonych po całym tripie
+    "costs_page": lambda seed: lambda: cost_service.get_costs_page(seed["busy_participant_id"], seed["trip_id"]),
+    # uczestnik tylko w INVOLVED_COSTS najstarszych kosztach – keyset przechodzi przez resztę tripu
+    "costs_page_sparse": lambda seed: lambda: cost_service.get_costs_page(seed["participant_id"], seed["trip_id"]),
+    "suggested_transfers": lambda seed: lambda: get_suggested_transfers(seed["trip_id"]),
+    # podział 1000.01 po równo między wszystkich i wagami 1..n
+    "split_equal": lambda seed: lambda: split_service.compute_splits(
+        seed["trip_id"], split_service.EQUAL, Decimal("1000.01")
+    ),
+    "split_shares": lambda seed: lambda: split_service.compute_splits(
+        seed["trip_id"], split_service.SHARES, Decimal("1000.01"), [
+            _SplitParticipant(participant_id=member_id, share=Decimal(i + 1))
+            for i, member_id in enumerate(seed["members"])
+        ]
+    ),
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Time service functions on seeded trips of growing size and print the median per size. "
+        "Every seeded trip is rolled back."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sizes", default="1000,10000,50000", help="Comma-separated cost counts of the seeded trips")
+        parser.add_argument("--participants", type=int, default=20, help="Participants in each seeded trip")
+        parser.add_argument("--repeat", type=int, default=5, help="Timed runs per scenario and size")
+        parser.add_argument("--scenario", action="append", dest="scenarios", choices=sorted(SCENARIOS),
+                            help="Only run this scenario (repeatable)")
+
+    def handle(self, *args, **options):
+        try:
+            sizes = [int(size) for size in options["sizes"].split(",")]
+        except ValueError:
+            raise CommandError("--sizes must be a comma-separated list of integers")
+        if options["participants"] < SPLITS_PER_COST + 1:
+            raise CommandError(f"Use at least {SPLITS_PER_COST + 1} participants")
+
+        scenarios = options["scenarios"] or sorted(SCENARIOS)
+        results = {name: [] for name in scenarios}
+
+        # cache podsumowań wyłączony – każde wywołanie musi dojść do bazy
+        with override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.dummy.DummyCache"}}):
+            for size in sizes:
+                try:
+                    with transaction.atomic():
+                        seed = self._seed(size, options["participants"])
+                        for name in scenarios:
+                            results[name].append(self._time(SCENARIOS[name](seed), options["repeat"]))
+                        raise Rollback
+                except Rollback:
+                    pass
+                self.stdout.write(f"{size} costs done")
+
+        layout = ""
+        if connection.vendor == "postgresql":
+            # porównanie przed / po partition_by_trip --execute
+            layout = ", partitioned" if is_partitioned(Splited) else ", plain tables"
+        self.stdout.write(f"\n{connection.vendor}{layout}, {options['participants']} participants, median ms")
+        self.stdout.write("scenario".ljust(24) + "".join(f"{size:>12}" for size in sizes))
+        for name in scenarios:
+            self.stdout.write(name.ljust(24) + "".join(f"{ms:>12.2f}" for ms in results[name]))
+
+    def _time(self, call, repeat):
+        call()  # rozgrzewka
+        timings = []
+        for _ in range(repeat):
+            # zapisy mierzone w savepoincie wycofywanym po wywołaniu
+            try:
+                with transaction.atomic():
+                    started = time.perf_counter()
+                    call()
+                    timings.append((time.perf_counter() - started) * 1000)
+                    raise Rollback
+            except Rollback:
+                pass
+        return statistics.median(timings)
+
+    def _seed(self, costs, participants):
+        """
+        Trip z `costs` kosztami po SPLITS_PER_COST splitów. Mierzony uczestnik (members[0])
+        bierze udział tylko w INVOLVED_COSTS kosztach – reszta tripu rośnie bez niego.
+        """
+        owner = User.objects.create(username=f"__bench_{User.objects.count()}")
+        trip = Trip.objects.create(
+            trip_code="__BENCH", trip_owner=owner, name="bench", description="", default_currency="PLN"
+        )
+        members = TripParticipant.objects.bulk_create([
+            TripParticipant(trip=trip, nickname=f"p{i}", Join_code=f"__BE{i:04d}")
+            for i in range(participants)
+        ])
+        me, others = members[0], members[1:]
+
+        value = Decimal("10.00")
+        cost_rows = Cost.objects.bulk_create([
+            Cost(
+                trip=trip, cost_name=f"c{i}", overall_value=value * SPLITS_PER_COST, description="",
+                payed_currency="PLN", overall_value_main_currency=value * SPLITS_PER_COST,
+            )
+            for i in range(costs)
+        ], batch_size=1000)
+
+        splits = []
+        for i, cost in enumerate(cost_rows):
+            group = [others[(i + k) % len(others)] for k in range(SPLITS_PER_COST)]
+            if i < INVOLVED_COSTS:
+                group[-1] = me
+            payer = group[0]
+            for member in group:
+                own = member.id == payer.id
+                splits.append(Splited(
+                    trip=trip, cost=cost, participant=member, payer=payer, payment=own, rate=Decimal("1.00"),
+                    split_value=value, split_value_main_current=value,
+                    pay_back_value=value if own else Decimal("0.00"),
+                    pay_back_value_main_current=value if own else Decimal("0.00"),
+                    to_pay_back_value=Decimal("0.00") if own else value,
+                    to_pay_back_value_main_current=Decimal("0.00") if own else value,
+                ))
+            if len(splits) >= 10000:
+                Splited.objects.bulk_create(splits, batch_size=1000)
+                splits = []
+        Splited.objects.bulk_create(splits, batch_size=1000)
+        rebuild_ledger([trip.trip_id])
+
+        if connection.vendor == "postgresql":
+            with connection.cursor() as cursor:
+                cursor.execute("ANALYZE")
+
+        return {
+            "trip_id": trip.trip_id,
+            "participant_id": me.id,
+            "busy_participant_id": others[0].id,
+            "members": [member.id for member in members],
+        }
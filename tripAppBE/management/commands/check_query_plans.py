@@ -0,0 +1,174 @@
+import re
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.utils import timezone
+
+from tripAppBE.models import Cost, Splited, Trip, TripParticipant
+from tripAppBE.services import cost_service
+from tripAppBE.services.ledger_service import get_ledger_as_of, rebuild_ledger
+from tripAppBE.services.transfer_service import get_suggested_transfers
+
+# plan line → nazwa tabeli skanowanej sekwencyjnie
+SEQ_SCAN_PATTERNS = {
+    "postgresql": re.compile(r"Seq Scan on \"?(\w+)\"?"),
+    "sqlite": re.compile(r"\bSCAN (\w+)(?![\w ]*USING)"),
+}
+
+EXPLAINED_STATEMENTS = ("SELECT", "UPDATE", "DELETE")
+
+
+class Rollback(Exception):
+    pass
+
+
+def service_calls(trip_id, participant_id, other_id, cost_id):
+    """
+    Funkcje serwisów, których plany sprawdzamy – (nazwa, wywołanie).
+    Zapisy działają w savepoincie wycofywanym po wywołaniu.
+    """
+    return [
+        ("get_cost_sum_for_participant_per_trip_bulk",
+         lambda: cost_service.get_cost_sum_for_participant_per_trip_bulk(participant_id, trip_id)),
+        ("get_trip_balances", lambda: cost_service.get_trip_balances(trip_id)),
+        ("get_all_cost_for_participant_per_trip",
+         lambda: list(cost_service.get_all_cost_for_participant_per_trip(participant_id, trip_id))),
+        ("get_costs_page", lambda: cost_service.get_costs_page(participant_id, trip_id)),
+        ("get_payback_participant_relation_per_trip_bulk",
+         lambda: cost_service.get_payback_participant_relation_per_trip_bulk(trip_id, participant_id)),
+        ("get_suggested_transfers", lambda: get_suggested_transfers(trip_id)),
+        ("get_ledger_as_of", lambda: get_ledger_as_of(trip_id, timezone.now())),
+        ("update_payment", lambda: cost_service.update_payment(cost_id, other_id, 1, None)),
+        ("record_payment", lambda: cost_service.record_payment(cost_id, other_id, 1, None)),
+        ("delete_split_by_user", lambda: cost_service.delete_split_by_user(cost_id, other_id)),
+        ("delete_cost", lambda: cost_service.delete_cost(cost_id)),
+        ("fully_settlement_with_participant",
+         lambda: cost_service.fully_settlement_with_participant(trip_id, participant_id, other_id)),
+        ("settle_trip", lambda: cost_service.settle_trip(trip_id)),
+    ]
+
+
+class Command(BaseCommand):
+    help = (
+        "Run the cost service functions on a seeded trip, EXPLAIN every query they issue "
+        "and fail if any plan falls back to a sequential scan."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--costs", type=int, default=2000, help="Costs in the seeded trip")
+        parser.add_argument("--participants", type=int, default=8, help="Participants in the seeded trip")
+        parser.add_argument("--allow", action="append", default=[], metavar="TABLE",
+                            help="Table allowed to be scanned sequentially (repeatable)")
+        parser.add_argument("--verbose-plans", action="store_true", help="Print every plan")
+
+    def handle(self, *args, **options):
+        vendor = connection.vendor
+        if vendor not in SEQ_SCAN_PATTERNS:
+            raise CommandError(f"Unsupported database: {vendor}")
+
+        failures = []
+        try:
+            # seed + wywołania w jednej transakcji, na końcu wszystko wycofane
+            with transaction.atomic():
+                if vendor == "postgresql":
+                    with connection.cursor() as cursor:
+                        # planner wybierze seq scan tylko gdy nie ma użytecznego indeksu
+                        cursor.execute("SET LOCAL enable_seqscan = off")
+
+                seed = self._seed(options["costs"], options["participants"])
+                failures = self._check(seed, vendor, set(options["allow"]), options["verbose_plans"])
+                raise Rollback
+        except Rollback:
+            pass
+
+        if failures:
+            for name, table, sql in failures:
+                self.stdout.write(f"{name}: sequential scan on {table}\n  {sql[:200]}")
+            raise CommandError(f"{len(failures)} query plan(s) use a sequential scan")
+
+        self.stdout.write(self.style.SUCCESS("No sequential scans"))
+
+    def _seed(self, costs, participants):
+        owner = User.objects.create(username=f"__plans_{User.objects.count()}")
+        trip = Trip.objects.create(
+            trip_code="__PLANS", trip_owner=owner, name="plans", description="", default_currency="PLN"
+        )
+        members = TripParticipant.objects.bulk_create([
+            TripParticipant(trip=trip, nickname=f"p{i}", Join_code=f"__PL{i:04d}")
+            for i in range(participants)
+        ])
+
+        value = Decimal("10.00")
+        cost_rows = Cost.objects.bulk_create([
+            Cost(
+                trip=trip, cost_name=f"c{i}", overall_value=value * participants, description="",
+                payed_currency="PLN", overall_value_main_currency=value * participants,
+            )
+            for i in range(costs)
+        ], batch_size=1000)
+
+        splits = []
+        for i, cost in enumerate(cost_rows):
+            payer = members[i % participants]
+            for member in members:
+                own = member.id == payer.id
+                splits.append(Splited(
+                    trip=trip, cost=cost, participant=member, payer=payer, payment=own, rate=Decimal("1.00"),
+                    split_value=value, split_value_main_current=value,
+                    pay_back_value=value if own else Decimal("0.00"),
+                    pay_back_value_main_current=value if own else Decimal("0.00"),
+                    to_pay_back_value=Decimal("0.00") if own else value,
+                    to_pay_back_value_main_current=Decimal("0.00") if own else value,
+                ))
+        Splited.objects.bulk_create(splits, batch_size=1000)
+        rebuild_ledger([trip.trip_id])
+
+        if connection.vendor == "postgresql":
+            with connection.cursor() as cursor:
+                cursor.execute("ANALYZE")
+
+        return {
+            "trip_id": trip.trip_id,
+            "participant_id": members[0].id,
+            "other_id": members[1].id,
+            "cost_id": cost_rows[0].cost_id,
+        }
+
+    def _check(self, seed, vendor, allowed, verbose):
+        pattern = SEQ_SCAN_PATTERNS[vendor]
+        explain = "EXPLAIN QUERY PLAN " if vendor == "sqlite" else "EXPLAIN "
+
+        failures = []
+        # cache podsumowań wyłączony – każde wywołanie musi dojść do bazy
+        with override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.dummy.DummyCache"}}):
+            for name, call in service_calls(**seed):
+                with CaptureQueriesContext(connection) as captured:
+                    try:
+                        with transaction.atomic():
+                            call()
+                            raise Rollback
+                    except Rollback:
+                        pass
+
+                statements = [
+                    q["sql"] for q in captured.captured_queries
+                    if q["sql"].lstrip().upper().startswith(EXPLAINED_STATEMENTS)
+                ]
+                for sql in statements:
+                    with connection.cursor() as cursor:
+                        cursor.execute(explain + sql)
+                        plan = "\n".join(" ".join(str(col) for col in row) for row in cursor.fetchall())
+
+                    if verbose:
+                        self.stdout.write(f"-- {name}\n{sql}\n{plan}\n")
+
+                    for table in pattern.findall(plan):
+                        if table not in allowed:
+                            failures.append((name, table, sql))
+
+                self.stdout.write(f"{name}: {len(statements)} statement(s) explained")
+
+        return failures
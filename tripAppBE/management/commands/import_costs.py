@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from tripAppBE.services.import_service import import_costs, iter_rows, FORMATS, DEFAULT_BATCH_SIZE
+
+
+class Command(BaseCommand):
+    help = "Stream a CSV or JSON-lines expense file into a trip."
+
+    def add_arguments(self, parser):
+        parser.add_argument("trip_id", type=int)
+        parser.add_argument("path")
+        parser.add_argument("--format", choices=FORMATS, help="File format (default: from the file extension)")
+        parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        file_format = options["format"] or options["path"].rsplit(".", 1)[-1].lower()
+        if file_format not in FORMATS:
+            raise CommandError(f"Unsupported format, use --format {' or '.join(FORMATS)}")
+
+        with open(options["path"], "rb") as stream:
+            result = import_costs(options["trip_id"], iter_rows(stream, file_format), options["batch_size"])
+
+        if not result["ok"]:
+            raise CommandError(result["message"])
+
+        for error in result["errors"]:
+            self.stderr.write(self.style.WARNING(f"row {error['row']}: {error['message']}"))
+        self.stdout.write(self.style.SUCCESS(
+            f"{result['message']} in {result['seconds']}s ({result['rows_per_second']} rows/s)"
+        ))
@@ -0,0 +1,111 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from tripAppBE.models import Cost, Splited
+
+DEFAULT_PARTITIONS = 16
+
+
+def _q(name):
+    return connection.ops.quote_name(name)
+
+
+def partition_sql(model, partitions, schema_editor):
+    """
+    SQL zamieniający tabelę modelu na tabelę partycjonowaną HASH (trip_id).
+    Dane kopiowane INSERT ... SELECT; indeksy odtwarzane z definicji modelu,
+    PK rozszerzony o trip_id (wymóg Postgresa dla tabel partycjonowanych).
+    """
+    table = model._meta.db_table
+    old = f"{table}_unpartitioned"
+    pk = model._meta.pk.column
+    seq = f"{table}_{pk}_part_seq"
+
+    statements = [
+        f"ALTER TABLE {_q(table)} RENAME TO {_q(old)}",
+        # LIKE nie kopiuje IDENTITY (niewspierane na tabelach partycjonowanych przed PG 17) → własna sekwencja
+        f"CREATE TABLE {_q(table)} (LIKE {_q(old)} INCLUDING DEFAULTS INCLUDING CONSTRAINTS) PARTITION BY HASH (trip_id)",
+        f"CREATE SEQUENCE {_q(seq)} OWNED BY {_q(table)}.{_q(pk)}",
+        f"ALTER TABLE {_q(table)} ALTER COLUMN {_q(pk)} SET DEFAULT nextval('{_q(seq)}')",
+    ]
+    statements += [
+        f"CREATE TABLE {_q(f'{table}_p{i}')} PARTITION OF {_q(table)} "
+        f"FOR VALUES WITH (MODULUS {partitions}, REMAINDER {i})"
+        for i in range(partitions)
+    ]
+    statements += [
+        f"INSERT INTO {_q(table)} SELECT * FROM {_q(old)}",
+        f"SELECT setval('{_q(seq)}', COALESCE((SELECT MAX({_q(pk)}) FROM {_q(old)}), 0) + 1, false)",
+        # CASCADE usuwa też klucze obce wskazujące na starą tabelę
+        f"DROP TABLE {_q(old)} CASCADE",
+        f"ALTER TABLE {_q(table)} ADD PRIMARY KEY (trip_id, {_q(pk)})",
+    ]
+    statements += [str(sql) for sql in schema_editor._model_indexes_sql(model)]
+
+    for field in model._meta.local_fields:
+        if not field.remote_field or not field.db_constraint:
+            continue
+        target = field.remote_field.model
+        if target is Cost:
+            # cost_id nie jest już unikalny sam w sobie – FK złożony z kluczem partycjonowania
+            columns, target_columns = ["trip_id", field.column], ["trip_id", target._meta.pk.column]
+        else:
+            columns, target_columns = [field.column], [field.target_field.column]
+        statements.append(
+            f"ALTER TABLE {_q(table)} ADD CONSTRAINT {_q(f'{table}_{field.column}_part_fk')} "
+            f"FOREIGN KEY ({', '.join(map(_q, columns))}) "
+            f"REFERENCES {_q(target._meta.db_table)} ({', '.join(map(_q, target_columns))}) "
+            f"DEFERRABLE INITIALLY DEFERRED"
+        )
+
+    return statements
+
+
+def is_partitioned(model):
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT relkind FROM pg_class WHERE relname = %s", [model._meta.db_table])
+        row = cursor.fetchone()
+    return bool(row) and row[0] == "p"
+
+
+class Command(BaseCommand):
+    help = (
+        "Hash-partition the cost and split tables by trip_id (PostgreSQL only). "
+        "Prints the SQL by default; --execute runs it in one transaction."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--partitions", type=int, default=DEFAULT_PARTITIONS, help="Number of hash partitions")
+        parser.add_argument("--execute", action="store_true", help="Run the SQL instead of printing it")
+
+    def handle(self, *args, **options):
+        if connection.vendor != "postgresql":
+            raise CommandError("Partitioning is only supported on PostgreSQL")
+        partitions = options["partitions"]
+        if partitions < 2:
+            raise CommandError("Use at least 2 partitions")
+
+        # Cost przed Splited: FK złożony ze splitów wymaga już PK (trip_id, cost_id)
+        models = [Cost, Splited]
+        if options["execute"]:
+            models = [model for model in models if not is_partitioned(model)]
+            if not models:
+                self.stdout.write("Tables are already partitioned")
+                return
+
+        with connection.schema_editor(collect_sql=True, atomic=False) as schema_editor:
+            statements = [sql for model in models for sql in partition_sql(model, partitions, schema_editor)]
+
+        if not options["execute"]:
+            self.stdout.write(";\n".join(statements) + ";")
+            return
+
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                for sql in statements:
+                    cursor.execute(sql)
+                cursor.execute("ANALYZE " + ", ".join(_q(model._meta.db_table) for model in models))
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Partitioned {', '.join(model._meta.db_table for model in models)} into {partitions} partitions"
+        ))
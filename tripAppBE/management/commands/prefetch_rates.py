@@ -0,0 +1,47 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from tripAppBE.services.convert_currency_service import prefetch_rates, get_rate_cache_stats
+
+
+class Command(BaseCommand):
+    help = "Warm the currency rate store before peak hours so add_cost rarely fetches on the request path."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--base", action="append", dest="bases",
+                            help="Base currency table to warm (repeatable, default: CURRENCY_RATES['BASE_CURRENCY'])")
+        parser.add_argument("--workers", type=int, default=4, help="Size of the fetch thread pool")
+        parser.add_argument("--no-refresh", action="store_true",
+                            help="Only fetch tables that are missing or past their TTL")
+        parser.add_argument("--days", type=int, default=0,
+                            help="Also backfill the rate history for this many past days")
+        parser.add_argument("--loop", type=int, default=0, metavar="SECONDS",
+                            help="Keep running and warm again every SECONDS")
+
+    def handle(self, *args, **options):
+        while True:
+            started = time.monotonic()
+            report = prefetch_rates(
+                bases=options["bases"],
+                max_workers=options["workers"],
+                refresh=not options["no_refresh"],
+                days=options["days"],
+            )
+            elapsed = time.monotonic() - started
+
+            for base, info in report.items():
+                if info["date"] is None:
+                    self.stderr.write(self.style.ERROR(f"{base}: rates unavailable"))
+                    continue
+                self.stdout.write(self.style.SUCCESS(f"{base}: rates from {info['date']}"))
+                if info["missing"]:
+                    self.stderr.write(self.style.WARNING(f"{base}: no rate for {', '.join(info['missing'])}"))
+                if options["days"]:
+                    history = info["history"]
+                    self.stdout.write(f"{base}: history {history['stored']} day(s) stored, {history['failed']} failed")
+            self.stdout.write(f"Warmed {len(report)} table(s) in {elapsed:.2f}s, cache stats: {get_rate_cache_stats()}")
+
+            if not options["loop"]:
+                break
+            time.sleep(options["loop"])
@@ -0,0 +1,22 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from tripAppBE.services.cost_service import reconcile_pending_conversions
+
+
+class Command(BaseCommand):
+    help = "Fill in main-currency values of costs saved while the rate provider was unavailable."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--loop", type=int, default=0, metavar="SECONDS",
+                            help="Keep running and reconcile again every SECONDS")
+
+    def handle(self, *args, **options):
+        while True:
+            result = reconcile_pending_conversions()
+            self.stdout.write(f"Converted {result['converted']} cost(s), {result['pending']} still pending")
+
+            if not options["loop"]:
+                break
+            time.sleep(options["loop"])
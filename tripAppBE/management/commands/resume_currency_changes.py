@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from tripAppBE.services.currency_change_service import (
+    CURRENCY_CHANGE_STALE_SECONDS, get_resumable_jobs, run_currency_change_job,
+)
+
+
+class Command(BaseCommand):
+    help = "Finish trip currency changes interrupted by a restart (runs the jobs in the foreground)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--job", type=int, action="append", dest="job_ids", help="Only resume this job (repeatable)")
+        parser.add_argument("--failed", action="store_true", help="Retry failed jobs as well")
+        parser.add_argument(
+            "--stale-after", type=int, default=CURRENCY_CHANGE_STALE_SECONDS,
+            help="Take over running jobs idle for this many seconds (use 0 right after a restart)",
+        )
+
+    def handle(self, *args, **options):
+        jobs = get_resumable_jobs(options["job_ids"], include_failed=options["failed"])
+        if not jobs:
+            self.stdout.write("No currency changes to resume")
+            return
+
+        failed = resumed = 0
+        for job in jobs:
+            self.stdout.write(f"Job {job.id}: trip {job.trip_id} {job.from_currency} → {job.to_currency}, from cost {job.last_cost_id}")
+            result = run_currency_change_job(
+                job.id, include_failed=options["failed"], stale_seconds=options["stale_after"]
+            )
+            if result is None:
+                self.stdout.write(f"Job {job.id}: already running elsewhere, skipped")
+            elif result:
+                resumed += 1
+            else:
+                failed += 1
+
+        if failed:
+            raise CommandError(f"{failed} of {len(jobs)} job(s) failed")
+        self.stdout.write(self.style.SUCCESS(f"Resumed {resumed} job(s)"))
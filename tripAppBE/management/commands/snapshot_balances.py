@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from tripAppBE.services.ledger_service import SNAPSHOT_MIN_EVENTS, take_snapshot, trips_due_for_snapshot
+
+
+class Command(BaseCommand):
+    help = "Snapshot the balances of trips with many cost events since their last snapshot (run periodically)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--trip", type=int, action="append", dest="trip_ids", help="Only snapshot this trip (repeatable)")
+        parser.add_argument("--min-events", type=int, default=SNAPSHOT_MIN_EVENTS,
+                            help="Events since the last snapshot needed to take a new one")
+
+    def handle(self, *args, **options):
+        trip_ids = trips_due_for_snapshot(options["min_events"], options["trip_ids"])
+        if not trip_ids:
+            self.stdout.write("No trips due for a snapshot")
+            return
+
+        taken = 0
+        for trip_id in trip_ids:
+            snapshot = take_snapshot(trip_id)
+            if snapshot is not None:
+                taken += 1
+                self.stdout.write(f"trip {trip_id}: {len(snapshot.balances)} balance(s) up to event {snapshot.last_event_id}")
+
+        self.stdout.write(self.style.SUCCESS(f"Snapshotted {taken} trip(s)"))
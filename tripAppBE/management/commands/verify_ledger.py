@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from tripAppBE.services.ledger_service import diff_ledger, rebuild_ledger
+
+
+class Command(BaseCommand):
+    help = "Rebuild the balance ledger from Splited rows and report differences to the stored ledger."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--trip", type=int, action="append", dest="trip_ids", help="Only check this trip (repeatable)")
+        parser.add_argument("--fix", action="store_true", help="Rebuild the ledger of trips with differences")
+
+    def handle(self, *args, **options):
+        diffs = diff_ledger(options["trip_ids"])
+
+        for diff in diffs:
+            trip_id, debtor_id, creditor_id, currency = diff["key"]
+            self.stdout.write(
+                f"trip {trip_id}: {debtor_id} → {creditor_id} {currency}: "
+                f"expected {diff['expected']}, ledger {diff['actual']}"
+            )
+
+        if not diffs:
+            self.stdout.write(self.style.SUCCESS("Ledger matches splits"))
+            return
+
+        trip_ids = sorted({diff["key"][0] for diff in diffs})
+        if not options["fix"]:
+            raise CommandError(f"{len(diffs)} ledger difference(s) in {len(trip_ids)} trip(s), run with --fix to rebuild")
+
+        rebuild_ledger(trip_ids)
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt ledger of {len(trip_ids)} trip(s)"))
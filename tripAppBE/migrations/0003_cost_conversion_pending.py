@@ -0,0 +1,33 @@
+# Generated by Django 6.0 on 2026-10-18 11:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tripAppBE', '0002_currencyrate'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cost',
+            name='conversion_pending',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='cost',
+            name='rate_date',
+            field=models.DateField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='cost',
+            name='overall_value_main_currency',
+            field=models.DecimalField(decimal_places=2, max_digits=10, null=True),
+        ),
+        migrations.AlterField(
+            model_name='splited',
+            name='rate',
+            field=models.DecimalField(decimal_places=2, max_digits=10, null=True),
+        ),
+    ]
@@ -0,0 +1,62 @@
+# Generated by Django 6.0 on 2026-10-18 14:05
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models.functions import Coalesce
+
+
+def build_ledger(apps, schema_editor):
+    Splited = apps.get_model('tripAppBE', 'Splited')
+    BalanceLedger = apps.get_model('tripAppBE', 'BalanceLedger')
+
+    rows = (
+        Splited.objects
+        .filter(payment=False)
+        .exclude(participant_id=models.F('payer_id'))
+        .values('cost__trip_id', 'participant_id', 'payer_id', 'cost__payed_currency')
+        .annotate(
+            amount=models.Sum('to_pay_back_value'),
+            amount_main=models.Sum(Coalesce('to_pay_back_value_main_current', models.Value(0), output_field=models.DecimalField(max_digits=12, decimal_places=2))),
+        )
+    )
+    BalanceLedger.objects.bulk_create(
+        [
+            BalanceLedger(
+                trip_id=row['cost__trip_id'],
+                debtor_id=row['participant_id'],
+                creditor_id=row['payer_id'],
+                currency=row['cost__payed_currency'],
+                amount=row['amount'],
+                amount_main=row['amount_main'],
+            )
+            for row in rows
+        ],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tripAppBE', '0003_cost_conversion_pending'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BalanceLedger',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('currency', models.TextField(max_length=5)),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('amount_main', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('creditor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='credits', to='tripAppBE.tripparticipant')),
+                ('debtor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='debts', to='tripAppBE.tripparticipant')),
+                ('trip', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ledger', to='tripAppBE.trip')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['trip', 'creditor'], name='ledger_trip_creditor_idx')],
+                'constraints': [models.UniqueConstraint(fields=('trip', 'debtor', 'creditor', 'currency'), name='unique_ledger_pair_per_currency')],
+            },
+        ),
+        migrations.RunPython(build_ledger, migrations.RunPython.noop),
+    ]
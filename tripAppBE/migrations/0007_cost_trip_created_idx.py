@@ -0,0 +1,17 @@
+# Generated by Django 6.0 on 2026-10-18 17:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tripAppBE', '0006_trip_version'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='cost',
+            index=models.Index(fields=['trip', 'created_at', 'cost_id'], name='cost_trip_created_idx'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 6.0 on 2026-10-18 18:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tripAppBE', '0007_cost_trip_created_idx'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='cost',
+            index=models.Index(condition=models.Q(('conversion_pending', True)), fields=['payed_currency', 'rate_date'], name='cost_conversion_pending_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='splited',
+            index=models.Index(fields=['cost', 'participant'], name='splited_cost_participant_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='splited',
+            index=models.Index(fields=['payer', 'participant', 'payment'], name='splited_payer_participant_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='splited',
+            index=models.Index(condition=models.Q(('payment', False)), fields=['participant', 'payer'], name='splited_open_idx'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 6.0 on 2026-10-18 19:30
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tripAppBE', '0008_query_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CurrencyChangeJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('from_currency', models.TextField(max_length=5)),
+                ('to_currency', models.TextField(max_length=5)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], default='pending', max_length=10)),
+                ('last_cost_id', models.IntegerField(default=0)),
+                ('total_costs', models.IntegerField(default=0)),
+                ('converted_costs', models.IntegerField(default=0)),
+                ('error', models.TextField(blank=True, default='')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('trip', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='currency_jobs', to='tripAppBE.trip')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(condition=models.Q(('status__in', ['pending', 'running'])), fields=('trip',), name='one_active_currency_job_per_trip')],
+            },
+        ),
+    ]
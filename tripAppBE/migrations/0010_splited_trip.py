@@ -0,0 +1,31 @@
+# Generated by Django 6.0 on 2026-10-18 20:40
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def backfill_split_trip(apps, schema_editor):
+    Splited = apps.get_model('tripAppBE', 'Splited')
+    Cost = apps.get_model('tripAppBE', 'Cost')
+
+    Splited.objects.filter(trip__isnull=True).update(
+        trip_id=models.Subquery(
+            Cost.objects.filter(cost_id=models.OuterRef('cost_id')).values('trip_id')[:1]
+        )
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tripAppBE', '0009_currencychangejob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='splited',
+            name='trip',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='splits', to='tripAppBE.trip'),
+        ),
+        migrations.RunPython(backfill_split_trip, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 6.0 on 2026-10-18 20:41
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tripAppBE', '0010_splited_trip'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='splited',
+            name='trip',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='splits', to='tripAppBE.trip'),
+        ),
+        migrations.RemoveIndex(
+            model_name='splited',
+            name='splited_open_idx',
+        ),
+        migrations.AddIndex(
+            model_name='splited',
+            index=models.Index(condition=models.Q(('payment', False)), fields=['trip', 'participant', 'payer'], name='splited_open_idx'),
+        ),
+    ]
@@ -0,0 +1,73 @@
+# Generated by Django 6.0 on 2026-10-18 21:20
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def baseline_snapshots(apps, schema_editor):
+    """
+    Historia zaczyna się od bieżącego stanu ledgera – snapshot bazowy (last_event_id = 0) dla każdego tripu.
+    """
+    Trip = apps.get_model('tripAppBE', 'Trip')
+    BalanceLedger = apps.get_model('tripAppBE', 'BalanceLedger')
+    TripBalanceSnapshot = apps.get_model('tripAppBE', 'TripBalanceSnapshot')
+
+    balances = {}
+    rows = BalanceLedger.objects.order_by('trip_id', 'debtor_id', 'creditor_id', 'currency').values_list(
+        'trip_id', 'debtor_id', 'creditor_id', 'currency', 'amount', 'amount_main'
+    )
+    for trip_id, debtor_id, creditor_id, currency, amount, amount_main in rows:
+        balances.setdefault(trip_id, []).append([debtor_id, creditor_id, currency, str(amount), str(amount_main)])
+
+    now = timezone.now()
+    TripBalanceSnapshot.objects.bulk_create(
+        [
+            TripBalanceSnapshot(trip_id=trip_id, as_of=now, last_event_id=0, balances=balances.get(trip_id, []))
+            for trip_id in Trip.objects.values_list('trip_id', flat=True)
+        ],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tripAppBE', '0011_splited_trip_not_null'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CostEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('cost_added', 'Cost added'), ('cost_updated', 'Cost updated'), ('cost_deleted', 'Cost deleted'), ('split_deleted', 'Split deleted'), ('payment', 'Payment'), ('settlement', 'Settlement'), ('conversion', 'Conversion'), ('rebuild', 'Rebuild')], max_length=20)),
+                ('cost_id', models.IntegerField(null=True)),
+                ('currency', models.TextField(blank=True, default='', max_length=5)),
+                ('amount', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('amount_main', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('creditor', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='credit_events', to='tripAppBE.tripparticipant')),
+                ('debtor', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='debt_events', to='tripAppBE.tripparticipant')),
+                ('trip', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='events', to='tripAppBE.trip')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['trip', 'id'], name='cost_event_trip_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='TripBalanceSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('as_of', models.DateTimeField()),
+                ('last_event_id', models.BigIntegerField(default=0)),
+                ('balances', models.JSONField(default=list)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('trip', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='balance_snapshots', to='tripAppBE.trip')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['trip', 'as_of'], name='balance_snapshot_trip_idx')],
+            },
+        ),
+        migrations.RunPython(baseline_snapshots, migrations.RunPython.noop),
+    ]
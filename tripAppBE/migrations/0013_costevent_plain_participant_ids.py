@@ -0,0 +1,49 @@
+# Generated by Django 6.0 on 2026-10-18 22:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tripAppBE', '0012_costevent_tripbalancesnapshot'),
+    ]
+
+    operations = [
+        # FK → zwykła kolumna (ta sama debtor_id / creditor_id): usunięcie uczestnika nie kasuje zdarzeń
+        migrations.AlterField(
+            model_name='costevent',
+            name='debtor',
+            field=models.IntegerField(db_column='debtor_id', null=True),
+        ),
+        migrations.RenameField(
+            model_name='costevent',
+            old_name='debtor',
+            new_name='debtor_id',
+        ),
+        migrations.AlterField(
+            model_name='costevent',
+            name='debtor_id',
+            field=models.IntegerField(null=True),
+        ),
+        migrations.AlterField(
+            model_name='costevent',
+            name='creditor',
+            field=models.IntegerField(db_column='creditor_id', null=True),
+        ),
+        migrations.RenameField(
+            model_name='costevent',
+            old_name='creditor',
+            new_name='creditor_id',
+        ),
+        migrations.AlterField(
+            model_name='costevent',
+            name='creditor_id',
+            field=models.IntegerField(null=True),
+        ),
+        migrations.AlterField(
+            model_name='costevent',
+            name='kind',
+            field=models.CharField(choices=[('cost_added', 'Cost added'), ('cost_updated', 'Cost updated'), ('cost_deleted', 'Cost deleted'), ('split_deleted', 'Split deleted'), ('payment', 'Payment'), ('settlement', 'Settlement'), ('conversion', 'Conversion'), ('participant_removed', 'Participant removed'), ('rebuild', 'Rebuild')], max_length=20),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 6.0 on 2026-10-18 22:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tripAppBE', '0013_costevent_plain_participant_ids'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='currencychangejob',
+            name='runner',
+            field=models.CharField(blank=True, default='', max_length=32),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 6.0 on 2026-10-18 23:10
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tripAppBE', '0014_currencychangejob_runner'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='splited',
+            index=models.Index(fields=['participant', 'trip'], name='splited_participant_trip_idx'),
+        ),
+        migrations.AlterField(
+            model_name='splited',
+            name='participant',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='splits', to='tripAppBE.tripparticipant'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 6.0 on 2026-10-18 23:40
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tripAppBE', '0015_splited_participant_trip_idx'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='splited',
+            index=models.Index(fields=['payer', 'trip'], name='splited_payer_trip_idx'),
+        ),
+        migrations.AlterField(
+            model_name='splited',
+            name='payer',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='payed_splits', to='tripAppBE.tripparticipant'),
+        ),
+    ]
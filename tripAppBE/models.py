@@ -11,6 +11,8 @@ class Trip(models.Model):
     description = models.TextField(max_length=30)
     created_at = models.DateTimeField(auto_now_add=True)
     default_currency = models.TextField(max_length=5)
+    # podbijane przy każdej zmianie kosztów/spłat – klucz cache podsumowań
+    version = models.PositiveIntegerField(default=0)
 
 
 class Cost(models.Model):
@@ -22,7 +24,21 @@ class Cost(models.Model):
     payment = models.BooleanField(default=False)
     description = models.TextField(max_length=250)
     payed_currency = models.TextField(max_length=5)
-    overall_value_main_currency = models.DecimalField(max_digits=10, decimal_places=2)
+    overall_value_main_currency = models.DecimalField(max_digits=10, decimal_places=2, null=True)
+    rate_date = models.DateField(null=True, blank=True)
+    conversion_pending = models.BooleanField(default=False)
+
+    class Meta:
+        indexes = [
+            # lista kosztów tripu: ORDER BY created_at DESC, cost_id DESC + keyset
+            models.Index(fields=["trip", "created_at", "cost_id"], name="cost_trip_created_idx"),
+            # reconcile_pending_conversions: tylko koszty czekające na kurs
+            models.Index(
+                fields=["payed_currency", "rate_date"],
+                condition=Q(conversion_pending=True),
+                name="cost_conversion_pending_idx"
+            ),
+        ]
 
 
 class TripParticipant(models.Model):
@@ -53,8 +69,12 @@ class TripParticipant(models.Model):
         return self.user is None
 
 class Splited(models.Model):
-    participant = models.ForeignKey(TripParticipant,  on_delete=models.CASCADE,  related_name="splits")
-    payer = models.ForeignKey(TripParticipant, on_delete=models.CASCADE, related_name="payed_splits")
+    # zdenormalizowane z cost.trip – filtry po tripie bez JOIN-a (i klucz partycjonowania)
+    trip = models.ForeignKey(Trip, on_delete=models.CASCADE, related_name="splits")
+    # indeks: splited_participant_trip_idx (prefiks participant zastępuje indeks FK)
+    participant = models.ForeignKey(TripParticipant,  on_delete=models.CASCADE,  related_name="splits", db_index=False)
+    # indeks: splited_payer_trip_idx
+    payer = models.ForeignKey(TripParticipant, on_delete=models.CASCADE, related_name="payed_splits", db_index=False)
     cost = models.ForeignKey(Cost, on_delete=models.CASCADE)
     payment = models.BooleanField(default=False)
     split_value = models.DecimalField(max_digits=10, decimal_places=2)
@@ -64,6 +84,157 @@ class Splited(models.Model):
     split_value_main_current = models.DecimalField(max_digits=10, decimal_places=2, null=True)
     to_pay_back_value_main_current = models.DecimalField(max_digits=10, decimal_places=2, null=True)
     pay_back_value_main_current = models.DecimalField(max_digits=10, decimal_places=2, null=True)
-    rate = models.DecimalField(max_digits=10, decimal_places=2)
+    rate = models.DecimalField(max_digits=10, decimal_places=2, null=True)
+
+    class Meta:
+        indexes = [
+            # podsumowanie uczestnika: bez niego planer wybiera indeks FK trip i czyta cały trip
+            models.Index(fields=["participant", "trip"], name="splited_participant_trip_idx"),
+            # koszty płacone przez uczestnika (strona kosztów) – jak wyżej, bez odczytu całego tripu
+            models.Index(fields=["payer", "trip"], name="splited_payer_trip_idx"),
+            # spłata / usunięcie splitu uczestnika, EXISTS w liście kosztów
+            models.Index(fields=["cost", "participant"], name="splited_cost_participant_idx"),
+            # rozliczenie pary uczestników
+            models.Index(fields=["payer", "participant", "payment"], name="splited_payer_participant_idx"),
+            # ledger / bilanse / przelewy: tylko otwarte splity tripu
+            models.Index(
+                fields=["trip", "participant", "payer"],
+                condition=Q(payment=False),
+                name="splited_open_idx"
+            ),
+        ]
+
+
+class Payment(models.Model):
+    split = models.ForeignKey(Splited, on_delete=models.CASCADE, related_name="payments")
+    amount = models.DecimalField(max_digits=10, decimal_places=2)
+    amount_main = models.DecimalField(max_digits=10, decimal_places=2, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+
+class CurrencyRate(models.Model):
+    base_currency = models.CharField(max_length=5)
+    rate_date = models.DateField()
+    rates = models.JSONField()
+    fetched_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["base_currency", "rate_date"],
+                name="unique_rate_per_base_and_date"
+            )
+        ]
+
 
+class BalanceLedger(models.Model):
+    trip = models.ForeignKey(Trip, on_delete=models.CASCADE, related_name="ledger")
+    debtor = models.ForeignKey(TripParticipant, on_delete=models.CASCADE, related_name="debts")
+    creditor = models.ForeignKey(TripParticipant, on_delete=models.CASCADE, related_name="credits")
+    currency = models.TextField(max_length=5)
+    amount = models.DecimalField(max_digits=12, decimal_places=2)
+    amount_main = models.DecimalField(max_digits=12, decimal_places=2)
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["trip", "debtor", "creditor", "currency"],
+                name="unique_ledger_pair_per_currency"
+            )
+        ]
+        indexes = [
+            models.Index(fields=["trip", "creditor"], name="ledger_trip_creditor_idx"),
+        ]
+
+
+class CurrencyChangeJob(models.Model):
+    PENDING = "pending"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+    STATUS_CHOICES = [
+        (PENDING, "Pending"),
+        (RUNNING, "Running"),
+        (DONE, "Done"),
+        (FAILED, "Failed"),
+    ]
+
+    trip = models.ForeignKey(Trip, on_delete=models.CASCADE, related_name="currency_jobs")
+    from_currency = models.TextField(max_length=5)
+    to_currency = models.TextField(max_length=5)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    # token wykonawcy, który przejął job (tylko on zapisuje postęp)
+    runner = models.CharField(max_length=32, blank=True, default="")
+    # kursor chunków: koszty o cost_id <= last_cost_id są już przeliczone
+    last_cost_id = models.IntegerField(default=0)
+    total_costs = models.IntegerField(default=0)
+    converted_costs = models.IntegerField(default=0)
+    error = models.TextField(blank=True, default="")
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["trip"],
+                condition=Q(status__in=["pending", "running"]),
+                name="one_active_currency_job_per_trip"
+            )
+        ]
+
+
+# dziennik zmian (tylko INSERT): delta wiersza ledgera zapisywana w transakcji mutacji;
+# zdarzenie bez pary (debtor NULL) = zmiana kosztu bez wpływu na bilans
+class CostEvent(models.Model):
+    COST_ADDED = "cost_added"
+    COST_UPDATED = "cost_updated"
+    COST_DELETED = "cost_deleted"
+    SPLIT_DELETED = "split_deleted"
+    PAYMENT = "payment"
+    SETTLEMENT = "settlement"
+    CONVERSION = "conversion"
+    PARTICIPANT_REMOVED = "participant_removed"
+    REBUILD = "rebuild"
+    KIND_CHOICES = [
+        (COST_ADDED, "Cost added"),
+        (COST_UPDATED, "Cost updated"),
+        (COST_DELETED, "Cost deleted"),
+        (SPLIT_DELETED, "Split deleted"),
+        (PAYMENT, "Payment"),
+        (SETTLEMENT, "Settlement"),
+        (CONVERSION, "Conversion"),
+        (PARTICIPANT_REMOVED, "Participant removed"),
+        (REBUILD, "Rebuild"),
+    ]
+
+    trip = models.ForeignKey(Trip, on_delete=models.CASCADE, related_name="events")
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    # bez FK – historia zostaje po usunięciu kosztu / uczestnika
+    cost_id = models.IntegerField(null=True)
+    debtor_id = models.IntegerField(null=True)
+    creditor_id = models.IntegerField(null=True)
+    currency = models.TextField(max_length=5, blank=True, default="")
+    amount = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    amount_main = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            # ogon zdarzeń po snapshocie
+            models.Index(fields=["trip", "id"], name="cost_event_trip_idx"),
+        ]
+
+
+class TripBalanceSnapshot(models.Model):
+    trip = models.ForeignKey(Trip, on_delete=models.CASCADE, related_name="balance_snapshots")
+    # stan ledgera na chwilę as_of = wszystkie zdarzenia tripu o id <= last_event_id
+    as_of = models.DateTimeField()
+    last_event_id = models.BigIntegerField(default=0)
+    # [[debtor_id, creditor_id, currency, amount, amount_main], ...] – kwoty jako tekst
+    balances = models.JSONField(default=list)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["trip", "as_of"], name="balance_snapshot_trip_idx"),
+        ]
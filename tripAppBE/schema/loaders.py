@@ -0,0 +1,80 @@
+from collections import defaultdict
+
+from django.contrib.auth.models import User
+
+from tripAppBE.models import TripParticipant
+
+
+class DataLoader:
+    """
+    Batch loader na czas jednego requestu (wykonanie synchroniczne).
+    Klucze zgłoszone przez want() ładują się jednym zapytaniem przy pierwszym load(),
+    wyniki zostają w cache do końca requestu.
+    """
+
+    def __init__(self, batch_load_fn, default=None):
+        self.batch_load_fn = batch_load_fn
+        self.default = default
+        self._cache = {}
+        self._queue = set()
+
+    def want(self, keys):
+        self._queue.update(key for key in keys if key not in self._cache)
+
+    def prime(self, key, value):
+        self._cache.setdefault(key, value)
+        self._queue.discard(key)
+
+    def load(self, key):
+        if key not in self._cache:
+            self._queue.add(key)
+            self._dispatch()
+        return self._cache[key]
+
+    def load_many(self, keys):
+        keys = list(keys)
+        self.want(keys)
+        return [self.load(key) for key in keys]
+
+    def _dispatch(self):
+        keys, self._queue = self._queue, set()
+        loaded = self.batch_load_fn(keys)
+        for key in keys:
+            self._cache[key] = loaded.get(key, self.default() if callable(self.default) else self.default)
+
+
+class Loaders:
+    """
+    Loadery jednego requestu (GraphQL context.loaders).
+    """
+
+    def __init__(self):
+        self.users = DataLoader(self._load_users)
+        self.participants_by_trip = DataLoader(self._load_participants, default=list)
+
+    def _load_users(self, user_ids):
+        return User.objects.only("id", "username").in_bulk(user_ids)
+
+    def _load_participants(self, trip_ids):
+        participants = defaultdict(list)
+        for participant in TripParticipant.objects.filter(trip_id__in=trip_ids).order_by("id"):
+            participants[participant.trip_id].append(participant)
+
+        # użytkownicy wszystkich załadowanych uczestników – jedno zapytanie przy pierwszym resolve_user
+        self.users.want(
+            participant.user_id
+            for trip_participants in participants.values()
+            for participant in trip_participants
+            if participant.user_id is not None
+        )
+        return participants
+
+
+def get_loaders(info):
+    """
+    Loadery z kontekstu requestu; tworzy je, gdy schema wykonywana jest poza widokiem.
+    """
+    loaders = getattr(info.context, "loaders", None)
+    if loaders is None:
+        loaders = info.context.loaders = Loaders()
+    return loaders
@@ -1,16 +1,22 @@
 import graphene
 from graphql import GraphQLError
 
-from tripAppBE.schema.types.cost_type import SplitInput
+from tripAppBE.schema.types.cost_type import SplitInput, CostInput, CreateCostResultType, PaymentInput, \
+    PaymentResultType, SplitStrategy, SplitParticipantInput
 from tripAppBE.services.cost_service import (
     add_cost,
+    add_costs,
     update_cost,
     update_payment,
+    update_payments,
+    record_payment,
     delete_cost,
     delete_split_by_user,
-    fully_settlement_with_participant
+    fully_settlement_with_participant,
+    settle_trip
 )
-from tripAppBE.models import TripParticipant
+from tripAppBE.services.split_service import compute_splits
+from tripAppBE.models import TripParticipant, Trip
 
 
 # --- Helper to get current participant in a trip ---
@@ -31,13 +37,26 @@ class CreateCost(graphene.Mutation):
         value = graphene.Decimal(required=True)
         currency = graphene.String(required=True)
         description = graphene.String(required=False)
-        split_object_list = graphene.List(SplitInput, required=True)
+        split_object_list = graphene.List(SplitInput, required=False)
+        date = graphene.Date(required=False)
+        # podział liczony na serwerze zamiast split_object_list
+        split_strategy = SplitStrategy(required=False)
+        split_participants = graphene.List(graphene.NonNull(SplitParticipantInput), required=False)
 
     ok = graphene.Boolean(required=True)
     message = graphene.String(required=True)
-    cost_id = graphene.ID(required=True)
+    cost_id = graphene.ID()
+
+    def mutate(self, info, title, payer_id, trip_id, value, currency, split_object_list=None, description="",
+               date=None, split_strategy=None, split_participants=None):
+        if split_strategy is not None:
+            try:
+                split_object_list = compute_splits(trip_id, split_strategy.value, value, split_participants)
+            except ValueError as e:
+                return CreateCost(ok=False, message=str(e), cost_id=None)
+        elif not split_object_list:
+            return CreateCost(ok=False, message="Provide split_object_list or split_strategy", cost_id=None)
 
-    def mutate(self, info, title, payer_id, trip_id, value, currency, split_object_list, description=""):
         result = add_cost(
             trip_id=trip_id,
             title=title,
@@ -45,7 +64,8 @@ class CreateCost(graphene.Mutation):
             overall_value=value,
             split_object_list=split_object_list,
             currency=currency,
-            description=description
+            description=description,
+            rate_date=date
         )
         return CreateCost(
             ok=result["ok"],
@@ -54,6 +74,31 @@ class CreateCost(graphene.Mutation):
         )
 
 
+class CreateCosts(graphene.Mutation):
+    class Arguments:
+        trip_id = graphene.ID(required=True)
+        costs = graphene.List(graphene.NonNull(CostInput), required=True)
+
+    ok = graphene.Boolean(required=True)
+    message = graphene.String(required=True)
+    results = graphene.List(CreateCostResultType, required=True)
+
+    def mutate(self, info, trip_id, costs):
+        result = add_costs(trip_id, costs)
+        return CreateCosts(
+            ok=result["ok"],
+            message=result["message"],
+            results=[
+                CreateCostResultType(
+                    ok=item["ok"],
+                    message=item["message"],
+                    cost_id=item["cost"].cost_id if item["ok"] else None
+                )
+                for item in result["results"]
+            ]
+        )
+
+
 class UpdateCost(graphene.Mutation):
     class Arguments:
         cost_id = graphene.ID(required=True)
@@ -92,6 +137,46 @@ class UpdatePayment(graphene.Mutation):
         return UpdatePayment(ok=result["ok"], message=result["message"])
 
 
+class UpdatePayments(graphene.Mutation):
+    class Arguments:
+        payments = graphene.List(graphene.NonNull(PaymentInput), required=True)
+
+    ok = graphene.Boolean(required=True)
+    message = graphene.String(required=True)
+    results = graphene.List(PaymentResultType, required=True)
+
+    def mutate(self, info, payments):
+        result = update_payments(payments)
+        return UpdatePayments(
+            ok=result["ok"],
+            message=result["message"],
+            results=[
+                PaymentResultType(
+                    ok=item["ok"],
+                    message=item["message"],
+                    cost_id=payment.cost_id,
+                    participant_id=payment.participant_id
+                )
+                for payment, item in zip(payments, result["results"])
+            ]
+        )
+
+
+class RecordPayment(graphene.Mutation):
+    class Arguments:
+        cost_id = graphene.ID(required=True)
+        participant_id = graphene.ID(required=True)
+        amount = graphene.Decimal(required=True)
+        currency = graphene.String(required=True)
+
+    ok = graphene.Boolean(required=True)
+    message = graphene.String(required=True)
+
+    def mutate(self, info, cost_id, participant_id, amount, currency):
+        result = record_payment(cost_id, participant_id, amount, currency)
+        return RecordPayment(ok=result["ok"], message=result["message"])
+
+
 class DeleteCost(graphene.Mutation):
     class Arguments:
         cost_id = graphene.ID(required=True)
@@ -137,3 +222,19 @@ class FullySettlement(graphene.Mutation):
             currency=currency
         )
         return FullySettlement(ok=result["ok"], message=result["message"])
+
+
+class SettleTrip(graphene.Mutation):
+    class Arguments:
+        trip_id = graphene.ID(required=True)
+
+    ok = graphene.Boolean(required=True)
+    message = graphene.String(required=True)
+
+    def mutate(self, info, trip_id):
+        user = info.context.user
+        if not Trip.objects.filter(trip_id=trip_id, trip_owner=user).exists():
+            raise GraphQLError("Only the trip owner can settle the whole trip.")
+
+        result = settle_trip(trip_id)
+        return SettleTrip(ok=result["ok"], message=result["message"])
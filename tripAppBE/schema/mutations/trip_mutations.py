@@ -8,6 +8,9 @@ from tripAppBE.services.trip_service import (
     add_placeholder_to_trip,
     remove_user_from_participant_and_regenerate_code, remove_participant_from_trip,
 )
+from tripAppBE.services.currency_change_service import start_currency_change
+from tripAppBE.schema.types.trip_type import CurrencyChangeJobType
+from tripAppBE.models import Trip
 
 User = get_user_model()
 
@@ -103,3 +106,25 @@ class RemoveParticipant(graphene.Mutation):
     def mutate(self, info, trip_id, participant_id):
         result = remove_participant_from_trip(trip_id, participant_id)
         return RemoveParticipant(ok=result["ok"], message=result.get("message", "Error"))
+
+
+class ChangeTripCurrency(graphene.Mutation):
+    class Arguments:
+        trip_id = graphene.ID(required=True)
+        currency = graphene.String(required=True)
+
+    ok = graphene.Boolean(required=True)
+    message = graphene.String(required=True)
+    job = graphene.Field(CurrencyChangeJobType)
+
+    def mutate(self, info, trip_id, currency):
+        user = info.context.user
+        if not Trip.objects.filter(trip_id=trip_id, trip_owner=user).exists():
+            raise GraphQLError("Only the trip owner can change the trip currency.")
+
+        result = start_currency_change(trip_id, currency)
+        return ChangeTripCurrency(
+            ok=result["ok"],
+            message=result["message"],
+            job=CurrencyChangeJobType.from_job(result["job"]) if result["job"] else None
+        )
@@ -1,12 +1,18 @@
 import graphene
 
-from tripAppBE.schema.types.cost_type import CostType, SplitType, CostSumType, ParticipantPaybackType, \
-    SplitValueType, CurrencyType
+from tripAppBE.schema.types.cost_type import CostType, CostConnection, SplitType, CostSumType, ParticipantPaybackType, \
+    SplitValueType, CurrencyType, SuggestedTransferType, ParticipantBalanceType, LedgerEntryType
 from tripAppBE.services.cost_service import (
     get_all_cost_for_participant_per_trip,
+    get_costs_page,
+    encode_cost_cursor,
+    COSTS_PAGE_SIZE,
      get_cost_sum_for_participant_per_trip_bulk,
-    get_payback_participant_relation_per_trip_bulk
+    get_payback_participant_relation_per_trip_bulk,
+    get_trip_balances
 )
+from tripAppBE.services.ledger_service import get_ledger_as_of
+from tripAppBE.services.transfer_service import get_suggested_transfers
 from tripAppBE.models import TripParticipant, Splited
 from graphql import GraphQLError
 
@@ -14,7 +20,7 @@ from graphql import GraphQLError
 # --- Helper to get current participant in a trip ---
 def get_current_participant(user, trip_id):
     try:
-        return TripParticipant.objects.get(trip_id=trip_id, user=user)
+        return TripParticipant.objects.select_related("trip").get(trip_id=trip_id, user=user)
     except TripParticipant.DoesNotExist:
         raise GraphQLError("User is not a participant in this trip.")
 
@@ -30,7 +36,7 @@ class GetCostsSumPerTrip(graphene.ObjectType):
 
     def resolve_cost_sum(self, info, trip_id):
         participant = get_current_participant(info.context.user, trip_id)
-        result = get_cost_sum_for_participant_per_trip_bulk(participant, trip_id)
+        result = get_cost_sum_for_participant_per_trip_bulk(participant.id, trip_id, trip=participant.trip)
 
         overview = CurrencyType(
             currency=result["overviewSum"]["currency"],
@@ -59,6 +65,35 @@ class GetCostsPerTrip(graphene.ObjectType):
         participant = get_current_participant(info.context.user, trip_id)
         return get_all_cost_for_participant_per_trip(participant.id, trip_id)
 
+    costs_connection = graphene.Field(
+        CostConnection,
+        trip_id=graphene.ID(required=True),
+        first=graphene.Int(default_value=COSTS_PAGE_SIZE),
+        after=graphene.String(),
+        required=True
+    )
+
+    def resolve_costs_connection(self, info, trip_id, first=COSTS_PAGE_SIZE, after=None):
+        participant = get_current_participant(info.context.user, trip_id)
+        try:
+            page = get_costs_page(participant.id, trip_id, first=first, after=after)
+        except ValueError as e:
+            raise GraphQLError(str(e))
+
+        edges = [
+            CostConnection.Edge(node=cost, cursor=encode_cost_cursor(cost))
+            for cost in page["costs"]
+        ]
+        return CostConnection(
+            edges=edges,
+            page_info=graphene.relay.PageInfo(
+                has_next_page=page["has_next_page"],
+                has_previous_page=after is not None,
+                start_cursor=edges[0].cursor if edges else None,
+                end_cursor=edges[-1].cursor if edges else None,
+            )
+        )
+
 
 class GetSplitsInfo(graphene.ObjectType):
     splits = graphene.List(
@@ -133,3 +168,82 @@ class GetPayback(graphene.ObjectType):
                 )
             )
         return result
+
+
+class GetTripBalances(graphene.ObjectType):
+    trip_balances = graphene.List(
+        ParticipantBalanceType,
+        trip_id=graphene.ID(required=True),
+        required=True
+    )
+
+    def resolve_trip_balances(self, info, trip_id):
+        participant = get_current_participant(info.context.user, trip_id)
+
+        result = []
+        for balance in get_trip_balances(trip_id, trip=participant.trip):
+            currency = balance["trip_currency"]
+            result.append(
+                ParticipantBalanceType(
+                    participant_id=balance["participant"]["id"],
+                    nickname=balance["participant"]["nickname"],
+                    user_id=balance["participant"]["user_id"],
+                    spent=CurrencyType(currency=currency, value=balance["spent_main"]),
+                    paid=CurrencyType(currency=currency, value=balance["paid_main"]),
+                    owed=CurrencyType(currency=currency, value=balance["owed_main"]),
+                    spent_by_currency=[CurrencyType(currency=c, value=v) for c, v in balance["spent"].items()],
+                    paid_by_currency=[CurrencyType(currency=c, value=v) for c, v in balance["paid"].items()],
+                    owed_by_currency=[CurrencyType(currency=c, value=v) for c, v in balance["owed"].items()],
+                )
+            )
+        return result
+
+
+class GetLedgerAsOf(graphene.ObjectType):
+    ledger_as_of = graphene.List(
+        LedgerEntryType,
+        trip_id=graphene.ID(required=True),
+        at=graphene.DateTime(required=True),
+        required=True
+    )
+
+    def resolve_ledger_as_of(self, info, trip_id, at):
+        get_current_participant(info.context.user, trip_id)
+
+        try:
+            ledger = get_ledger_as_of(trip_id, at)
+        except ValueError as e:
+            raise GraphQLError(str(e))
+
+        nicknames = dict(TripParticipant.objects.filter(trip_id=trip_id).values_list("id", "nickname"))
+        return [
+            LedgerEntryType(
+                debtor_id=debtor_id,
+                debtor_nickname=nicknames.get(debtor_id),
+                creditor_id=creditor_id,
+                creditor_nickname=nicknames.get(creditor_id),
+                value=CurrencyType(currency=currency, value=amount),
+            )
+            for (debtor_id, creditor_id, currency), (amount, _) in sorted(ledger.items())
+        ]
+
+
+class GetSuggestedTransfers(graphene.ObjectType):
+    suggested_transfers = graphene.List(
+        SuggestedTransferType,
+        trip_id=graphene.ID(required=True),
+        required=True
+    )
+
+    def resolve_suggested_transfers(self, info, trip_id):
+        get_current_participant(info.context.user, trip_id)
+        return [
+            SuggestedTransferType(
+                from_participant_id=t["from"]["id"],
+                from_nickname=t["from"]["nickname"],
+                to_participant_id=t["to"]["id"],
+                to_nickname=t["to"]["nickname"],
+                value=CurrencyType(currency=t["currency"], value=t["value"])
+            )
+            for t in get_suggested_transfers(trip_id)
+        ]
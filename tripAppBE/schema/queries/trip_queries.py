@@ -1,7 +1,9 @@
 import graphene
 
-from tripAppBE.models import Trip
-from tripAppBE.schema.types.trip_type import TripType
+from tripAppBE.models import Trip, TripParticipant
+from tripAppBE.schema.loaders import get_loaders
+from tripAppBE.schema.types.trip_type import TripType, CurrencyChangeJobType
+from tripAppBE.services.currency_change_service import get_currency_change_job
 from tripAppBE.services.trip_service import get_trip_details, get_trip_list
 from graphql import GraphQLError
 
@@ -12,7 +14,10 @@ class GetTripList(graphene.ObjectType):
 
     def resolve_trip_list(self, info):
         user = info.context.user
-        return get_trip_list(user)
+        trips = list(get_trip_list(user))
+        # uczestnicy wszystkich tripów z listy – jedno zapytanie przy pierwszym resolve_participants
+        get_loaders(info).participants_by_trip.want(trip.trip_id for trip in trips)
+        return trips
 
     def resolve_trip(self, info, trip_id):
         user = info.context.user
@@ -21,3 +26,14 @@ class GetTripList(graphene.ObjectType):
             return get_trip_details(user, trip_id)
         except Trip.DoesNotExist:
             return None
+
+
+class GetCurrencyChangeJob(graphene.ObjectType):
+    currency_change_job = graphene.Field(CurrencyChangeJobType, trip_id=graphene.ID(required=True))
+
+    def resolve_currency_change_job(self, info, trip_id):
+        if not TripParticipant.objects.filter(trip_id=trip_id, user=info.context.user).exists():
+            raise GraphQLError("User is not a participant in this trip.")
+
+        job = get_currency_change_job(trip_id)
+        return CurrencyChangeJobType.from_job(job) if job else None
@@ -5,9 +5,10 @@ from tripAppBE.schema.mutations.cost_mutation import *
 from tripAppBE.schema.mutations.trip_mutations import *
 from tripAppBE.schema.queries.auth_queries import AuthQuery
 from tripAppBE.schema.queries.cost_queries import (
-    GetCostsPerTrip, GetCostsSumPerTrip, GetSplitsInfo, GetPayback
+    GetCostsPerTrip, GetCostsSumPerTrip, GetSplitsInfo, GetPayback, GetSuggestedTransfers, GetTripBalances,
+    GetLedgerAsOf
 )
-from tripAppBE.schema.queries.trip_queries import GetTripList
+from tripAppBE.schema.queries.trip_queries import GetTripList, GetCurrencyChangeJob
 
 
 class Mutation(graphene.ObjectType):
@@ -23,23 +24,32 @@ class Mutation(graphene.ObjectType):
     add_placeholder = AddPlaceholder.Field()
     remove_user_from_placeholder = RemoveUserFromPlaceholder.Field()
     remove_participant = RemoveParticipant.Field()
+    change_trip_currency = ChangeTripCurrency.Field()
 
     # ----- Cost -----
     create_cost = CreateCost.Field()
+    create_costs = CreateCosts.Field()
     update_cost = UpdateCost.Field()
     update_payment = UpdatePayment.Field()
+    update_payments = UpdatePayments.Field()
+    record_payment = RecordPayment.Field()
     delete_cost = DeleteCost.Field()
     delete_participant_splits = DeleteParticipantSplits.Field()
     fully_settlement = FullySettlement.Field()
+    settle_trip = SettleTrip.Field()
 
 
 class Query(
     AuthQuery,
     GetCostsPerTrip,
     GetPayback,
+    GetSuggestedTransfers,
+    GetTripBalances,
+    GetLedgerAsOf,
     GetCostsSumPerTrip,
     GetSplitsInfo,
     GetTripList,
+    GetCurrencyChangeJob,
     graphene.ObjectType
 ):
     pass
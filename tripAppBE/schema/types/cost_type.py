@@ -14,6 +14,12 @@ class CostType(graphene.ObjectType):
     payment = graphene.Boolean()
     payed_currency = graphene.String()
     description = graphene.String()
+    conversion_pending = graphene.Boolean()
+
+
+class CostConnection(graphene.relay.Connection):
+    class Meta:
+        node = CostType
 
 
 class SplitValueType(graphene.ObjectType):
@@ -51,6 +57,49 @@ class SplitInput(graphene.InputObjectType):
     split_value = graphene.Decimal(required=True)
 
 
+class SplitStrategy(graphene.Enum):
+    EQUAL = "equal"
+    SHARES = "shares"
+    PERCENT = "percent"
+    EXACT = "exact"
+
+
+class SplitParticipantInput(graphene.InputObjectType):
+    participant_id = graphene.ID(required=True)
+    # shares: waga, percent: procent, exact: kwota, equal: pomijane
+    share = graphene.Decimal(required=False)
+
+
+class CostInput(graphene.InputObjectType):
+    title = graphene.String(required=True)
+    payer_id = graphene.ID(required=True)
+    value = graphene.Decimal(required=True)
+    currency = graphene.String(required=True)
+    description = graphene.String(required=False)
+    split_object_list = graphene.List(graphene.NonNull(SplitInput), required=True)
+    date = graphene.Date(required=False)
+
+
+class PaymentInput(graphene.InputObjectType):
+    cost_id = graphene.ID(required=True)
+    participant_id = graphene.ID(required=True)
+    pay_back_value = graphene.Float(required=False)
+    currency = graphene.String(required=True)
+
+
+class CreateCostResultType(graphene.ObjectType):
+    ok = graphene.Boolean(required=True)
+    message = graphene.String(required=True)
+    cost_id = graphene.ID()
+
+
+class PaymentResultType(graphene.ObjectType):
+    ok = graphene.Boolean(required=True)
+    message = graphene.String(required=True)
+    cost_id = graphene.ID()
+    participant_id = graphene.ID()
+
+
 # -------------------- Payback / Balance Types --------------------
 
 class ParticipantPaybackType(graphene.ObjectType):
@@ -59,6 +108,34 @@ class ParticipantPaybackType(graphene.ObjectType):
     value_main = graphene.Field(CurrencyType)
     values_by_currency = graphene.List(CurrencyType)
 
+
+class ParticipantBalanceType(graphene.ObjectType):
+    participant_id = graphene.ID()
+    nickname = graphene.String()
+    user_id = graphene.ID()
+    spent = graphene.Field(CurrencyType)
+    paid = graphene.Field(CurrencyType)
+    owed = graphene.Field(CurrencyType)
+    spent_by_currency = graphene.List(CurrencyType)
+    paid_by_currency = graphene.List(CurrencyType)
+    owed_by_currency = graphene.List(CurrencyType)
+
+
+class LedgerEntryType(graphene.ObjectType):
+    debtor_id = graphene.ID()
+    debtor_nickname = graphene.String()
+    creditor_id = graphene.ID()
+    creditor_nickname = graphene.String()
+    value = graphene.Field(CurrencyType)
+
+
+class SuggestedTransferType(graphene.ObjectType):
+    from_participant_id = graphene.ID()
+    from_nickname = graphene.String()
+    to_participant_id = graphene.ID()
+    to_nickname = graphene.String()
+    value = graphene.Field(CurrencyType)
+
 # Resolver
 class GetPayback(graphene.ObjectType):
     payback_per_trip = graphene.List(
@@ -1,6 +1,7 @@
 import graphene
 from graphene_django import DjangoObjectType
 from tripAppBE.models import Trip, TripParticipant
+from tripAppBE.schema.loaders import get_loaders
 from tripAppBE.schema.types.user_type import UserType
 
 class ParticipantType(graphene.ObjectType):
@@ -9,6 +10,15 @@ class ParticipantType(graphene.ObjectType):
     nickname = graphene.String()
     joinCode = graphene.String()
 
+    # root: TripParticipant
+    def resolve_user(self, info):
+        if self.user_id is None:
+            return None
+        return get_loaders(info).users.load(self.user_id)
+
+    def resolve_joinCode(self, info):
+        return self.Join_code
+
 class TripType(DjangoObjectType):
     owner = graphene.Boolean()
     owner_id = graphene.ID()
@@ -25,12 +35,29 @@ class TripType(DjangoObjectType):
         return self.trip_owner_id
 
     def resolve_participants(self, info):
-        return [
-            ParticipantType(
-                id=p.id,
-                user=p.user,
-                nickname=p.nickname,
-                joinCode=p.Join_code
-            )
-            for p in self.participants.all()
-        ]
+        return get_loaders(info).participants_by_trip.load(self.trip_id)
+
+
+class CurrencyChangeJobType(graphene.ObjectType):
+    job_id = graphene.ID()
+    status = graphene.String()
+    from_currency = graphene.String()
+    to_currency = graphene.String()
+    total_costs = graphene.Int()
+    converted_costs = graphene.Int()
+    progress = graphene.Float()
+    error = graphene.String()
+
+    @staticmethod
+    def from_job(job):
+        progress = 1.0 if job.status == "done" else min(job.converted_costs / job.total_costs, 1.0) if job.total_costs else 0.0
+        return CurrencyChangeJobType(
+            job_id=job.id,
+            status=job.status,
+            from_currency=job.from_currency,
+            to_currency=job.to_currency,
+            total_costs=job.total_costs,
+            converted_costs=job.converted_costs,
+            progress=progress,
+            error=job.error,
+        )
@@ -1,50 +1,739 @@
+import hashlib
+import math
+import os
+import random
+import tempfile
+import threading
+import time
+from bisect import bisect_right
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import date, timedelta
 from decimal import Decimal, ROUND_HALF_UP
 
 import requests
+from requests.adapters import HTTPAdapter
+from django.conf import settings
+from django.db import connection, connections
+from django.utils import timezone
 
+from tripAppBE.models import CurrencyRate, Cost, Trip
+from tripAppBE.services.money import to_cents, from_cents, convert_cents
 
-def fetch_currency_rates(from_currency):
+
+# ======================================================
+# CONFIG
+# ======================================================
+
+DEFAULT_RATES_CONFIG = {
+    "BASE_CURRENCY": "usd",  # the one table the rate book derives every cross-rate from
+    "URL": "https://cdn.jsdelivr.net/npm/@fawazahmed0/currency-api@{version}/v1/currencies/{currency}.json",
+    "TTL_SECONDS": 24 * 60 * 60,  # how long fetched rates stay fresh (LRU and DB)
+    "LRU_MAX_ENTRIES": 64,  # base currencies kept in process memory
+    "DB_RETENTION_DAYS": None,  # None → stored rates are never deleted
+    "HISTORY_MAX_GAP_DAYS": 0,  # accept a stored table this many days older than the requested date
+    "LOCK_DIR": None,  # directory for cross-worker fetch locks (None → system temp dir)
+    "LOCK_TIMEOUT_SECONDS": 10,  # how long a fetch waits for the cross-worker lock
+    "REQUEST_TIMEOUT_SECONDS": 5,
+    "POOL_MAXSIZE": 10,  # keep-alive connections per host in the shared session
+    "RETRIES": 2,  # extra attempts after a failed request
+    "BACKOFF_SECONDS": 0.2,  # base of the exponential backoff (full jitter)
+    "BACKOFF_MAX_SECONDS": 2,
+    "BREAKER_FAILURE_THRESHOLD": 3,  # consecutive failed fetches that open the circuit
+    "BREAKER_RESET_SECONDS": 60,  # how long the circuit stays open before a trial fetch
+}
+
+
+def get_rates_config():
+    return {**DEFAULT_RATES_CONFIG, **getattr(settings, "CURRENCY_RATES", {})}
+
+
+# ======================================================
+# RATE CACHE (in-process LRU + CurrencyRate table)
+# ======================================================
+
+class RateCache:
     """
-    Fetch exchange rates for `from_currency` and return a flat dictionary
-    with 'date' and currency rates.
+    Two-tier cache for flat rate dictionaries keyed by base currency:
+    an in-process LRU in front of the CurrencyRate table.
+    """
+
+    def __init__(self):
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {
+            "lru_hits": 0,
+            "db_hits": 0,
+            "misses": 0,
+            "stale_hits": 0,
+            "fetch_seconds_total": 0.0,
+        }
+
+    # ----- stats -----
+
+    def record(self, counter, value=1):
+        with self._lock:
+            self._stats[counter] += value
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        fetches = stats["misses"]
+        avg_fetch = stats["fetch_seconds_total"] / fetches if fetches else 0.0
+        stats["avg_fetch_seconds"] = avg_fetch
+        stats["saved_seconds_estimate"] = avg_fetch * (stats["lru_hits"] + stats["db_hits"])
+        return stats
+
+    def reset(self):
+        with self._lock:
+            self._entries.clear()
+            for key in self._stats:
+                self._stats[key] = 0.0 if key == "fetch_seconds_total" else 0
+
+    # ----- LRU -----
+
+    def get_local(self, base_currency, allow_stale=False):
+        with self._lock:
+            entry = self._entries.get(base_currency)
+            if entry is None:
+                return None
+            expires_at, rates = entry
+            if time.time() > expires_at and not allow_stale:
+                return None
+            self._entries.move_to_end(base_currency)
+            return rates
+
+    def put_local(self, base_currency, rates, expires_at, max_entries):
+        with self._lock:
+            self._entries[base_currency] = (expires_at, rates)
+            self._entries.move_to_end(base_currency)
+            while len(self._entries) > max_entries:
+                self._entries.popitem(last=False)
+
+    # ----- DB -----
+
+    @staticmethod
+    def get_stored(base_currency, ttl):
+        """
+        Return (rates, expires_at) of the newest stored table if it was fetched
+        within `ttl`, otherwise (None, None).
+        """
+        row = CurrencyRate.objects.filter(base_currency=base_currency).order_by("-rate_date").first()
+        if row is None or row.fetched_at < timezone.now() - timedelta(seconds=ttl):
+            return None, None
+        rates = {"date": row.rate_date.isoformat(), **row.rates}
+        return rates, row.fetched_at.timestamp() + ttl
+
+    @staticmethod
+    def get_last_good(base_currency):
+        row = CurrencyRate.objects.filter(base_currency=base_currency).order_by("-rate_date").first()
+        if row is None:
+            return None
+        return {"date": row.rate_date.isoformat(), **row.rates}
+
+    @staticmethod
+    def get_on_or_before(base_currency, as_of):
+        """
+        Nearest stored table dated on or before `as_of` (index range scan on
+        the (base_currency, rate_date) unique constraint).
+        """
+        row = (
+            CurrencyRate.objects
+            .filter(base_currency=base_currency, rate_date__lte=as_of)
+            .order_by("-rate_date")
+            .first()
+        )
+        if row is None:
+            return None
+        return {"date": row.rate_date.isoformat(), **row.rates}
+
+    @staticmethod
+    def put_stored(base_currency, rates, retention_days):
+        rate_date = date.fromisoformat(rates["date"])
+        CurrencyRate.objects.update_or_create(
+            base_currency=base_currency,
+            rate_date=rate_date,
+            defaults={"rates": {k: v for k, v in rates.items() if k != "date"}},
+        )
+        if retention_days is not None:
+            CurrencyRate.objects.filter(
+                base_currency=base_currency,
+                rate_date__lt=rate_date - timedelta(days=retention_days),
+            ).delete()
+
+
+rate_cache = RateCache()
+
+
+def get_rate_cache_stats():
+    """
+    Hit/miss counters of the rate cache plus an estimate of the time saved
+    (average upstream fetch time × number of cache hits).
+    """
+    return rate_cache.stats()
+
+
+# ======================================================
+# FETCH
+# ======================================================
+
+class CircuitOpenError(Exception):
+    pass
+
+
+class CircuitBreaker:
+    """
+    Fail fast once the currency API is known to be down: after
+    `failure_threshold` consecutive failures the circuit opens for
+    `reset_seconds`, then a single trial request decides whether it closes.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._trial_running = False
+
+    def allow(self, reset_seconds):
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if time.monotonic() - self._opened_at < reset_seconds or self._trial_running:
+                return False
+            self._trial_running = True  # half-open: let exactly one request through
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_running = False
+
+    def record_failure(self, failure_threshold):
+        with self._lock:
+            self._failures += 1
+            self._trial_running = False
+            if self._opened_at is not None or self._failures >= failure_threshold:
+                self._opened_at = time.monotonic()
+
+    @property
+    def is_open(self):
+        return self._opened_at is not None
+
+    def reset(self):
+        self.record_success()
+
+
+circuit_breaker = CircuitBreaker()
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_http_session():
+    """
+    Module-level requests session, so calls to the currency API reuse
+    pooled keep-alive connections instead of a new TLS handshake each time.
+    """
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                pool_maxsize = get_rates_config()["POOL_MAXSIZE"]
+                session = requests.Session()
+                session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=pool_maxsize))
+                session.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=pool_maxsize))
+                _session = session
+    return _session
+
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+def _get_with_retries(url, config):
+    """
+    GET `url` with bounded retries and exponential backoff with full jitter.
+    Retries connection errors, timeouts, 429 and 5xx responses.
+    """
+    attempts = config["RETRIES"] + 1
+    for attempt in range(attempts):
+        last_attempt = attempt == attempts - 1
+        try:
+            response = get_http_session().get(url, timeout=config["REQUEST_TIMEOUT_SECONDS"])
+        except (requests.ConnectionError, requests.Timeout):
+            if last_attempt:
+                raise
+        else:
+            if response.status_code not in RETRY_STATUSES or last_attempt:
+                response.raise_for_status()
+                return response
+
+        backoff = min(config["BACKOFF_MAX_SECONDS"], config["BACKOFF_SECONDS"] * 2 ** attempt)
+        time.sleep(random.uniform(0, backoff))
+
+
+def _fetch_budget(config):
+    """
+    Worst case of _get_with_retries: every attempt runs into the request
+    timeout and every backoff sleeps its full cap.
+    """
+    attempts = config["RETRIES"] + 1
+    backoff = sum(
+        min(config["BACKOFF_MAX_SECONDS"], config["BACKOFF_SECONDS"] * 2 ** attempt)
+        for attempt in range(attempts - 1)
+    )
+    return attempts * config["REQUEST_TIMEOUT_SECONDS"] + backoff
+
+
+def _fetch_remote_rates(from_currency, as_of=None):
+    """
+    Fetch exchange rates for `from_currency` from the currency API and return
+    a flat dictionary with 'date' and currency rates. `as_of` selects a
+    historical table instead of @latest.
     """
-    url = f"https://cdn.jsdelivr.net/npm/@fawazahmed0/currency-api@latest/v1/currencies/{from_currency.lower()}.json"
+    config = get_rates_config()
+    if not circuit_breaker.allow(config["BREAKER_RESET_SECONDS"]):
+        raise CircuitOpenError("Currency API circuit is open")
+
     try:
-        response = requests.get(url, timeout=5)
-        response.raise_for_status()
+        version = as_of.isoformat() if as_of else "latest"
+        response = _get_with_retries(config["URL"].format(version=version, currency=from_currency), config)
         data = response.json()
+    except Exception:
+        circuit_breaker.record_failure(config["BREAKER_FAILURE_THRESHOLD"])
+        raise
+    circuit_breaker.record_success()
+
+    rate_date = data.get("date")
+    base_rates = next((v for k, v in data.items() if k != "date"), {})
+    return {"date": rate_date, **base_rates}
+
+
+# ======================================================
+# SINGLE-FLIGHT (one upstream fetch per base currency)
+# ======================================================
+
+class _InFlight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+_in_flight = {}
+_in_flight_lock = threading.Lock()
+
+
+def _wait_for(try_acquire, key, timeout):
+    deadline = time.monotonic() + timeout
+    while not try_acquire():
+        if time.monotonic() > deadline:
+            raise TimeoutError(f"Timed out waiting for rates lock '{key}'")
+        time.sleep(0.05)
 
-        rate_date = data.get("date")
-        base_rates = next((v for k, v in data.items() if k != "date"), {})
-        flat_rates = {"date": rate_date, **base_rates}
 
-        return flat_rates
+@contextmanager
+def _cross_process_lock(key, timeout):
+    """
+    Serialize fetches of `key` across gunicorn workers: a Postgres advisory
+    lock when available, otherwise an flock on a file in LOCK_DIR.
+    """
+    if connection.vendor == "postgresql":
+        lock_id = int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "big", signed=True)
+        with connection.cursor() as cursor:
+            def try_acquire():
+                cursor.execute("SELECT pg_try_advisory_lock(%s)", [lock_id])
+                return cursor.fetchone()[0]
+
+            _wait_for(try_acquire, key, timeout)
+            try:
+                yield
+            finally:
+                cursor.execute("SELECT pg_advisory_unlock(%s)", [lock_id])
+        return
+
+    import fcntl
+
+    lock_dir = get_rates_config()["LOCK_DIR"] or tempfile.gettempdir()
+    with open(os.path.join(lock_dir, f"tripappbe-rates-{key}.lock"), "a") as lock_file:
+        def try_acquire():
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return True
+            except BlockingIOError:
+                return False
+
+        _wait_for(try_acquire, key, timeout)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _single_flight(key, fn, timeout):
+    """
+    Run `fn` once per `key` at a time in this process; concurrent callers wait
+    up to `timeout` for the in-flight call and share its result, so `timeout`
+    must cover the leader's lock wait plus all of its retries.
+    """
+    with _in_flight_lock:
+        call = _in_flight.get(key)
+        leader = call is None
+        if leader:
+            call = _InFlight()
+            _in_flight[key] = call
 
+    if not leader:
+        if not call.done.wait(timeout):
+            raise TimeoutError(f"Timed out waiting for in-flight fetch '{key}'")
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+    try:
+        call.result = fn()
+        return call.result
+    except Exception as e:
+        call.error = e
+        raise
+    finally:
+        with _in_flight_lock:
+            del _in_flight[key]
+        call.done.set()
+
+
+def _load_rates(base_currency, config, refresh=False):
+    """
+    Leader path of fetch_currency_rates: take the cross-worker lock, re-check
+    the DB (another worker may have just stored the table) and only then
+    call the currency API.
+    """
+    ttl = config["TTL_SECONDS"]
+
+    with _cross_process_lock(base_currency, config["LOCK_TIMEOUT_SECONDS"]):
+        rates, expires_at = (None, None) if refresh else rate_cache.get_stored(base_currency, ttl)
+        if rates is not None:
+            rate_cache.record("db_hits")
+            rate_cache.put_local(base_currency, rates, expires_at, config["LRU_MAX_ENTRIES"])
+            return rates
+
+        rate_cache.record("misses")
+        started = time.monotonic()
+        try:
+            rates = _fetch_remote_rates(base_currency)
+        finally:
+            rate_cache.record("fetch_seconds_total", time.monotonic() - started)
+
+        if rates.get("date"):
+            rate_cache.put_stored(base_currency, rates, config["DB_RETENTION_DAYS"])
+            rate_cache.put_local(base_currency, rates, time.time() + ttl, config["LRU_MAX_ENTRIES"])
+
+        return rates
+
+
+def fetch_currency_rates(from_currency, refresh=False):
+    """
+    Fetch exchange rates for `from_currency` and return a flat dictionary
+    with 'date' and currency rates.
+
+    Rates are served from the in-process LRU, then from the CurrencyRate table,
+    and only when both are stale from the currency API. Concurrent misses for
+    the same currency share a single upstream request.
+    `refresh=True` skips both cache tiers (used by the prefetcher).
+    """
+    config = get_rates_config()
+    base_currency = from_currency.lower()
+
+    if not refresh:
+        rates = rate_cache.get_local(base_currency)
+        if rates is not None:
+            rate_cache.record("lru_hits")
+            return rates
+
+        rates, expires_at = rate_cache.get_stored(base_currency, config["TTL_SECONDS"])
+        if rates is not None:
+            rate_cache.record("db_hits")
+            rate_cache.put_local(base_currency, rates, expires_at, config["LRU_MAX_ENTRIES"])
+            return rates
+
+    try:
+        return _single_flight(
+            base_currency,
+            lambda: _load_rates(base_currency, config, refresh),
+            config["LOCK_TIMEOUT_SECONDS"] + _fetch_budget(config),
+        )
     except Exception as e:
         print(f"Error fetching rates for {from_currency}: {e}")
-        return {"date": None}  # fallback
 
+    # upstream unavailable → serve the last good rates, even past their TTL
+    rates = rate_cache.get_local(base_currency, allow_stale=True) or rate_cache.get_last_good(base_currency)
+    if rates is not None:
+        rate_cache.record("stale_hits")
+        return rates
+    return {"date": None}  # fallback
+
+
+# ======================================================
+# RATE BOOK (cross-rates from a single base table)
+# ======================================================
+
+class RateBook:
+    """
+    Exchange rates for every currency against one base currency.
+    Any `from → to` rate is derived locally as rate[to] / rate[from].
+    """
+
+    def __init__(self, base_currency, rates_dict):
+        self.base_currency = base_currency.lower()
+        self.date = rates_dict.get("date")
+        self._rates = rates_dict
+        self._decimals = {self.base_currency: Decimal(1)}
+
+    @property
+    def available(self):
+        """
+        False when the provider failed and no stored table could be served.
+        """
+        return self.date is not None
+
+    def _base_rate(self, currency):
+        code = currency.lower()
+        if code not in self._decimals:
+            raw = self._rates.get(code)
+            if raw is None:
+                raise ValueError(f"Currency '{currency}' not found in rates for '{self.base_currency}'")
+            self._decimals[code] = Decimal(str(raw))
+        return self._decimals[code]
+
+    def rate(self, from_currency, to_currency):
+        if from_currency.lower() == to_currency.lower():
+            return Decimal(1)
+        return self._base_rate(to_currency) / self._base_rate(from_currency)
+
+
+def get_rate_book(base_currency=None, as_of=None, history=None):
+    """
+    Rate book built from the cached base-currency table, so a trip with costs
+    in many currencies needs a single upstream fetch per day.
+
+    `as_of` picks the table valid on that date; with a preloaded `history`
+    the lookup is local unless no loaded table is within HISTORY_MAX_GAP_DAYS
+    (backfills, bulk imports).
+    """
+    base_currency = base_currency or get_rates_config()["BASE_CURRENCY"]
+    if history is not None:
+        return history.rate_book(as_of or timezone.localdate())
+    if as_of is not None:
+        return RateBook(base_currency, fetch_historical_rates(base_currency, as_of))
+    return RateBook(base_currency, fetch_currency_rates(base_currency))
+
+
+# ======================================================
+# RATE HISTORY (as-of-date lookups)
+# ======================================================
+
+def _load_historical_rates(base_currency, as_of, config):
+    with _cross_process_lock(f"{base_currency}-{as_of.isoformat()}", config["LOCK_TIMEOUT_SECONDS"]):
+        rates = rate_cache.get_on_or_before(base_currency, as_of)
+        if rates is not None and rates["date"] == as_of.isoformat():
+            rate_cache.record("db_hits")
+            return rates
+
+        rate_cache.record("misses")
+        started = time.monotonic()
+        try:
+            rates = _fetch_remote_rates(base_currency, as_of)
+        finally:
+            rate_cache.record("fetch_seconds_total", time.monotonic() - started)
+
+        if rates.get("date"):
+            rate_cache.put_stored(base_currency, rates, config["DB_RETENTION_DAYS"])
+        return rates
+
+
+def _within_gap(rates, as_of, max_gap_days):
+    """
+    True when `rates` is a table dated at most `max_gap_days` before `as_of`.
+    """
+    return rates.get("date") is not None and (as_of - date.fromisoformat(rates["date"])).days <= max_gap_days
+
+
+def fetch_historical_rates(from_currency, as_of):
+    """
+    Flat rates dictionary for `from_currency` valid on date `as_of`.
+
+    Uses the nearest stored table on or before `as_of` when it is at most
+    HISTORY_MAX_GAP_DAYS old, otherwise fetches that day's table once and
+    stores it. If the upstream fails, the nearest older table is used.
+    Historical tables never change, so they stay in the LRU until evicted.
+    """
+    config = get_rates_config()
+    base_currency = from_currency.lower()
+    if as_of >= timezone.localdate():
+        return fetch_currency_rates(base_currency)
+
+    key = f"{base_currency}@{as_of.isoformat()}"
+    rates = rate_cache.get_local(key)
+    if rates is not None:
+        rate_cache.record("lru_hits")
+        return rates
+
+    nearest = rate_cache.get_on_or_before(base_currency, as_of)
+    if nearest is not None and _within_gap(nearest, as_of, config["HISTORY_MAX_GAP_DAYS"]):
+        rate_cache.record("db_hits")
+        rate_cache.put_local(key, nearest, math.inf, config["LRU_MAX_ENTRIES"])
+        return nearest
+
+    try:
+        rates = _single_flight(
+            key,
+            lambda: _load_historical_rates(base_currency, as_of, config),
+            config["LOCK_TIMEOUT_SECONDS"] + _fetch_budget(config),
+        )
+        if rates.get("date"):
+            rate_cache.put_local(key, rates, math.inf, config["LRU_MAX_ENTRIES"])
+            return rates
+    except Exception as e:
+        print(f"Error fetching rates for {from_currency} on {as_of}: {e}")
+
+    if nearest is not None:
+        rate_cache.record("stale_hits")
+        return nearest
+    return {"date": None}  # fallback
+
+
+class RateHistory:
+    """
+    Date-sorted rate tables of one base currency loaded with a single query.
+    `rates_on(d)` bisects for the nearest table on or before `d`, so bulk
+    conversions of historical costs need no per-cost query or network call
+    as long as that table is within HISTORY_MAX_GAP_DAYS.
+    """
+
+    def __init__(self, base_currency, rows):
+        self.base_currency = base_currency.lower()
+        self.max_gap_days = get_rates_config()["HISTORY_MAX_GAP_DAYS"]
+        self._dates = [rate_date for rate_date, _ in rows]
+        self._tables = [rates for _, rates in rows]
+
+    @classmethod
+    def load(cls, base_currency=None, start=None, end=None, currencies=None):
+        """
+        Tables between `start` and `end`; with `currencies` each table keeps
+        only those codes (and the base), so a bulk job holds no unused rates.
+        """
+        base_currency = (base_currency or get_rates_config()["BASE_CURRENCY"]).lower()
+        qs = CurrencyRate.objects.filter(base_currency=base_currency)
+        if start is not None:
+            # the nearest table before `start` is needed for dates right after it
+            previous = qs.filter(rate_date__lt=start).order_by("-rate_date").values_list("rate_date", flat=True)[:1]
+            qs = qs.filter(rate_date__gte=previous[0]) if previous else qs.filter(rate_date__gte=start)
+        if end is not None:
+            qs = qs.filter(rate_date__lte=end)
+        rows = qs.order_by("rate_date").values_list("rate_date", "rates")
+        if currencies is not None:
+            codes = {code.lower() for code in currencies} | {base_currency}
+            rows = ((rate_date, {code: rates[code] for code in codes if code in rates}) for rate_date, rates in rows)
+        return cls(base_currency, list(rows))
+
+    def __len__(self):
+        return len(self._dates)
+
+    def rates_on(self, as_of):
+        """
+        Nearest loaded table on or before `as_of`; {"date": None} when there is
+        none or it is older than HISTORY_MAX_GAP_DAYS (same rule as fetch_historical_rates).
+        """
+        idx = bisect_right(self._dates, as_of) - 1
+        if idx < 0 or (as_of - self._dates[idx]).days > self.max_gap_days:
+            return {"date": None}
+        return {"date": self._dates[idx].isoformat(), **self._tables[idx]}
+
+    def rate_book(self, as_of):
+        """
+        Rate book for `as_of` from the loaded tables. Dates the history does not
+        cover are fetched once; when that fails too the book is unavailable
+        (the cost is stored pending) rather than built from a table past the gap.
+        """
+        rates = self.rates_on(as_of)
+        if rates["date"] is None:
+            rates = fetch_historical_rates(self.base_currency, as_of)
+            # today's table comes from fetch_currency_rates and is dated by the provider
+            if as_of < timezone.localdate() and not _within_gap(rates, as_of, self.max_gap_days):
+                rates = {"date": None}
+        return RateBook(self.base_currency, rates)
+
+
+# ======================================================
+# PREFETCH
+# ======================================================
+
+def get_currencies_in_use():
+    """
+    Distinct currencies of existing costs and trips (lowercase).
+    """
+    codes = set(Cost.objects.values_list("payed_currency", flat=True).distinct())
+    codes |= set(Trip.objects.values_list("default_currency", flat=True).distinct())
+    return sorted({code.lower() for code in codes if code})
+
+
+def _warm(base_currency, as_of, refresh):
+    try:
+        if as_of is None:
+            return fetch_currency_rates(base_currency, refresh=refresh)
+        return fetch_historical_rates(base_currency, as_of)
+    finally:
+        connections.close_all()  # each pool thread has its own DB connection
+
+
+def prefetch_rates(bases=None, max_workers=4, refresh=True, days=0):
+    """
+    Warm the rate store for `bases` (default: the rate book base) on a bounded
+    thread pool and report which in-use currencies the warmed tables cover.
+    `days` additionally backfills the history for that many past days.
+    Returns {base: {"date": ..., "missing": [...], "history": {"stored": n, "failed": n}}}.
+    """
+    bases = [b.lower() for b in (bases or [get_rates_config()["BASE_CURRENCY"]])]
+    in_use = get_currencies_in_use()
+    today = timezone.localdate()
+    tasks = [(base, None) for base in bases]
+    tasks += [(base, today - timedelta(days=i)) for base in bases for i in range(1, days + 1)]
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        results = list(pool.map(lambda task: (task, _warm(task[0], task[1], refresh)), tasks))
+
+    report = {base: {"date": None, "missing": [], "history": {"stored": 0, "failed": 0}} for base in bases}
+    for (base, as_of), rates in results:
+        if as_of is not None:
+            stored = rates.get("date") == as_of.isoformat()  # not the older fallback table
+            report[base]["history"]["stored" if stored else "failed"] += 1
+            continue
+        report[base]["date"] = rates.get("date")
+        report[base]["missing"] = [code for code in in_use if code != base and code not in rates]
+    return report
+
+
+# ======================================================
+# CONVERSION
+# ======================================================
 
-def convert_currency(value, from_currency, to_currency, rates_dict):
+def convert_currency(value, from_currency, to_currency, rate_book):
     """
-    Convert `value` from `from_currency` to `to_currency` using `rates_dict`.
+    Convert `value` from `from_currency` to `to_currency` using `rate_book`.
     """
-    rate = rates_dict.get(to_currency.lower())
-    if rate is None:
-        raise ValueError(f"Currency '{to_currency}' not found in rates for '{from_currency}'")
-    converted_value = (value * Decimal(rate)).quantize(Decimal("0.01"), rounding=ROUND_HALF_UP)
-    return converted_value
+    rate = rate_book.rate(from_currency, to_currency)
+    return from_cents(convert_cents(to_cents(value), rate))
 
 
-def update_description(description, value, calculated_value, from_currency, to_currency, rates_dict):
+def update_description(description, value, calculated_value, from_currency, to_currency, rate_book):
     """
     Append conversion info to description if provided.
     """
     if description:
-        rate = rates_dict.get(to_currency.lower())
-        rate_date = rates_dict.get("date")
+        rate = rate_book.rate(from_currency, to_currency).quantize(Decimal("0.000001"), rounding=ROUND_HALF_UP)
         return (
             f"{description} | Automatic conversion of {value} {from_currency} "
-            f"to {calculated_value} {to_currency} at rate {rate} (date: {rate_date})"
+            f"to {calculated_value} {to_currency} at rate {rate} (date: {rate_book.date})"
         )
-        return description
\ No newline at end of file
+    return description
@@ -1,13 +1,27 @@
+import binascii
+import logging
+from collections import defaultdict
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from datetime import datetime
 from decimal import Decimal, ROUND_HALF_UP
+from functools import partial, reduce
+from operator import or_
 
+from django.core.cache import cache
 from django.db import transaction
-from django.db.models import Q, Sum, F, Case, When, Value, BooleanField, ExpressionWrapper, DecimalField
+from django.db.models import Q, Sum, F, Case, When, Value, BooleanField, ExpressionWrapper, DecimalField, Exists, \
+    OuterRef
 from django.db.models.functions import Round
 
-from tripAppBE.models import Cost, Splited, Trip
-from tripAppBE.services.convert_currency_service import fetch_currency_rates, \
+from tripAppBE.models import Cost, CostEvent, Splited, Trip, Payment, TripParticipant
+from tripAppBE.services.convert_currency_service import get_rate_book, \
     update_description, convert_currency
 from tripAppBE.services.dto.cost_dto import SplitDTO
+from tripAppBE.services.money import to_cents, from_cents, convert_cents
+from tripAppBE.services.ledger_service import ledger_pairs, refresh_ledger, rebuild_ledger, get_participant_ledger, \
+    shift_ledger, prune_ledger, record_event, _lock_trips
+
+logger = logging.getLogger(__name__)
 
 
 def calculate_split_values(obj, is_payer, payment_flag):
@@ -39,23 +53,24 @@ def calculate_split_values(obj, is_payer, payment_flag):
 # ======================================================
 
 
-def add_cost(
-    trip_id,
+def _build_cost(
+    trip,
     title,
     payer_participant_id,
     overall_value,
     split_object_list,
     currency,
     description,
+    rate_date,
+    rate_books,
+    rate_history=None,
 ):
     """
-    Dodaje koszt + splity (bulk)
+    Buduje niezapisany Cost + listę Splited (bez cost_id).
+    rate_books: {rate_date: RateBook} współdzielone między kosztami jednego batcha
+    rate_history: RateHistory → kursy historyczne bez zapytań per data
     """
 
-    trip = Trip.objects.filter(trip_id=trip_id).first()
-    if not trip:
-        return {"ok": False, "message": "Trip not found"}
-
     # ===== KONWERSJA Graphene Input → DTO =====
     split_dtos = [
         SplitDTO(
@@ -68,21 +83,37 @@ def add_cost(
     # ===== DOMYŚLNE WARTOŚCI (waluta główna) =====
     overall_value_main_currency = overall_value
     rate = 1.0
+    conversion_pending = False
 
     for obj in split_dtos:
         obj.split_value_main_current = obj.split_value
 
     # ===== PRZELICZANIE WALUT =====
+    rate_book = None
     if currency != trip.default_currency:
-        rate_dict = fetch_currency_rates(currency)
-        rate = rate_dict.get(trip.default_currency.lower())
+        if rate_date not in rate_books:
+            history = rate_history if rate_date is not None else None
+            rate_books[rate_date] = get_rate_book(as_of=rate_date, history=history)
+        rate_book = rate_books[rate_date]
+
+    if rate_book is not None and not rate_book.available:
+        # kursy niedostępne → zapis bez wartości w walucie głównej, uzupełni je reconcile_pending_conversions
+        conversion_pending = True
+        overall_value_main_currency = None
+        rate = None
+        for obj in split_dtos:
+            obj.split_value_main_current = None
+
+    elif rate_book is not None:
+        rate = rate_book.rate(currency, trip.default_currency)
 
-        overall_value_main_currency = convert_currency( overall_value, currency, trip.default_currency, rate_dict)
+        overall_value_main_currency = convert_currency( overall_value, currency, trip.default_currency, rate_book)
 
-        description = update_description(description, overall_value, overall_value_main_currency, currency, trip.default_currency, rate_dict)
+        description = update_description(description, overall_value, overall_value_main_currency, currency, trip.default_currency, rate_book)
 
+        # kurs liczony raz, splity przeliczane na groszach
         for obj in split_dtos:
-            obj.split_value_main_current = convert_currency(obj.split_value, currency, trip.default_currency, rate_dict)
+            obj.split_value_main_current = from_cents(convert_cents(to_cents(obj.split_value), rate))
 
     # ===== FLAGA PŁATNOŚCI =====
     payment_flag = (
@@ -90,40 +121,160 @@ def add_cost(
         and str(split_object_list[0].participant_id) == str(payer_participant_id)
     )
 
-    # ===== ZAPIS DO BAZY =====
-    with transaction.atomic():
-        cost = Cost.objects.create(
-            trip=trip, cost_name=title, overall_value=overall_value,
-            overall_value_main_currency=overall_value_main_currency, payed_currency=currency,
-            payment=payment_flag, description=description,
-        )
+    cost = Cost(
+        trip=trip, cost_name=title, overall_value=overall_value,
+        overall_value_main_currency=overall_value_main_currency, payed_currency=currency,
+        payment=payment_flag, description=description,
+        rate_date=rate_date, conversion_pending=conversion_pending,
+    )
 
-        splits = []
+    splits = []
 
-        for obj in split_dtos:
-            is_payer = str(payer_participant_id) == str(obj.participant_id)
-            values = calculate_split_values(obj, is_payer, payment_flag)
-
-            splits.append(
-                Splited(
-                    cost_id=cost.cost_id, participant_id=obj.participant_id,
-                    payer_id=payer_participant_id, payment=is_payer,
-                    split_value=obj.split_value, split_value_main_current=obj.split_value_main_current,
-                    rate=rate,
-                    **values
-                )
+    for obj in split_dtos:
+        is_payer = str(payer_participant_id) == str(obj.participant_id)
+        values = calculate_split_values(obj, is_payer, payment_flag)
+
+        splits.append(
+            Splited(
+                trip=trip, participant_id=obj.participant_id,
+                payer_id=payer_participant_id, payment=is_payer,
+                split_value=obj.split_value, split_value_main_current=obj.split_value_main_current,
+                rate=rate,
+                **values
             )
+        )
+
+    return cost, splits
+
+
+def add_cost(
+    trip_id,
+    title,
+    payer_participant_id,
+    overall_value,
+    split_object_list,
+    currency,
+    description,
+    rate_date=None,
+):
+    """
+    Dodaje koszt + splity (bulk)
+    rate_date → kurs z danego dnia (koszty wpisywane po fakcie)
+    """
+
+    trip = Trip.objects.filter(trip_id=trip_id).first()
+    if not trip:
+        return {"ok": False, "message": "Trip not found"}
+
+    cost, splits = _build_cost(
+        trip, title, payer_participant_id, overall_value, split_object_list,
+        currency, description, rate_date, rate_books={},
+    )
+
+    # ===== ZAPIS DO BAZY =====
+    with transaction.atomic():
+        cost.save()
+
+        for split in splits:
+            split.cost_id = cost.cost_id
 
         Splited.objects.bulk_create(splits)
 
+        refresh_ledger(_pairs_of(trip.trip_id, splits), CostEvent.COST_ADDED, cost.cost_id)
+        _bump_trip_version(trip_id=trip.trip_id)
+
     return { "ok": True, "message": "New cost added", "cost": cost,}
 
 
+def _bump_trip_version(**trip_filter):
+    """
+    Podbija licznik wersji tripu (jeden UPDATE) – unieważnia cache podsumowań.
+    Wołać w transakcji mutacji kosztów/spłat.
+    """
+    Trip.objects.filter(**trip_filter).update(version=F("version") + 1)
+
+
+def _pairs_of(trip_id, splits):
+    """
+    Pary (trip, dłużnik, wierzyciel) nowych splitów – dla refresh_ledger.
+    """
+    return {
+        (trip_id, int(split.participant_id), int(split.payer_id))
+        for split in splits
+        if int(split.participant_id) != int(split.payer_id)
+    }
+
+
+def _insert_cost_batch(built, update_ledger=True):
+    """
+    Zapisuje [(Cost, [Splited])] dwoma bulk insertami w jednej transakcji.
+    update_ledger=False → ledger i wersję odświeża wołający (import: raz na końcu).
+    Zwraca pary (trip, dłużnik, wierzyciel) zapisanych splitów.
+    """
+    with transaction.atomic():
+        Cost.objects.bulk_create([cost for cost, _ in built])
+
+        all_splits = []
+        pairs = set()
+        for cost, splits in built:
+            for split in splits:
+                split.cost_id = cost.cost_id
+            all_splits.extend(splits)
+            pairs |= _pairs_of(cost.trip_id, splits)
+
+        Splited.objects.bulk_create(all_splits)
+
+        if update_ledger:
+            refresh_ledger(pairs, CostEvent.COST_ADDED)
+            _bump_trip_version(trip_id__in={cost.trip_id for cost, _ in built})
+
+    return pairs
+
+
+def add_costs(trip_id, cost_inputs):
+    """
+    Dodaje wiele kosztów naraz (synchronizacja po pracy offline):
+    jeden odczyt tripu, jeden kurs na datę, dwa bulk inserty w jednej transakcji.
+    Zwraca wynik per pozycja w kolejności wejścia.
+    """
+    trip = Trip.objects.filter(trip_id=trip_id).first()
+    if not trip:
+        return {"ok": False, "message": "Trip not found", "results": []}
+
+    rate_books = {}
+    results = []
+    built = []
+
+    for item in cost_inputs:
+        try:
+            cost, splits = _build_cost(
+                trip, item.title, item.payer_id, item.value, item.split_object_list,
+                item.currency, item.get("description") or "", item.get("date"), rate_books,
+            )
+        except ValueError as e:
+            results.append({"ok": False, "message": str(e), "cost": None})
+            continue
+
+        result = {"ok": True, "message": "New cost added", "cost": cost}
+        results.append(result)
+        built.append((cost, splits))
+
+    _insert_cost_batch(built)
+
+    added = sum(1 for r in results if r["ok"])
+    return {"ok": True, "message": f"{added} of {len(results)} costs added", "results": results}
+
+
 def update_cost(cost_id, **fields):
     """
     Aktualizacja kosztu (bez SELECT)
     """
-    updated = Cost.objects.filter(cost_id=cost_id).update(**fields)
+    with transaction.atomic():
+        updated = Cost.objects.filter(cost_id=cost_id).update(**fields)
+        if updated:
+            trip_id = Cost.objects.filter(cost_id=cost_id).values_list("trip_id", flat=True).get()
+            record_event(trip_id, CostEvent.COST_UPDATED, cost_id)
+            _bump_trip_version(trip_id=trip_id)
 
     if not updated:
         return {"ok": False, "message": "Cost not found"}
@@ -131,74 +282,291 @@ def update_cost(cost_id, **fields):
     return {"ok": True, "message": "Cost updated"}
 
 
-def update_payment(cost_id, participant_id, pay_back_value, current_currency=None):
+# pola splitu zmieniane przez spłatę (save/bulk_update)
+PAYMENT_FIELDS = (
+    "pay_back_value",
+    "to_pay_back_value",
+    "payment",
+    "pay_back_value_main_current",
+    "to_pay_back_value_main_current",
+)
+
+CENT = Decimal("0.01")
+
+
+def _apply_payment(split, pay_back_value, current_currency=None):
     """
-    Aktualizacja płatności splitu + status kosztu z uwzględnieniem waluty bieżącej.
+    Liczy w Pythonie nowe wartości spłaty splitu (bez zapisu).
+    Split musi mieć załadowane cost__trip. Zwraca komunikat błędu albo None.
 
     - Jeśli current_currency != trip.default_currency → standardowa konwersja na main currency
     - Jeśli current_currency == trip.default_currency → pay_back_value traktowane jako main currency,
       split_value przeliczany odwrotnie przez rate
     """
-    pay_back_value = Decimal(pay_back_value)
+    pay_back_value = Decimal(str(pay_back_value)).quantize(CENT, rounding=ROUND_HALF_UP)
+    cost = split.cost
 
-    with transaction.atomic():
-        # Pobierz split i powiązany trip
-        split_qs = Splited.objects.select_related('cost__trip').filter(cost_id=cost_id, participant_id=participant_id)
-        if not split_qs.exists():
-            return {"ok": False, "message": "Split not found"}
+    if current_currency and current_currency == cost.trip.default_currency:
+        if cost.conversion_pending:
+            return "Currency conversion pending, pay in the cost currency"
 
-        split = split_qs.first()
-        trip = split.cost.trip
+        # pay_back_value traktujemy jako main currency → przeliczamy split_value
         rate = split.rate if split.rate else Decimal("1.0")
+        split.pay_back_value = (pay_back_value / rate).quantize(CENT, rounding=ROUND_HALF_UP)
+        split.to_pay_back_value = split.split_value - split.pay_back_value
+        split.pay_back_value_main_current = pay_back_value
+        split.to_pay_back_value_main_current = split.split_value_main_current - pay_back_value
+    else:
+        # standardowa logika: pay_back_value w walucie transakcji
+        split.pay_back_value = pay_back_value
+        split.to_pay_back_value = split.split_value - pay_back_value
+        if split.rate is None:
+            # kurs jeszcze nieznany → main currency uzupełni rekonsyliacja
+            split.pay_back_value_main_current = None
+            split.to_pay_back_value_main_current = None
+        else:
+            split.pay_back_value_main_current = (split.pay_back_value * split.rate).quantize(CENT, rounding=ROUND_HALF_UP)
+            split.to_pay_back_value_main_current = (split.to_pay_back_value * split.rate).quantize(CENT, rounding=ROUND_HALF_UP)
+
+    split.payment = split.split_value <= split.pay_back_value
+    return None
+
+
+def _open_amounts(split):
+    """
+    Wkład splitu w ledger: (amount, amount_main); opłacony split nic nie wnosi.
+    """
+    if split.payment:
+        return Decimal("0.00"), Decimal("0.00")
+    return split.to_pay_back_value, split.to_pay_back_value_main_current or Decimal("0.00")
+
+
+def _correction_of(split, old_pay_back_value, old_pay_back_value_main):
+    """
+    Wpis Payment z różnicą po nadpisaniu spłaty (może być ujemny) – żeby suma
+    wpisów zgadzała się ze spłaconą kwotą splitu. None, gdy nic się nie zmieniło.
+    """
+    amount = split.pay_back_value - old_pay_back_value
+    if not amount:
+        return None
 
-        if current_currency and current_currency == trip.default_currency:
-            # pay_back_value traktujemy jako main currency → przeliczamy split_value
-            split_value_calc = pay_back_value / rate
-            to_pay_back_value_calc = split.split_value - split_value_calc
-
-            # Bulk update dla jednego splitu
-            split_qs.update(
-                split_value=F("split_value"),  # pozostaje bez zmian
-                pay_back_value=split_value_calc,
-                to_pay_back_value=to_pay_back_value_calc,
-                payment=Case(
-                    When(split_value__lte=split_value_calc, then=Value(True)),
-                    default=Value(False),
-                    output_field=BooleanField()
-                ),
-                pay_back_value_main_current=pay_back_value,
-                to_pay_back_value_main_current=split.split_value_main_current - pay_back_value
+    amount_main = None
+    if split.pay_back_value_main_current is not None and old_pay_back_value_main is not None:
+        amount_main = split.pay_back_value_main_current - old_pay_back_value_main
+
+    return Payment(split=split, amount=amount, amount_main=amount_main)
+
+
+def update_payment(cost_id, participant_id, pay_back_value, current_currency=None):
+    """
+    Aktualizacja płatności splitu + status kosztu z uwzględnieniem waluty bieżącej.
+
+    Sześć zapytań: wersja tripu, SELECT ... FOR UPDATE splitu z kosztem i tripem, UPDATE splitu,
+    wpis korekty w Payment, zdarzenie + przesunięcie wiersza ledgera o deltę.
+    UPDATE statusu kosztu tylko, gdy zmienił się status splitu. Pozostałe splity kosztu nie są dotykane.
+    """
+    with transaction.atomic():
+        # UPDATE wersji blokuje trip przed splitem – ta sama kolejność trip → split → ledger
+        # co w refresh_ledger, rozliczeniach i usuwaniu kosztów
+        _bump_trip_version(trip_id__in=Cost.objects.filter(cost_id=cost_id).values("trip_id"))
+        split = (
+            Splited.objects.select_for_update(of=("self",))
+            .select_related("cost__trip")
+            .filter(cost_id=cost_id, participant_id=participant_id)
+            .first()
+        )
+        if split is None:
+            return {"ok": False, "message": "Split not found"}
+
+        was_payment = split.payment
+        old_amount, old_amount_main = _open_amounts(split)
+        old_paid = (split.pay_back_value, split.pay_back_value_main_current)
+
+        error = _apply_payment(split, pay_back_value, current_currency)
+        if error:
+            return {"ok": False, "message": error}
+
+        split.save(update_fields=PAYMENT_FIELDS)
+        correction = _correction_of(split, *old_paid)
+        if correction:
+            correction.save()
+
+        # ===== Ledger =====
+        if split.participant_id != split.payer_id and not (was_payment and split.payment):
+            new_amount, new_amount_main = _open_amounts(split)
+            shift_ledger(
+                split.cost.trip_id, split.participant_id, split.payer_id, split.cost.payed_currency,
+                new_amount - old_amount, new_amount_main - old_amount_main, CostEvent.PAYMENT, cost_id,
             )
-        else:
-            # standardowa logika: pay_back_value w walucie transakcji
-            split_qs.update(
-                pay_back_value=pay_back_value,
-                to_pay_back_value=F("split_value") - pay_back_value,
-                payment=Case(
-                    When(split_value__lte=pay_back_value, then=Value(True)),
-                    default=Value(False),
-                    output_field=BooleanField()
-                )
+            if split.payment:
+                prune_ledger(split.cost.trip_id, split.participant_id, split.payer_id, CostEvent.PAYMENT, cost_id)
+
+        # ===== Aktualizacja statusu kosztu =====
+        # status kosztu zależy tylko od statusów splitów – bez zmiany splitu nie ma czego przeliczać
+        if split.payment != was_payment:
+            _update_cost_payment(Cost.objects.filter(cost_id=cost_id))
+
+    return {"ok": True, "message": "Payments updated"}
+
+
+def update_payments(payments):
+    """
+    Wiele spłat (cost_id, participant_id, pay_back_value, currency) w jednej transakcji:
+    jeden SELECT ... FOR UPDATE, bulk_update splitów, jeden UPDATE kosztów, odświeżenie ledgera.
+    Zwraca wynik per pozycja w kolejności wejścia.
+    """
+    keys = {(int(p["cost_id"]), int(p["participant_id"])) for p in payments}
+    if not keys:
+        return {"ok": True, "message": "0 of 0 payments updated", "results": []}
+
+    with transaction.atomic():
+        # tripy przed splitami (kolejność jak w update_payment), blokowany tylko split
+        _lock_trips(Cost.objects.filter(cost_id__in={c for c, _ in keys}).values("trip_id"))
+        splits = {
+            (split.cost_id, split.participant_id): split
+            for split in (
+                Splited.objects.select_for_update(of=("self",))
+                .select_related("cost__trip")
+                .filter(reduce(or_, (Q(cost_id=c, participant_id=p) for c, p in keys)))
             )
+        }
+
+        results = []
+        changed = {}
+        corrections = []
+        for item in payments:
+            key = (int(item["cost_id"]), int(item["participant_id"]))
+            split = splits.get(key)
+            if split is None:
+                results.append({"ok": False, "message": "Split not found"})
+                continue
+
+            old_paid = (split.pay_back_value, split.pay_back_value_main_current)
+            error = _apply_payment(split, item.get("pay_back_value") or 0, item.get("currency"))
+            if error:
+                results.append({"ok": False, "message": error})
+                continue
+
+            correction = _correction_of(split, *old_paid)
+            if correction:
+                corrections.append(correction)
+            changed[key] = split
+            results.append({"ok": True, "message": "Payment updated"})
+
+        if changed:
+            Splited.objects.bulk_update(changed.values(), PAYMENT_FIELDS, batch_size=500)
+            Payment.objects.bulk_create(corrections, batch_size=500)
+            _update_cost_payment(Cost.objects.filter(cost_id__in={c for c, _ in changed}))
+            refresh_ledger({
+                (split.cost.trip_id, split.participant_id, split.payer_id)
+                for split in changed.values()
+                if split.participant_id != split.payer_id
+            }, CostEvent.PAYMENT)
+            _bump_trip_version(trip_id__in={split.cost.trip_id for split in changed.values()})
+
+    updated = sum(1 for r in results if r["ok"])
+    return {"ok": True, "message": f"{updated} of {len(results)} payments updated", "results": results}
+
+
+def record_payment(cost_id, participant_id, amount, current_currency=None):
+    """
+    Dopisuje spłatę (INSERT do Payment) i przesuwa wartości splitu o kwotę
+    atomowym UPDATE z F() – bez SELECT ... FOR UPDATE i bez read-modify-write,
+    więc równoległe spłaty tego samego splitu się sumują, a nie nadpisują.
 
-            # Bulk update main currency z zaokrągleniem
-            Splited.objects.filter(cost_id=cost_id).update(
-                pay_back_value_main_current=Round(F("pay_back_value") * F("rate"), precision=2),
-                to_pay_back_value_main_current=Round(F("to_pay_back_value") * F("rate"), precision=2)
+    - Jeśli current_currency == trip.default_currency → amount jest w main currency,
+      kwota w walucie kosztu liczona odwrotnie przez rate
+    - W przeciwnym razie amount jest w walucie kosztu
+    """
+    amount = Decimal(str(amount)).quantize(CENT, rounding=ROUND_HALF_UP)
+    if amount <= 0:
+        return {"ok": False, "message": "Payment amount must be positive"}
+
+    split_qs = Splited.objects.filter(cost_id=cost_id, participant_id=participant_id)
+    split = split_qs.values(
+        "id", "rate", "payer_id", "trip_id", "cost__payed_currency",
+        "cost__conversion_pending", "cost__trip__default_currency",
+    ).first()
+    if split is None:
+        return {"ok": False, "message": "Split not found"}
+
+    rate = split["rate"]
+    if current_currency and current_currency == split["cost__trip__default_currency"]:
+        if split["cost__conversion_pending"]:
+            return {"ok": False, "message": "Currency conversion pending, pay in the cost currency"}
+        amount_main = amount
+        amount = (amount / (rate or Decimal("1.0"))).quantize(CENT, rounding=ROUND_HALF_UP)
+    else:
+        amount_main = (amount * rate).quantize(CENT, rounding=ROUND_HALF_UP) if rate is not None else None
+
+    with transaction.atomic():
+        # bez blokady tripu: split i ledger zmieniają się przyrostowo (F()), a refresh_ledger
+        # blokuje otwarte splity par przed agregacją – kolejność split → ledger jak tutaj.
+        # Wersja tripu (cache podsumowań) podbijana osobno po commicie.
+        transaction.on_commit(partial(_bump_trip_version, trip_id=split["trip_id"]))
+
+        Payment.objects.create(split_id=split["id"], amount=amount, amount_main=amount_main)
+
+        fields = {
+            "pay_back_value": F("pay_back_value") + amount,
+            "to_pay_back_value": F("to_pay_back_value") - amount,
+            # SET liczy się na wartościach sprzed UPDATE
+            "payment": Case(
+                When(split_value__lte=F("pay_back_value") + amount, then=Value(True)),
+                default=Value(False),
+                output_field=BooleanField()
+            ),
+        }
+        if amount_main is not None:
+            fields["pay_back_value_main_current"] = F("pay_back_value_main_current") + amount_main
+            fields["to_pay_back_value_main_current"] = F("to_pay_back_value_main_current") - amount_main
+        split_qs.update(**fields)
+
+        # wiersz splitu jest już zablokowany przez nasz UPDATE → odczyt jest spójny
+        updated = split_qs.values(
+            "payment", "split_value", "pay_back_value", "to_pay_back_value", "to_pay_back_value_main_current"
+        ).get()
+        was_paid = updated["split_value"] <= updated["pay_back_value"] - amount
+
+        # ===== Ledger =====
+        if split["payer_id"] != int(participant_id) and not was_paid:
+            old_amount_main = updated["to_pay_back_value_main_current"] or Decimal("0.00")
+            if amount_main is not None:
+                old_amount_main += amount_main
+
+            new_amount, new_amount_main = Decimal("0.00"), Decimal("0.00")
+            if not updated["payment"]:
+                new_amount = updated["to_pay_back_value"]
+                new_amount_main = updated["to_pay_back_value_main_current"] or Decimal("0.00")
+
+            shift_ledger(
+                split["trip_id"], int(participant_id), split["payer_id"], split["cost__payed_currency"],
+                new_amount - (updated["to_pay_back_value"] + amount), new_amount_main - old_amount_main,
+                CostEvent.PAYMENT, cost_id,
             )
+            if updated["payment"]:
+                prune_ledger(split["trip_id"], int(participant_id), split["payer_id"], CostEvent.PAYMENT, cost_id)
 
         # ===== Aktualizacja statusu kosztu =====
-        unpaid_exists = Splited.objects.filter(cost_id=cost_id, payment=False).exists()
-        Cost.objects.filter(cost_id=cost_id).update(payment=not unpaid_exists)
+        if updated["payment"] and not was_paid:
+            # pierwszy UPDATE czeka na równoległe spłaty tego kosztu, NOT EXISTS
+            # w kolejnym zapytaniu widzi już ich zatwierdzone splity
+            cost_qs = Cost.objects.filter(cost_id=cost_id)
+            cost_qs.update(payment=False)
+            _update_cost_payment(cost_qs)
 
-    return {"ok": True, "message": "Payments updated"}
+    return {"ok": True, "message": "Payment recorded"}
 
 
 def delete_cost(cost_id):
     """
     Usuwa koszt (cascade splity)
     """
-    deleted, _ = Cost.objects.filter(cost_id=cost_id).delete()
+    with transaction.atomic():
+        pairs = ledger_pairs(Splited.objects.filter(cost_id=cost_id))
+        _bump_trip_version(trip_id__in=Cost.objects.filter(cost_id=cost_id).values("trip_id"))
+        deleted, _ = Cost.objects.filter(cost_id=cost_id).delete()
+        refresh_ledger(pairs, CostEvent.COST_DELETED, cost_id)
 
     if not deleted:
         return {"ok": False, "message": "Cost not deleted"}
@@ -210,10 +578,15 @@ def delete_split_by_user(cost_id, participant_id):
     """
     Usuwa split użytkownika z kosztu
     """
-    deleted, _ = Splited.objects.filter(
-        cost_id=cost_id,
-        participant_id=participant_id
-    ).delete()
+    with transaction.atomic():
+        split_qs = Splited.objects.filter(
+            cost_id=cost_id,
+            participant_id=participant_id
+        )
+        pairs = ledger_pairs(split_qs)
+        _bump_trip_version(trip_id__in=Cost.objects.filter(cost_id=cost_id).values("trip_id"))
+        deleted, _ = split_qs.delete()
+        refresh_ledger(pairs, CostEvent.SPLIT_DELETED, cost_id)
 
     if not deleted:
         return {"ok": False, "message": "Participant is not assigned to this cost"}
@@ -221,69 +594,309 @@ def delete_split_by_user(cost_id, participant_id):
     return {"ok": True, "message": "Participant removed from cost"}
 
 
+def reconcile_pending_conversions():
+    """
+    Uzupełnia wartości w walucie głównej kosztów zapisanych bez kursu.
+    Jeden UPDATE splitów + jeden UPDATE kosztów na grupę (waluta, waluta tripu, data kursu).
+    """
+    groups = (
+        Cost.objects
+        .filter(conversion_pending=True)
+        .values_list("payed_currency", "trip__default_currency", "rate_date")
+        .distinct()
+    )
+
+    converted = 0
+    still_pending = 0
+    for from_currency, to_currency, rate_date in groups:
+        pending_qs = Cost.objects.filter(
+            conversion_pending=True,
+            payed_currency=from_currency,
+            trip__default_currency=to_currency,
+            rate_date=rate_date,
+        )
+
+        rate_book = get_rate_book(as_of=rate_date)
+        if not rate_book.available:
+            still_pending += pending_qs.count()
+            continue
+        try:
+            rate = rate_book.rate(from_currency, to_currency)
+        except ValueError as e:
+            # waluta spoza tabeli kursów – grupa czeka dalej, pozostałe grupy są przeliczane
+            logger.warning("Cannot reconcile %s → %s costs (%s): %s", from_currency, to_currency, rate_date, e)
+            still_pending += pending_qs.count()
+            continue
+        rate = Value(rate, output_field=DecimalField(max_digits=20, decimal_places=10))
+
+        with transaction.atomic():
+            # tripy przed kosztami i splitami
+            _lock_trips(pending_qs.values("trip_id"))
+            cost_ids = list(pending_qs.select_for_update(of=("self",)).values_list("cost_id", flat=True))
+            pairs = ledger_pairs(Splited.objects.filter(cost_id__in=cost_ids))
+
+            Splited.objects.filter(cost_id__in=cost_ids).update(
+                rate=rate,
+                split_value_main_current=Round(F("split_value") * rate, precision=2),
+                to_pay_back_value_main_current=Round(F("to_pay_back_value") * rate, precision=2),
+                pay_back_value_main_current=Round(F("pay_back_value") * rate, precision=2),
+            )
+            converted += Cost.objects.filter(cost_id__in=cost_ids).update(
+                overall_value_main_currency=Round(F("overall_value") * rate, precision=2),
+                conversion_pending=False,
+            )
+
+            refresh_ledger(pairs, CostEvent.CONVERSION)
+            _bump_trip_version(trip_id__in=Cost.objects.filter(cost_id__in=cost_ids).values("trip_id"))
+
+    return {"ok": True, "converted": converted, "pending": still_pending}
+
+
 # ======================================================
 # COST QUERIES
 # ======================================================
 
-def get_cost_sum_for_participant_per_trip_bulk(participant_id, trip_id):
+COSTS_PAGE_SIZE = 20
+MAX_COSTS_PAGE_SIZE = 100
+
+# poniżej tylu splitów uczestnika strona kosztów jest budowana od jego splitów
+SPARSE_PARTICIPANT_SPLITS = 500
+
+
+# wpisy cache są unieważniane przez Trip.version, timeout tylko ogranicza pamięć
+COST_SUM_CACHE_TIMEOUT = 60 * 60
+
+
+def _cost_sum_cache_key(trip, participant_id):
+    return f"cost_sum:{trip.trip_id}:{int(participant_id)}:v{trip.version}"
+
+
+def get_cost_sum_for_participant_per_trip_bulk(participant_id, trip_id, trip=None):
     """
     Zwraca sumę kosztów uczestnika dla danego tripu w formacie:
     {
         overviewSum: {"currency": trip.default_currency, "value": total_main_currency},
         splitsByCurrency: [{"currency": "USD", "value": 123.45}, ...]
     }
-    Wersja BULK, bez pętli po splitach.
+    Jedno zapytanie GROUP BY waluta (suma w walucie głównej składana w Pythonie),
+    wynik w cache per (trip, uczestnik, wersja tripu).
+    trip → już pobrany trip (np. przez select_related uczestnika), bez dodatkowego odczytu
     """
-    # Pobranie tripu
-    trip = Trip.objects.filter(trip_id=trip_id).first()
+    if trip is None:
+        trip = Trip.objects.filter(trip_id=trip_id).only("trip_id", "default_currency", "version").first()
     if not trip:
         return {
             "overviewSum": {"currency": None, "value": Decimal("0.00")},
             "splitsByCurrency": []
         }
 
-    # ===== Suma w walucie głównej =====
-    total_main = (
-        Splited.objects
-        .filter(cost__trip_id=trip_id, participant_id=participant_id)
-        .aggregate(total=Sum("split_value_main_current"))["total"]
-    )
-    total_main = (total_main or Decimal("0.00")).quantize(Decimal("0.00"), rounding=ROUND_HALF_UP)
-    overviewSum = {"currency": trip.default_currency, "value": total_main}
+    cache_key = _cost_sum_cache_key(trip, participant_id)
+    cached = cache.get(cache_key)
+    if cached is not None:
+        return cached
 
-    # ===== Suma według każdej waluty (BULK) =====
-    from django.db.models import DecimalField
+    # ===== Suma według każdej waluty + waluta główna (jedno zapytanie) =====
+    money = DecimalField(max_digits=20, decimal_places=2)
     totals_by_currency_qs = (
         Splited.objects
-        .filter(cost__trip_id=trip_id, participant_id=participant_id)
+        .filter(trip_id=trip.trip_id, participant_id=participant_id)
         .values(currency=F("cost__payed_currency"))
-        .annotate(total=Sum("split_value", output_field=DecimalField(max_digits=20, decimal_places=2)))
+        .annotate(
+            total=Sum("split_value", output_field=money),
+            total_main=Sum("split_value_main_current", output_field=money),
+        )
+        .order_by("currency")
     )
 
-    splitsByCurrency = [
-        {"currency": item["currency"], "value": item["total"].quantize(Decimal("0.00"), rounding=ROUND_HALF_UP)}
-        for item in totals_by_currency_qs
-    ]
+    total_main = Decimal("0.00")
+    splitsByCurrency = []
+    for item in totals_by_currency_qs:
+        total_main += item["total_main"] or Decimal("0.00")
+        splitsByCurrency.append(
+            {"currency": item["currency"], "value": item["total"].quantize(Decimal("0.00"), rounding=ROUND_HALF_UP)}
+        )
 
-    return {
-        "overviewSum": overviewSum,
-        "splitsByCurrency": splitsByCurrency
+    result = {
+        "overviewSum": {
+            "currency": trip.default_currency,
+            "value": total_main.quantize(Decimal("0.00"), rounding=ROUND_HALF_UP),
+        },
+        "splitsByCurrency": splitsByCurrency,
     }
+    cache.set(cache_key, result, COST_SUM_CACHE_TIMEOUT)
+    return result
+
+
+def _empty_balance():
+    zero = Decimal("0.00")
+    return {"spent_main": zero, "paid_main": zero, "owed_main": zero, "spent": {}, "paid": {}, "owed": {}}
+
+
+def _trip_balance_totals(trip):
+    """
+    Sumy spent / paid / owed per uczestnik (id → wartości) – jeden GROUP BY
+    (uczestnik, payer, waluta) po splitach, bez listy uczestników.
+    """
+    money = DecimalField(max_digits=20, decimal_places=2)
+    unpaid = Q(payment=False)
+    rows = (
+        Splited.objects
+        .filter(trip_id=trip.trip_id)
+        .values("participant_id", "payer_id", currency=F("cost__payed_currency"))
+        .annotate(
+            total=Sum("split_value", output_field=money),
+            total_main=Sum("split_value_main_current", output_field=money),
+            open=Sum("to_pay_back_value", filter=unpaid, output_field=money),
+            open_main=Sum("to_pay_back_value_main_current", filter=unpaid, output_field=money),
+        )
+        .order_by()
+    )
+
+    totals = defaultdict(_empty_balance)
+    zero = Decimal("0.00")
+
+    def add(data, kind, currency, value, value_main):
+        data[kind][currency] = data[kind].get(currency, zero) + (value or zero)
+        data[f"{kind}_main"] += value_main or zero
+
+    for row in rows:
+        debtor = totals[row["participant_id"]]
+        payer = totals[row["payer_id"]]
+        currency = row["currency"]
+
+        add(debtor, "spent", currency, row["total"], row["total_main"])
+        add(payer, "paid", currency, row["total"], row["total_main"])
+
+        if row["participant_id"] != row["payer_id"] and row["open"] is not None:
+            add(payer, "owed", currency, row["open"], row["open_main"])
+            add(debtor, "owed", currency, -row["open"], -(row["open_main"] or zero))
+
+    # Zaokrąglanie
+    for data in totals.values():
+        for kind in ("spent", "paid", "owed"):
+            data[f"{kind}_main"] = data[f"{kind}_main"].quantize(Decimal("0.01"), rounding=ROUND_HALF_UP)
+            data[kind] = {
+                c: v.quantize(Decimal("0.01"), rounding=ROUND_HALF_UP)
+                for c, v in sorted(data[kind].items())
+            }
+    return dict(totals)
+
+
+def get_trip_balances(trip_id, trip=None):
+    """
+    Bilans wszystkich uczestników tripu naraz (dashboard właściciela):
+    - spent: udział uczestnika w kosztach
+    - paid: koszty zapłacone przez uczestnika (jako payer)
+    - owed: saldo otwartych splitów, > 0 → inni są mu winni, < 0 → on jest winien
+    Każda wartość w walucie głównej i per waluta.
+    W cache (per wersja tripu) są tylko sumy; lista uczestników czytana zawsze na żywo.
+    """
+    if trip is None:
+        trip = Trip.objects.filter(trip_id=trip_id).only("trip_id", "default_currency", "version").first()
+    if not trip:
+        return []
+
+    cache_key = f"trip_balances:{trip.trip_id}:v{trip.version}"
+    totals = cache.get(cache_key)
+    if totals is None:
+        totals = _trip_balance_totals(trip)
+        cache.set(cache_key, totals, COST_SUM_CACHE_TIMEOUT)
+
+    return [
+        {"participant": p, "trip_currency": trip.default_currency, **totals.get(p["id"], _empty_balance())}
+        for p in TripParticipant.objects.filter(trip_id=trip.trip_id).order_by("id").values("id", "nickname", "user_id")
+    ]
+
+
+def _involved_splits(participant_id, trip_id):
+    """
+    Splity uczestnika (jako dłużnik, jako payer) – osobno, każde po swoim indeksie
+    (participant, trip) / (payer, trip). OR w jednym zapytaniu planer czyta z indeksu tripu.
+    """
+    return (
+        Splited.objects.filter(participant_id=participant_id, trip_id=trip_id),
+        Splited.objects.filter(payer_id=participant_id, trip_id=trip_id),
+    )
 
 
 def get_all_cost_for_participant_per_trip(participant_id, trip_id):
+    """
+    Koszty tripu, w których uczestnik ma split albo jest payerem.
+    Prowadzone od splitów uczestnika (UNION po dwóch indeksach). Trip filtrowany
+    w podzapytaniach; filtr na Cost skłania SQLite do przejścia po wszystkich kosztach tripu.
+    """
+    as_participant, as_payer = _involved_splits(participant_id, trip_id)
+    return (
+        Cost.objects
+        .filter(cost_id__in=as_participant.values("cost_id").union(as_payer.values("cost_id")))
+        .order_by("-created_at", "-cost_id")
+    )
+
+
+def _walk_trip_costs(participant_id, trip_id):
+    """
+    Koszty tripu po indeksie cost_trip_created_idx z EXISTS na splitach – dla
+    uczestnika obecnego w wielu kosztach strona kończy się po kilku krokach keysetu.
+    """
+    involved = Splited.objects.filter(cost_id=OuterRef("cost_id")).filter(
+        Q(participant_id=participant_id) | Q(payer_id=participant_id)
+    )
     return (
         Cost.objects
         .filter(trip_id=trip_id)
-        .filter(
-            Q(splited__participant_id=participant_id) |
-            Q(splited__payer_id=participant_id)
-        )
-        .distinct()
-        .order_by("-created_at")
+        .filter(Exists(involved))
+        .order_by("-created_at", "-cost_id")
     )
 
 
+def encode_cost_cursor(cost):
+    raw = f"{cost.created_at.isoformat()}|{cost.cost_id}"
+    return urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cost_cursor(cursor):
+    """
+    Kursor → (created_at, cost_id). ValueError dla niepoprawnego kursora.
+    """
+    try:
+        created_at, cost_id = urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return datetime.fromisoformat(created_at), int(cost_id)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise ValueError("Invalid cursor")
+
+
+def get_costs_page(participant_id, trip_id, first=COSTS_PAGE_SIZE, after=None):
+    """
+    Strona kosztów uczestnika (keyset po (created_at, cost_id) malejąco).
+    Uczestnik w niewielu kosztach (< SPARSE_PARTICIPANT_SPLITS splitów jako dłużnik i jako
+    payer) → id jego kosztów z indeksów splitów, koszty po PK i sortowanie tylko ich;
+    w pozostałych przypadkach przejście po indeksie cost_trip_created_idx, które
+    znajduje stronę po kilku krokach.
+    Zwraca {"costs": [...], "has_next_page": bool}.
+    """
+    first = max(1, min(int(first), MAX_COSTS_PAGE_SIZE))
+
+    involved = _involved_splits(participant_id, trip_id)
+    # LIMIT 1 OFFSET n – czyta co najwyżej SPARSE_PARTICIPANT_SPLITS wpisów indeksu
+    nth = slice(SPARSE_PARTICIPANT_SPLITS - 1, SPARSE_PARTICIPANT_SPLITS)
+    if any(splits_qs[nth].exists() for splits_qs in involved):
+        costs_qs = _walk_trip_costs(participant_id, trip_id)
+    else:
+        # lista id zamiast podzapytania – planer nie ma powodu czytać całej tabeli kosztów
+        cost_ids = {cost_id for splits_qs in involved for cost_id in splits_qs.values_list("cost_id", flat=True)}
+        costs_qs = Cost.objects.filter(cost_id__in=cost_ids).order_by("-created_at", "-cost_id")
+    if after:
+        created_at, cost_id = decode_cost_cursor(after)
+        costs_qs = (
+            costs_qs
+            .filter(created_at__lte=created_at)
+            .exclude(created_at=created_at, cost_id__gte=cost_id)
+        )
+
+    costs = list(costs_qs[:first + 1])
+    return {"costs": costs[:first], "has_next_page": len(costs) > first}
+
+
 # ======================================================
 # PAYBACK / SETTLEMENT
 # ======================================================
@@ -291,93 +904,119 @@ def get_all_cost_for_participant_per_trip(participant_id, trip_id):
 def get_payback_participant_relation_per_trip_bulk(trip_id, participant_id):
     """
     Oblicza kto komu ile jest winien w walucie głównej i per walutę.
+    Odczyt z BalanceLedger: O(uczestników × walut) wierszy po indeksie,
+    bez skanowania splitów.
     """
-    splits = Splited.objects.filter(
-        cost__trip_id=trip_id
-    ).select_related("participant", "payer", "cost__trip", "cost")
-
-    # jeśli nie ma splitów, zwróć pustą listę
-    if not splits.exists():
-        return []
-
-    trip_currency = splits[0].cost.trip.default_currency
+    participant_id = int(participant_id)
 
     totals = {}
-    for s in splits:
-        if s.payment:
-            continue
-
-        if s.payer.id == participant_id and s.participant.id != participant_id:
-            pid = s.participant.id
-            sign = 1  # oni mi są winni
-        elif s.participant.id == participant_id and s.payer.id != participant_id:
-            pid = s.payer.id
-            sign = -1  # ja jestem im winien
+    for row in get_participant_ledger(trip_id, participant_id):
+        if row.creditor_id == participant_id:
+            counterparty, sign = row.debtor, 1  # oni mi są winni
         else:
-            continue
-
-        if pid not in totals:
-            totals[pid] = {
-                "participant": {
-                    "id": pid,
-                    "nickname": s.participant.nickname if sign > 0 else s.payer.nickname,
-                    "user_id": s.participant.user_id if sign > 0 else s.payer.user_id,
-                },
-                "total_main": Decimal("0.00"),
-                "totals_by_currency": {}
-            }
-
-        totals[pid]["total_main"] += sign * (s.to_pay_back_value_main_current or Decimal("0.00"))
-        totals[pid]["totals_by_currency"].setdefault(s.cost.payed_currency, Decimal("0.00"))
-        totals[pid]["totals_by_currency"][s.cost.payed_currency] += sign * s.to_pay_back_value
+            counterparty, sign = row.creditor, -1  # ja jestem im winien
+
+        data = totals.setdefault(counterparty.id, {
+            "participant": {
+                "id": counterparty.id,
+                "nickname": counterparty.nickname,
+                "user_id": counterparty.user_id,
+            },
+            "total_main": Decimal("0.00"),
+            "totals_by_currency": {},
+            "trip_currency": row.trip.default_currency,
+        })
+        data["total_main"] += sign * row.amount_main
+        data["totals_by_currency"].setdefault(row.currency, Decimal("0.00"))
+        data["totals_by_currency"][row.currency] += sign * row.amount
 
     # Zaokrąglanie
-    for pid, data in totals.items():
+    for data in totals.values():
         data["total_main"] = data["total_main"].quantize(Decimal("0.01"), rounding=ROUND_HALF_UP)
         for c, v in data["totals_by_currency"].items():
             data["totals_by_currency"][c] = v.quantize(Decimal("0.01"), rounding=ROUND_HALF_UP)
 
-        # dodajemy walutę tripu dla value_main
-        data["trip_currency"] = trip_currency
-
     return list(totals.values())
 
 
+def _update_cost_payment(cost_qs):
+    """
+    Jeden UPDATE: koszt opłacony ⇔ nie ma żadnego nieopłaconego splitu.
+    """
+    unpaid_splits = Splited.objects.filter(cost_id=OuterRef("pk"), payment=False)
+    return cost_qs.update(payment=~Exists(unpaid_splits))
+
+
+def _settle_splits(splits_qs):
+    """
+    Zamyka splity: całość spłacona, nic do oddania.
+    """
+    return splits_qs.update(
+        to_pay_back_value=Decimal("0.00"),
+        to_pay_back_value_main_current=Decimal("0.00"),
+        pay_back_value=F("split_value"),
+        pay_back_value_main_current=F("split_value_main_current"),
+        payment=True
+    )
+
+
 def fully_settlement_with_participant(trip_id, participant_id, settlement_participant_id, currency=None):
     """
     Pełne rozliczenie pomiędzy dwoma participantami.
     Jeśli currency=None → rozliczenie po wszystkich kosztach (full settlement)
     Jeśli currency='USD' → rozliczenie tylko dla kosztów w podanej walucie
+    Stała liczba zapytań: UPDATE splitów + UPDATE kosztów (bez pętli po kosztach).
     """
+    pair_filter = (
+        Q(payer_id=participant_id, participant_id=settlement_participant_id) |
+        Q(payer_id=settlement_participant_id, participant_id=participant_id)
+    )
+
     with transaction.atomic():
+        # blokada tripu przed UPDATE splitów
+        _bump_trip_version(trip_id=trip_id)
+
         splits_qs = Splited.objects.filter(
-            cost__trip_id=trip_id,
+            trip_id=trip_id,
             payment=False
-        ).filter(
-            Q(payer_id=participant_id, participant_id=settlement_participant_id) |
-            Q(payer_id=settlement_participant_id, participant_id=participant_id)
+        ).filter(pair_filter)
+
+        costs_qs = Cost.objects.filter(
+            trip_id=trip_id,
+            cost_id__in=Splited.objects.filter(pair_filter).values("cost_id")
         )
 
         if currency:
             splits_qs = splits_qs.filter(cost__payed_currency=currency)
-
-        cost_ids = list(splits_qs.values_list("cost_id", flat=True).distinct())
+            costs_qs = costs_qs.filter(payed_currency=currency)
 
         # ===== Aktualizacja splitów =====
-        splits_qs.update(
-            to_pay_back_value=Decimal("0.00"),
-            to_pay_back_value_main_current=Decimal("0.00"),
-            pay_back_value=F("split_value"),
-            pay_back_value_main_current=F("split_value_main_current"),
-            payment=True
-        )
+        _settle_splits(splits_qs)
 
-        # ===== Sprawdzenie statusu kosztów =====
-        for cost_id in cost_ids:
-            all_paid = not Splited.objects.filter(cost_id=cost_id, payment=False).exists()
-            Cost.objects.filter(cost_id=cost_id).update(payment=all_paid)
+        # ===== Status kosztów (set-based) =====
+        _update_cost_payment(costs_qs)
+
+        refresh_ledger({
+            (trip_id, participant_id, settlement_participant_id),
+            (trip_id, settlement_participant_id, participant_id),
+        }, CostEvent.SETTLEMENT)
 
         return {
             "ok": True,
             "message": f"Fully settlement successful {'for currency ' + currency if currency else 'in main currency'}"
         }
+
+
+def settle_trip(trip_id):
+    """
+    Rozlicza wszystkich uczestników tripu naraz: zamyka wszystkie otwarte splity
+    i przelicza status każdego kosztu – stała liczba zapytań niezależnie od rozmiaru tripu.
+    """
+    with transaction.atomic():
+        # blokada tripu przed UPDATE splitów
+        _bump_trip_version(trip_id=trip_id)
+        settled = _settle_splits(Splited.objects.filter(trip_id=trip_id, payment=False))
+        _update_cost_payment(Cost.objects.filter(trip_id=trip_id))
+        rebuild_ledger([trip_id], CostEvent.SETTLEMENT)
+
+    return {"ok": True, "message": f"Trip settled, {settled} splits closed"}
@@ -0,0 +1,253 @@
+import logging
+import threading
+import uuid
+from collections import defaultdict
+from datetime import timedelta
+from decimal import Decimal
+
+from django.db import transaction, connection, IntegrityError
+from django.db.models import F, Q, Value, DecimalField
+from django.db.models.functions import Round
+from django.utils import timezone
+
+from tripAppBE.models import Cost, CostEvent, CurrencyChangeJob, Payment, Splited, Trip
+from tripAppBE.services.convert_currency_service import get_rate_book
+from tripAppBE.services.ledger_service import rebuild_ledger
+
+logger = logging.getLogger(__name__)
+
+
+# ======================================================
+# CONFIG
+# ======================================================
+
+# kosztów na jedną transakcję – blokady wierszy trzymane tylko przez jeden chunk
+CURRENCY_CHANGE_CHUNK_SIZE = 500
+
+ACTIVE_STATUSES = (CurrencyChangeJob.PENDING, CurrencyChangeJob.RUNNING)
+
+# job RUNNING bez postępu dłużej niż tyle sekund uznajemy za porzucony (restart procesu)
+CURRENCY_CHANGE_STALE_SECONDS = 300
+
+
+# ======================================================
+# START
+# ======================================================
+
+def start_currency_change(trip_id, to_currency):
+    """
+    Zmienia walutę główną tripu i zleca przeliczenie kosztów w tle.
+    Trip dostaje nową walutę od razu (nowe koszty liczą się już w niej),
+    istniejące koszty przelicza job chunkami.
+    """
+    to_currency = to_currency.strip().upper()
+
+    trip = Trip.objects.filter(trip_id=trip_id).first()
+    if not trip:
+        return {"ok": False, "message": "Trip not found", "job": None}
+    if trip.default_currency == to_currency:
+        return {"ok": False, "message": "Trip already uses this currency", "job": None}
+
+    rate_book = get_rate_book()
+    if not rate_book.available:
+        return {"ok": False, "message": "Currency rates unavailable, try again later", "job": None}
+    try:
+        rate_book.rate(trip.default_currency, to_currency)
+    except ValueError as e:
+        return {"ok": False, "message": str(e), "job": None}
+
+    try:
+        with transaction.atomic():
+            job = CurrencyChangeJob.objects.create(
+                trip_id=trip.trip_id,
+                from_currency=trip.default_currency,
+                to_currency=to_currency,
+                total_costs=Cost.objects.filter(trip_id=trip.trip_id).count(),
+            )
+            Trip.objects.filter(trip_id=trip.trip_id).update(
+                default_currency=to_currency, version=F("version") + 1
+            )
+            transaction.on_commit(lambda: run_in_background(job.id))
+    except IntegrityError:
+        return {"ok": False, "message": "Currency change already in progress", "job": None}
+
+    return {"ok": True, "message": "Currency change started", "job": job}
+
+
+def run_in_background(job_id):
+    thread = threading.Thread(target=_run_thread, args=(job_id,), name=f"currency-change-{job_id}", daemon=True)
+    thread.start()
+    return thread
+
+
+def _run_thread(job_id):
+    try:
+        run_currency_change_job(job_id)
+    finally:
+        connection.close()
+
+
+# ======================================================
+# JOB
+# ======================================================
+
+def _claim(job_id, runner, include_failed, stale_seconds):
+    """
+    Atomowo przejmuje job (jeden UPDATE): pending, porzucony running albo – na życzenie – failed.
+    Drugi wykonawca tego samego joba dostaje False i nic nie robi.
+    """
+    now = timezone.now()
+    claimable = Q(status=CurrencyChangeJob.PENDING) | Q(
+        status=CurrencyChangeJob.RUNNING, updated_at__lt=now - timedelta(seconds=stale_seconds)
+    )
+    if include_failed:
+        claimable |= Q(status=CurrencyChangeJob.FAILED)
+
+    return bool(
+        CurrencyChangeJob.objects.filter(claimable, id=job_id).update(
+            status=CurrencyChangeJob.RUNNING, runner=runner, error="", updated_at=now
+        )
+    )
+
+
+def run_currency_change_job(
+    job_id, chunk_size=CURRENCY_CHANGE_CHUNK_SIZE, include_failed=False, stale_seconds=CURRENCY_CHANGE_STALE_SECONDS
+):
+    """
+    Przelicza koszty tripu chunk po chunku (rosnąco po cost_id) aż do końca.
+    Wznawialny: kursor last_cost_id zapisywany w transakcji chunku.
+    Zwraca True (zakończony), False (błąd) albo None, gdy job prowadzi już inny wykonawca.
+    """
+    runner = uuid.uuid4().hex
+    if not _claim(job_id, runner, include_failed, stale_seconds):
+        return None
+
+    rate_books = {}
+    try:
+        while _convert_chunk(job_id, runner, chunk_size, rate_books):
+            pass
+
+        with transaction.atomic():
+            job = CurrencyChangeJob.objects.select_for_update().get(id=job_id)
+            if job.status != CurrencyChangeJob.RUNNING or job.runner != runner:
+                return None
+
+            rebuild_ledger([job.trip_id], CostEvent.CONVERSION)
+            Trip.objects.filter(trip_id=job.trip_id).update(version=F("version") + 1)
+            job.status = CurrencyChangeJob.DONE
+            job.save(update_fields=["status", "updated_at"])
+    except Exception as e:
+        logger.exception("Currency change job %s failed", job_id)
+        # job przejęty w międzyczasie przez innego wykonawcę zostaje nietknięty
+        CurrencyChangeJob.objects.filter(id=job_id, runner=runner).update(status=CurrencyChangeJob.FAILED, error=str(e))
+        return False
+
+    return True
+
+
+def _rate_book(rate_books, rate_date):
+    if rate_date not in rate_books:
+        rate_books[rate_date] = get_rate_book(as_of=rate_date)
+    return rate_books[rate_date]
+
+
+def _convert_chunk(job_id, runner, chunk_size, rate_books):
+    """
+    Jeden chunk w jednej krótkiej transakcji: UPDATE-y set-based per (waluta kosztu, data kursu).
+    Zwraca False, gdy nie ma już kosztów do przeliczenia albo job przejął inny wykonawca.
+    """
+    with transaction.atomic():
+        job = CurrencyChangeJob.objects.select_for_update().get(id=job_id)
+        if job.status != CurrencyChangeJob.RUNNING or job.runner != runner:
+            return False
+
+        chunk = list(
+            Cost.objects
+            .filter(trip_id=job.trip_id, cost_id__gt=job.last_cost_id)
+            .order_by("cost_id")
+            .values_list("cost_id", "payed_currency", "rate_date")[:chunk_size]
+        )
+        if not chunk:
+            return False
+
+        groups = defaultdict(list)
+        for cost_id, currency, rate_date in chunk:
+            groups[(currency, rate_date)].append(cost_id)
+
+        for (currency, rate_date), cost_ids in groups.items():
+            if currency == job.to_currency:
+                _apply_rate(cost_ids, Decimal("1"))
+                continue
+
+            rate_book = _rate_book(rate_books, rate_date)
+            if not rate_book.available:
+                _mark_pending(cost_ids)
+                continue
+            try:
+                rate = rate_book.rate(currency, job.to_currency)
+            except ValueError:
+                # waluta bez kursu w tabeli – jak przy braku kursów, uzupełni reconcile_pending_conversions
+                logger.warning("No %s → %s rate (%s), costs left pending", currency, job.to_currency, rate_date or "latest")
+                _mark_pending(cost_ids)
+                continue
+            _apply_rate(cost_ids, rate)
+
+        job.last_cost_id = chunk[-1][0]
+        job.converted_costs = F("converted_costs") + len(chunk)
+        job.save(update_fields=["last_cost_id", "converted_costs", "updated_at"])
+
+        # unieważnia cache podsumowań po każdym chunku
+        Trip.objects.filter(trip_id=job.trip_id).update(version=F("version") + 1)
+
+    return True
+
+
+def _apply_rate(cost_ids, rate):
+    rate = Value(rate, output_field=DecimalField(max_digits=20, decimal_places=10))
+
+    Splited.objects.filter(cost_id__in=cost_ids).update(
+        rate=rate,
+        split_value_main_current=Round(F("split_value") * rate, precision=2),
+        to_pay_back_value_main_current=Round(F("to_pay_back_value") * rate, precision=2),
+        pay_back_value_main_current=Round(F("pay_back_value") * rate, precision=2),
+    )
+    Cost.objects.filter(cost_id__in=cost_ids).update(
+        overall_value_main_currency=Round(F("overall_value") * rate, precision=2),
+        conversion_pending=False,
+    )
+    Payment.objects.filter(split__cost_id__in=cost_ids).update(
+        amount_main=Round(F("amount") * rate, precision=2),
+    )
+
+
+def _mark_pending(cost_ids):
+    """
+    Brak kursu → jak przy dodawaniu kosztu offline; uzupełni reconcile_pending_conversions.
+    """
+    Splited.objects.filter(cost_id__in=cost_ids).update(
+        rate=None,
+        split_value_main_current=None,
+        to_pay_back_value_main_current=None,
+        pay_back_value_main_current=None,
+    )
+    Cost.objects.filter(cost_id__in=cost_ids).update(overall_value_main_currency=None, conversion_pending=True)
+    Payment.objects.filter(split__cost_id__in=cost_ids).update(amount_main=None)
+
+
+# ======================================================
+# PROGRESS
+# ======================================================
+
+def get_currency_change_job(trip_id):
+    """
+    Ostatni job zmiany waluty tripu (albo None).
+    """
+    return CurrencyChangeJob.objects.filter(trip_id=trip_id).order_by("-created_at", "-id").first()
+
+
+def get_resumable_jobs(job_ids=None, include_failed=False):
+    statuses = ACTIVE_STATUSES + ((CurrencyChangeJob.FAILED,) if include_failed else ())
+    jobs = CurrencyChangeJob.objects.filter(status__in=statuses).order_by("id")
+    if job_ids:
+        jobs = jobs.filter(id__in=job_ids)
+    return list(jobs)
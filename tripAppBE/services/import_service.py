@@ -0,0 +1,260 @@
+import csv
+import io
+import json
+import time
+from datetime import date
+from decimal import Decimal, InvalidOperation
+
+from django.db import transaction
+
+from tripAppBE.models import CostEvent, Trip, TripParticipant
+from tripAppBE.services.convert_currency_service import RateHistory
+from tripAppBE.services.cost_service import _build_cost, _bump_trip_version, _insert_cost_batch
+from tripAppBE.services.ledger_service import refresh_ledger
+from tripAppBE.services.dto.cost_dto import SplitDTO
+
+
+# ======================================================
+# CONFIG
+# ======================================================
+
+DEFAULT_BATCH_SIZE = 1000
+MAX_REPORTED_ERRORS = 100
+FORMATS = ("csv", "jsonl")
+
+# kwoty kosztów i splitów: DecimalField(max_digits=10, decimal_places=2) → 8 cyfr przed przecinkiem
+MAX_AMOUNT = Decimal("99999999.99")
+
+
+class ImportRowError(ValueError):
+    pass
+
+
+# ======================================================
+# PARSING (generatory, wiersz po wierszu)
+# ======================================================
+
+def _as_text(stream):
+    if isinstance(stream, io.TextIOBase):
+        return stream
+    return io.TextIOWrapper(stream, encoding="utf-8-sig", newline="")
+
+
+def iter_csv_rows(stream):
+    """
+    Kolumny: title, payer_id, value, currency, description, date, splits
+    splits: "participant_id:value;participant_id:value"
+    """
+    for row in csv.DictReader(_as_text(stream)):
+        yield row
+
+
+def iter_jsonl_rows(stream):
+    """
+    Jeden obiekt JSON na linię, te same pola co CSV;
+    splits jako lista {"participant_id", "split_value"} albo string jak w CSV.
+    """
+    for line in _as_text(stream):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError as e:
+            yield ImportRowError(f"Invalid JSON: {e}")
+
+
+def iter_rows(stream, file_format):
+    if file_format == "csv":
+        return iter_csv_rows(stream)
+    if file_format == "jsonl":
+        return iter_jsonl_rows(stream)
+    raise ValueError(f"Unsupported import format '{file_format}'")
+
+
+# ======================================================
+# VALIDATION
+# ======================================================
+
+def _decimal(value, field):
+    """
+    Kwota z wiersza importu, zaokrąglona do groszy. Wartości, których nie przyjmie
+    kolumna (ujemne, nieskończone, powyżej MAX_AMOUNT), odrzucają wiersz – inaczej
+    błąd wyszedłby dopiero przy zapisie całej paczki.
+    """
+    try:
+        result = Decimal(str(value).strip())
+        if not result.is_finite() or result < 0 or result > MAX_AMOUNT:
+            raise ImportRowError(f"Invalid {field}: {value!r}")
+        # quantize też w try – np. 1e30 przekracza precyzję kontekstu
+        return result.quantize(Decimal("0.01"))
+    except (InvalidOperation, AttributeError):
+        raise ImportRowError(f"Invalid {field}: {value!r}")
+
+
+def _parse_splits(raw):
+    if isinstance(raw, str):
+        raw = [
+            dict(zip(("participant_id", "split_value"), part.split(":", 1)))
+            for part in raw.split(";") if part.strip()
+        ]
+    if not raw:
+        raise ImportRowError("Missing splits")
+
+    splits = []
+    for item in raw:
+        try:
+            participant_id = int(item["participant_id"])
+        except (KeyError, TypeError, ValueError):
+            raise ImportRowError(f"Invalid split: {item!r}")
+        splits.append(SplitDTO(participant_id=participant_id, split_value=_decimal(item.get("split_value"), "split_value")))
+    return splits
+
+
+def parse_row(row, participant_ids):
+    """
+    Waliduje wiersz importu i zwraca argumenty dla _build_cost.
+    """
+    if isinstance(row, ImportRowError):
+        raise row
+    if not isinstance(row, dict):
+        raise ImportRowError("Row is not an object")
+
+    title = (row.get("title") or "").strip()
+    if not title:
+        raise ImportRowError("Missing title")
+
+    try:
+        payer_id = int(row.get("payer_id"))
+    except (TypeError, ValueError):
+        raise ImportRowError(f"Invalid payer_id: {row.get('payer_id')!r}")
+
+    currency = (row.get("currency") or "").strip().upper()
+    if not currency:
+        raise ImportRowError("Missing currency")
+
+    rate_date = None
+    if row.get("date"):
+        try:
+            rate_date = date.fromisoformat(str(row["date"]).strip())
+        except ValueError:
+            raise ImportRowError(f"Invalid date: {row['date']!r}")
+
+    splits = _parse_splits(row.get("splits"))
+
+    unknown = {payer_id, *(s.participant_id for s in splits)} - participant_ids
+    if unknown:
+        raise ImportRowError(f"Participants not in trip: {sorted(unknown)}")
+
+    return {
+        "title": title[:30],
+        "payer_participant_id": payer_id,
+        "overall_value": _decimal(row.get("value"), "value"),
+        "split_object_list": splits,
+        "currency": currency,
+        "description": (row.get("description") or "")[:250],
+        "rate_date": rate_date,
+    }
+
+
+# ======================================================
+# IMPORT
+# ======================================================
+
+def _rate_history_for(trip, parsed):
+    """
+    Kursy historyczne tylko dla dat i walut jednej paczki – nie cała tabela CurrencyRate.
+    """
+    converted = [values for _, values in parsed if values["currency"] != trip.default_currency]
+    dates = [values["rate_date"] for values in converted if values["rate_date"] is not None]
+    if not dates:
+        return None
+    currencies = {values["currency"] for values in converted} | {trip.default_currency}
+    return RateHistory.load(start=min(dates), end=max(dates), currencies=currencies)
+
+
+def _import_batch(trip, parsed, report):
+    """
+    Buduje i zapisuje jedną paczkę sparsowanych wierszy [(nr wiersza, argumenty _build_cost)].
+    Zwraca pary ledgera zapisanych splitów.
+    """
+    rate_history = _rate_history_for(trip, parsed)
+    rate_books = {}  # per paczka: historia paczki ma tylko jej waluty
+    built = []
+
+    for line_no, values in parsed:
+        try:
+            cost, splits = _build_cost(trip, rate_books=rate_books, rate_history=rate_history, **values)
+        except ValueError as e:
+            _reject(report, line_no, e)
+            continue
+        # po przeliczeniu na walutę tripu kwota może już nie zmieścić się w kolumnie
+        if (cost.overall_value_main_currency or 0) > MAX_AMOUNT:
+            _reject(report, line_no, ImportRowError(f"Value in {trip.default_currency} is too large"))
+            continue
+        built.append((cost, splits))
+
+    if not built:
+        return set()
+
+    pairs = _insert_cost_batch(built, update_ledger=False)
+    report["imported"] += len(built)
+    return pairs
+
+
+def _reject(report, line_no, error):
+    report["failed"] += 1
+    if len(report["errors"]) < MAX_REPORTED_ERRORS:
+        report["errors"].append({"row": line_no, "message": str(error)})
+
+
+def import_costs(trip_id, rows, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Strumieniowy import kosztów do tripu.
+    rows: iterator słowników (iter_rows) – nic nie jest ładowane w całości do pamięci,
+    zapis w paczkach po batch_size (dwa bulk inserty na paczkę, logika jak w add_cost).
+    Ledger i wersja tripu odświeżane raz, po ostatniej paczce.
+    """
+    trip = Trip.objects.filter(trip_id=trip_id).first()
+    if not trip:
+        return {"ok": False, "message": "Trip not found"}
+
+    participant_ids = set(TripParticipant.objects.filter(trip_id=trip_id).values_list("id", flat=True))
+
+    started = time.monotonic()
+    report = {"imported": 0, "failed": 0, "errors": []}
+    pairs = set()
+    parsed = []
+
+    try:
+        for line_no, row in enumerate(rows, start=1):
+            try:
+                parsed.append((line_no, parse_row(row, participant_ids)))
+            except ValueError as e:
+                _reject(report, line_no, e)
+                continue
+
+            if len(parsed) >= batch_size:
+                pairs |= _import_batch(trip, parsed, report)
+                parsed = []
+
+        if parsed:
+            pairs |= _import_batch(trip, parsed, report)
+    finally:
+        # także po przerwanym imporcie – zapisane paczki muszą trafić do ledgera
+        if pairs:
+            with transaction.atomic():
+                refresh_ledger(pairs, CostEvent.COST_ADDED)
+                _bump_trip_version(trip_id=trip.trip_id)
+
+    seconds = time.monotonic() - started
+    imported, failed = report["imported"], report["failed"]
+    return {
+        "ok": True,
+        "message": f"Imported {imported} costs, {failed} rows rejected",
+        "imported": imported,
+        "failed": failed,
+        "errors": report["errors"],
+        "seconds": round(seconds, 3),
+        "rows_per_second": round((imported + failed) / seconds, 1) if seconds else None,
+    }
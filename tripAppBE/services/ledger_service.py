@@ -0,0 +1,460 @@
+from collections import defaultdict
+from datetime import timedelta
+from decimal import Decimal
+from functools import reduce
+from operator import or_
+
+from django.db import transaction
+from django.db.models import Q, Sum, F, Value, DecimalField, Exists, OuterRef, Max, Count, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from tripAppBE.models import BalanceLedger, CostEvent, Splited, Trip, TripBalanceSnapshot
+from tripAppBE.services.money import cents_sum, from_cents
+
+
+# ======================================================
+# CONFIG
+# ======================================================
+
+# powyżej tylu grup par (trip + wspólny wierzyciel albo dłużnik) taniej przeliczyć
+# ledger całych tripów niż budować OR po grupach
+MAX_GROUPS_PER_REFRESH = 200
+
+LEDGER_KEY_FIELDS = ("trip_id", "debtor_id", "creditor_id", "currency")
+
+ZERO = Decimal("0.00")
+
+# snapshot obejmuje tylko zdarzenia starsze niż tyle sekund – transakcje, które
+# wstawiły zdarzenia o niższych id, są już wtedy zatwierdzone
+SNAPSHOT_SETTLE_SECONDS = 60
+
+# domyślnie snapshot tripu, gdy od poprzedniego przybyło tyle zdarzeń
+SNAPSHOT_MIN_EVENTS = 500
+
+
+# ======================================================
+# AGGREGATION
+# ======================================================
+
+def _open_debts(splits_qs):
+    """
+    Otwarte długi z splitów: (trip, dłużnik, wierzyciel, waluta) → amount, amount_main.
+    """
+    money = DecimalField(max_digits=12, decimal_places=2)
+    return (
+        splits_qs
+        .filter(payment=False)
+        .exclude(participant_id=F("payer_id"))
+        .values(
+            ledger_trip_id=F("trip_id"),
+            ledger_debtor_id=F("participant_id"),
+            ledger_creditor_id=F("payer_id"),
+            ledger_currency=F("cost__payed_currency"),
+        )
+        .annotate(
+            amount=Sum("to_pay_back_value", output_field=money),
+            amount_main=Sum(Coalesce("to_pay_back_value_main_current", Value(Decimal("0.00"))), output_field=money),
+        )
+    )
+
+
+def _as_ledger_rows(debts):
+    return [
+        BalanceLedger(
+            trip_id=row["ledger_trip_id"],
+            debtor_id=row["ledger_debtor_id"],
+            creditor_id=row["ledger_creditor_id"],
+            currency=row["ledger_currency"],
+            amount=row["amount"],
+            amount_main=row["amount_main"],
+        )
+        for row in debts
+    ]
+
+
+def _ledger_values(ledger_qs):
+    """
+    (trip, dłużnik, wierzyciel, waluta) → (amount, amount_main) dla wierszy ledgera.
+    """
+    return {
+        tuple(row[:4]): tuple(row[4:])
+        for row in ledger_qs.values_list(*LEDGER_KEY_FIELDS, "amount", "amount_main")
+    }
+
+
+def _row_values(rows):
+    return {
+        (row.trip_id, row.debtor_id, row.creditor_id, row.currency): (row.amount, row.amount_main)
+        for row in rows
+    }
+
+
+def _lock_trips(trip_ids):
+    """
+    Serializuje zapisy ledgera per trip (blokada wierszy Trip do końca transakcji).
+    FOR NO KEY UPDATE – jak UPDATE wersji; nie blokuje sprawdzeń kluczy obcych
+    (FOR KEY SHARE) przy zapisach bez blokady tripu, np. w record_payment.
+    """
+    list(
+        Trip.objects.select_for_update(no_key=True)
+        .filter(trip_id__in=trip_ids)
+        .order_by("trip_id")
+        .values_list("trip_id", flat=True)
+    )
+
+
+def _lock_open_splits(splits_qs):
+    """
+    Blokuje otwarte splity przed agregacją do ledgera. record_payment zmienia split i ledger
+    bez blokady tripu – trwająca spłata kończy się, zanim przeliczymy jej parę.
+    """
+    list(
+        splits_qs.filter(payment=False)
+        .select_for_update(of=("self",))
+        .order_by("id")
+        .values_list("id", flat=True)
+    )
+
+
+# ======================================================
+# EVENTS
+# ======================================================
+
+def record_event(trip_id, kind, cost_id=None):
+    """
+    Zdarzenie bez wpływu na bilans (np. zmiana nazwy kosztu).
+    """
+    CostEvent.objects.create(trip_id=trip_id, kind=kind, cost_id=cost_id)
+
+
+def _record_changes(before, after, kind, cost_id=None):
+    """
+    Zapisuje delty ledgera (after - before) jako zdarzenia, jeden bulk insert.
+    Wołać w transakcji, która zmieniła ledger.
+    """
+    events = []
+    for key in sorted(before.keys() | after.keys()):
+        old_amount, old_main = before.get(key, (ZERO, ZERO))
+        new_amount, new_main = after.get(key, (ZERO, ZERO))
+        if new_amount == old_amount and new_main == old_main:
+            continue
+
+        trip_id, debtor_id, creditor_id, currency = key
+        events.append(CostEvent(
+            trip_id=trip_id, kind=kind, cost_id=cost_id,
+            debtor_id=debtor_id, creditor_id=creditor_id, currency=currency,
+            amount=new_amount - old_amount, amount_main=new_main - old_main,
+        ))
+
+    CostEvent.objects.bulk_create(events, batch_size=1000)
+
+
+# ======================================================
+# INCREMENTAL MAINTENANCE
+# ======================================================
+
+def ledger_pairs(splits_qs):
+    """
+    Pary (trip, dłużnik, wierzyciel), których dotyczą podane splity.
+    Wołać PRZED zmianą/usunięciem splitów, wynik przekazać do refresh_ledger.
+    """
+    return set(
+        splits_qs
+        .exclude(participant_id=F("payer_id"))
+        .values_list("trip_id", "participant_id", "payer_id")
+        .distinct()
+    )
+
+
+def _pair_groups(pairs):
+    """
+    Grupuje pary po (trip, wierzyciel) albo (trip, dłużnik) – którego podziału wychodzi mniej.
+    Koszt podzielony między wielu uczestników daje jedną grupę zamiast pary na dłużnika.
+    Zwraca [(trip, "creditor"/"debtor", id, {ids drugiej strony})].
+    """
+    by_creditor = defaultdict(set)
+    by_debtor = defaultdict(set)
+    for t, d, c in pairs:
+        by_creditor[(t, c)].add(d)
+        by_debtor[(t, d)].add(c)
+
+    if len(by_debtor) < len(by_creditor):
+        return [(t, "debtor", d, creditors) for (t, d), creditors in by_debtor.items()]
+    return [(t, "creditor", c, debtors) for (t, c), debtors in by_creditor.items()]
+
+
+def _splits_of(groups):
+    return Splited.objects.filter(reduce(or_, (
+        Q(trip_id=t, payer_id=key, participant_id__in=others) if side == "creditor"
+        else Q(trip_id=t, participant_id=key, payer_id__in=others)
+        for t, side, key, others in groups
+    )))
+
+
+def _ledger_of(groups):
+    return BalanceLedger.objects.filter(reduce(or_, (
+        Q(trip_id=t, creditor_id=key, debtor_id__in=others) if side == "creditor"
+        else Q(trip_id=t, debtor_id=key, creditor_id__in=others)
+        for t, side, key, others in groups
+    )))
+
+
+def refresh_ledger(pairs, kind, cost_id=None):
+    """
+    Przelicza wiersze ledgera dla par (trip, dłużnik, wierzyciel) z aktualnych splitów.
+    Musi działać w transakcji mutacji, która zmieniła splity.
+    Różnice zapisuje jako zdarzenia `kind`.
+    """
+    pairs = {(int(t), int(d), int(c)) for t, d, c in pairs}
+    if not pairs:
+        return
+
+    trip_ids = {t for t, _, _ in pairs}
+    groups = _pair_groups(pairs)
+    if len(groups) > MAX_GROUPS_PER_REFRESH:
+        rebuild_ledger(trip_ids, kind, cost_id)
+        return
+
+    with transaction.atomic():
+        _lock_trips(trip_ids)
+
+        splits_qs = _splits_of(groups)
+        _lock_open_splits(splits_qs)
+        rows = _as_ledger_rows(_open_debts(splits_qs))
+
+        ledger_qs = _ledger_of(groups)
+        before = _ledger_values(ledger_qs)
+        ledger_qs.delete()
+        BalanceLedger.objects.bulk_create(rows)
+
+        _record_changes(before, _row_values(rows), kind, cost_id)
+
+
+def shift_ledger(trip_id, debtor_id, creditor_id, currency, amount, amount_main, kind, cost_id=None):
+    """
+    Przesuwa jeden wiersz ledgera o deltę (UPDATE z F(), bez agregacji splitów).
+    Brak wiersza → para nie miała otwartych długów, delta jest pełną wartością.
+    Wołający musi trzymać blokadę zmienionego splitu (UPDATE albo SELECT ... FOR UPDATE).
+    """
+    if not amount and not amount_main:
+        return
+
+    CostEvent.objects.create(
+        trip_id=trip_id, kind=kind, cost_id=cost_id,
+        debtor_id=debtor_id, creditor_id=creditor_id, currency=currency,
+        amount=amount, amount_main=amount_main,
+    )
+
+    updated = BalanceLedger.objects.filter(
+        trip_id=trip_id, debtor_id=debtor_id, creditor_id=creditor_id, currency=currency
+    ).update(amount=F("amount") + amount, amount_main=F("amount_main") + amount_main)
+
+    if not updated:
+        BalanceLedger.objects.create(
+            trip_id=trip_id, debtor_id=debtor_id, creditor_id=creditor_id,
+            currency=currency, amount=amount, amount_main=amount_main,
+        )
+
+
+def prune_ledger(trip_id, debtor_id, creditor_id, kind, cost_id=None):
+    """
+    Usuwa wiersze pary, dla których nie został żaden otwarty split
+    (ten sam stan, który dałby refresh_ledger). Niezerowe resztki idą do zdarzeń.
+    """
+    open_splits = Splited.objects.filter(
+        trip_id=OuterRef("trip_id"),
+        participant_id=OuterRef("debtor_id"),
+        payer_id=OuterRef("creditor_id"),
+        cost__payed_currency=OuterRef("currency"),
+        payment=False,
+    )
+    ledger_qs = BalanceLedger.objects.filter(
+        trip_id=trip_id, debtor_id=debtor_id, creditor_id=creditor_id
+    ).filter(~Exists(open_splits))
+
+    before = _ledger_values(ledger_qs)
+    if before:
+        ledger_qs.delete()
+        _record_changes(before, {}, kind, cost_id)
+
+
+def clear_participant_ledger(trip_id, participant_id):
+    """
+    Zeruje ledger uczestnika usuwanego z tripu (jego splity znikają kaskadowo)
+    i zapisuje to jako zdarzenia – historia przed usunięciem zostaje w dzienniku.
+    Wołać w transakcji usunięcia, przed DELETE uczestnika.
+    """
+    with transaction.atomic():
+        _lock_trips([trip_id])
+        ledger_qs = BalanceLedger.objects.filter(
+            Q(debtor_id=participant_id) | Q(creditor_id=participant_id), trip_id=trip_id
+        )
+        before = _ledger_values(ledger_qs)
+        ledger_qs.delete()
+        _record_changes(before, {}, CostEvent.PARTICIPANT_REMOVED)
+
+
+def rebuild_ledger(trip_ids=None, kind=CostEvent.REBUILD, cost_id=None):
+    """
+    Buduje ledger od zera (dla podanych tripów albo całej bazy).
+    Różnice względem poprzedniego stanu zapisuje jako zdarzenia `kind`.
+    """
+    with transaction.atomic():
+        splits_qs = Splited.objects.all()
+        ledger_qs = BalanceLedger.objects.all()
+        if trip_ids is not None:
+            _lock_trips(trip_ids)
+            splits_qs = splits_qs.filter(trip_id__in=trip_ids)
+            ledger_qs = ledger_qs.filter(trip_id__in=trip_ids)
+            _lock_open_splits(splits_qs)
+
+        before = _ledger_values(ledger_qs)
+        rows = _as_ledger_rows(_open_debts(splits_qs))
+
+        ledger_qs.delete()
+        BalanceLedger.objects.bulk_create(rows, batch_size=1000)
+
+        _record_changes(before, _row_values(rows), kind, cost_id)
+
+
+def diff_ledger(trip_ids=None):
+    """
+    Porównuje ledger z wartościami przeliczonymi od zera ze splitów.
+    Zwraca listę {"key": (trip, dłużnik, wierzyciel, waluta), "expected": ..., "actual": ...}.
+    """
+    splits_qs = Splited.objects.all()
+    ledger_qs = BalanceLedger.objects.all()
+    if trip_ids is not None:
+        splits_qs = splits_qs.filter(trip_id__in=trip_ids)
+        ledger_qs = ledger_qs.filter(trip_id__in=trip_ids)
+
+    expected = _row_values(_as_ledger_rows(_open_debts(splits_qs)))
+    actual = _ledger_values(ledger_qs)
+
+    return [
+        {"key": key, "expected": expected.get(key), "actual": actual.get(key)}
+        for key in sorted(expected.keys() | actual.keys())
+        if expected.get(key) != actual.get(key)
+    ]
+
+
+# ======================================================
+# HISTORY
+# ======================================================
+
+def _latest_snapshot(trip_id, at=None):
+    snapshots = TripBalanceSnapshot.objects.filter(trip_id=trip_id)
+    if at is not None:
+        snapshots = snapshots.filter(as_of__lte=at)
+    return snapshots.order_by("-as_of", "-id").first()
+
+
+def _replay(trip_id, snapshot, events_qs):
+    """
+    Stan snapshotu + suma zdarzeń (agregowana w bazie) → {(dłużnik, wierzyciel, waluta): (amount, amount_main)}.
+    """
+    balances = {}
+    if snapshot is not None:
+        balances = {
+            (debtor_id, creditor_id, currency): (Decimal(amount), Decimal(amount_main))
+            for debtor_id, creditor_id, currency, amount, amount_main in snapshot.balances
+        }
+
+    tail = (
+        events_qs
+        .filter(debtor_id__isnull=False)
+        .values_list("debtor_id", "creditor_id", "currency")
+        .annotate(total=cents_sum("amount"), total_main=cents_sum("amount_main"))
+        .order_by()
+    )
+    for debtor_id, creditor_id, currency, cents, cents_main in tail:
+        key = (debtor_id, creditor_id, currency)
+        old_amount, old_main = balances.get(key, (ZERO, ZERO))
+        balances[key] = (old_amount + from_cents(cents), old_main + from_cents(cents_main))
+
+    return {key: value for key, value in balances.items() if any(value)}
+
+
+def take_snapshot(trip_id, now=None):
+    """
+    Snapshot bilansu tripu: poprzedni snapshot + zdarzenia do (now - SNAPSHOT_SETTLE_SECONDS).
+    Liczony ze zdarzeń, nie z ledgera – nie wymaga blokady tripu.
+    Zwraca snapshot albo None, gdy od poprzedniego nie przybyło zdarzeń.
+    """
+    cutoff = (now or timezone.now()) - timedelta(seconds=SNAPSHOT_SETTLE_SECONDS)
+    previous = _latest_snapshot(trip_id)
+    last_event_id = previous.last_event_id if previous else 0
+    events_qs = CostEvent.objects.filter(trip_id=trip_id, id__gt=last_event_id)
+    # zdarzenia o id <= ostatniego sprzed cutoff zostały wstawione wcześniej → są zatwierdzone
+    upto = events_qs.filter(created_at__lte=cutoff).aggregate(last=Max("id"))["last"] or last_event_id
+    if upto == last_event_id:
+        # brak nowych zdarzeń (snapshot z last_event_id = 0 to wyłącznie baza z migracji)
+        return None
+
+    balances = _replay(trip_id, previous, events_qs.filter(id__lte=upto))
+    return TripBalanceSnapshot.objects.create(
+        trip_id=trip_id,
+        as_of=cutoff,
+        last_event_id=upto,
+        balances=[
+            [debtor_id, creditor_id, currency, str(amount), str(amount_main)]
+            for (debtor_id, creditor_id, currency), (amount, amount_main) in sorted(balances.items())
+        ],
+    )
+
+
+def trips_due_for_snapshot(min_events=SNAPSHOT_MIN_EVENTS, trip_ids=None):
+    """
+    Id tripów z co najmniej min_events zdarzeniami od ostatniego snapshotu (jedno zapytanie).
+    """
+    last_snapshot = (
+        TripBalanceSnapshot.objects
+        .filter(trip_id=OuterRef("trip_id"))
+        .order_by("-as_of", "-id")
+        .values("last_event_id")[:1]
+    )
+    trips = (
+        Trip.objects
+        .annotate(snapshot_event_id=Coalesce(Subquery(last_snapshot), 0))
+        .annotate(tail=Count("events", filter=Q(events__id__gt=F("snapshot_event_id"))))
+        .filter(tail__gte=min_events)
+    )
+    if trip_ids is not None:
+        trips = trips.filter(trip_id__in=trip_ids)
+    return list(trips.order_by("trip_id").values_list("trip_id", flat=True))
+
+
+def get_ledger_as_of(trip_id, at):
+    """
+    Stan ledgera tripu na chwilę `at`: ostatni snapshot sprzed `at` + krótki ogon zdarzeń.
+    Zwraca {(dłużnik, wierzyciel, waluta): (amount, amount_main)}.
+    ValueError, gdy historia tripu zaczyna się później (snapshot bazowy z migracji).
+    """
+    snapshot = _latest_snapshot(trip_id, at)
+    if snapshot is None:
+        first = TripBalanceSnapshot.objects.filter(trip_id=trip_id).order_by("as_of", "id").first()
+        if first is not None and first.last_event_id == 0:
+            raise ValueError(f"Balance history starts at {first.as_of:%Y-%m-%d %H:%M}")
+
+    events_qs = CostEvent.objects.filter(
+        trip_id=trip_id, id__gt=snapshot.last_event_id if snapshot else 0, created_at__lte=at
+    )
+    return _replay(trip_id, snapshot, events_qs)
+
+
+# ======================================================
+# READS
+# ======================================================
+
+def get_participant_ledger(trip_id, participant_id):
+    """
+    Wiersze ledgera, w których uczestnik jest dłużnikiem albo wierzycielem
+    (indeksy: unique (trip, debtor, ...) i (trip, creditor)).
+    """
+    return (
+        BalanceLedger.objects
+        .filter(Q(debtor_id=participant_id) | Q(creditor_id=participant_id), trip_id=trip_id)
+        .select_related("debtor", "creditor", "trip")
+        .order_by("id")
+    )
@@ -0,0 +1,48 @@
+from decimal import Decimal, ROUND_HALF_UP
+
+from django.db.models import BigIntegerField, F, Sum
+from django.db.models.functions import Cast, Round
+
+# kwoty w bazie zostają DecimalField(decimal_places=2); w pętlach liczymy na int (grosze)
+CENT = Decimal("0.01")
+ONE = Decimal("1")
+
+
+def to_cents(value):
+    """
+    Decimal/str/int → int groszy (ROUND_HALF_UP jak przy zapisie kwot).
+    """
+    if not isinstance(value, Decimal):
+        value = Decimal(str(value))
+    return int(value.scaleb(2).quantize(ONE, rounding=ROUND_HALF_UP))
+
+
+def from_cents(cents):
+    """
+    int groszy → Decimal z dwoma miejscami po przecinku.
+    """
+    return Decimal(int(cents)).scaleb(-2)
+
+
+def convert_cents(cents, rate):
+    """
+    Przeliczenie kwoty w groszach po kursie (Decimal), zaokrąglone do grosza.
+    """
+    return int((cents * rate).quantize(ONE, rounding=ROUND_HALF_UP))
+
+
+def as_cents(expression):
+    """
+    Wyrażenie ORM: kwota DecimalField → bigint groszy liczony w bazie
+    (driver zwraca int, bez budowania Decimal per wiersz).
+    """
+    if isinstance(expression, str):
+        expression = F(expression)
+    return Cast(Round(expression * 100), BigIntegerField())
+
+
+def cents_sum(field, **kwargs):
+    """
+    SUM(field) w groszach jako bigint; None dla pustej grupy.
+    """
+    return as_cents(Sum(field, **kwargs))
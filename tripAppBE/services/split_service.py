@@ -0,0 +1,135 @@
+from decimal import Decimal
+
+import numpy as np
+
+from tripAppBE.models import TripParticipant
+from tripAppBE.services.dto.cost_dto import SplitDTO
+from tripAppBE.services.money import to_cents, from_cents
+
+# ======================================================
+# STRATEGIES
+# ======================================================
+
+EQUAL = "equal"
+SHARES = "shares"
+PERCENT = "percent"
+EXACT = "exact"
+
+STRATEGIES = (EQUAL, SHARES, PERCENT, EXACT)
+
+# maks. liczba miejsc po przecinku udziałów / procentów
+MAX_SHARE_DECIMALS = 6
+
+# powyżej tego iloczynu kwota × suma wag liczymy na int Pythona (bez przepełnienia int64)
+INT64_SAFE = 2 ** 62
+
+
+# ======================================================
+# ROUNDING ENGINE
+# ======================================================
+
+def allocate_cents(total_cents, weights):
+    """
+    Dzieli total_cents proporcjonalnie do wag metodą największych reszt.
+    Każdy dostaje floor(total × w / Σw), brakujące grosze trafiają do największych
+    reszt; remisy rozstrzyga kolejność wejścia (deterministycznie).
+    Suma wyniku == total_cents. Zwraca ndarray groszy.
+    """
+    weights = np.asarray(weights)
+    if weights.size == 0:
+        raise ValueError("No participants to split between")
+    if (weights < 0).any():
+        raise ValueError("Split weights must not be negative")
+
+    total_weight = int(weights.sum())
+    if total_weight <= 0:
+        raise ValueError("Split weights must not all be zero")
+
+    dtype = np.int64 if abs(total_cents) * total_weight < INT64_SAFE else object
+    scaled = weights.astype(dtype) * total_cents
+    base = scaled // total_weight
+    remainders = scaled - base * total_weight
+
+    leftover = total_cents - int(base.sum())
+    order = np.argsort(-remainders, kind="stable")
+    base[order[:leftover]] += 1
+    return base
+
+
+def _scaled_weights(values):
+    """
+    Udziały Decimal → wagi całkowite (wspólna skala 10^k).
+    """
+    values = [Decimal(str(v)) for v in values]
+    decimals = max((-v.as_tuple().exponent for v in values), default=0)
+    if decimals > MAX_SHARE_DECIMALS:
+        raise ValueError(f"Split shares support at most {MAX_SHARE_DECIMALS} decimal places")
+    scale = 10 ** max(decimals, 0)
+    return [int(v * scale) for v in values]
+
+
+# ======================================================
+# SPLITS
+# ======================================================
+
+def _participant_ids(trip_id, split_participants):
+    """
+    Id uczestników podziału; pusta lista → wszyscy uczestnicy tripu (jedno zapytanie).
+    """
+    trip_ids = list(
+        TripParticipant.objects.filter(trip_id=trip_id).order_by("id").values_list("id", flat=True)
+    )
+    if not split_participants:
+        return trip_ids
+
+    ids = [int(p.participant_id) for p in split_participants]
+    if len(set(ids)) != len(ids):
+        raise ValueError("Participant listed more than once")
+    if not set(ids) <= set(trip_ids):
+        raise ValueError("Participant is not part of this trip")
+    return ids
+
+
+def compute_splits(trip_id, strategy, overall_value, split_participants=None):
+    """
+    Liczy splity kosztu po stronie serwera.
+    - equal:   po równo między wybranych (brak listy → wszyscy uczestnicy tripu)
+    - shares:  proporcjonalnie do share każdego uczestnika
+    - percent: share w procentach, suma musi wynosić 100
+    - exact:   share to kwota uczestnika, suma musi równać się overall_value
+    Zwraca listę SplitDTO (wejście _build_cost); ValueError dla błędnych danych.
+    """
+    if strategy not in STRATEGIES:
+        raise ValueError(f"Unknown split strategy: {strategy}")
+
+    total_cents = to_cents(overall_value)
+    if total_cents <= 0:
+        raise ValueError("Cost value must be positive")
+
+    split_participants = split_participants or []
+    participant_ids = _participant_ids(trip_id, split_participants)
+
+    if strategy == EQUAL:
+        cents = allocate_cents(total_cents, np.ones(len(participant_ids), dtype=np.int64))
+    else:
+        if not split_participants:
+            raise ValueError(f"Strategy '{strategy}' needs participants with shares")
+        shares = [p.get("share") for p in split_participants]
+        if any(share is None for share in shares):
+            raise ValueError(f"Strategy '{strategy}' needs a share for every participant")
+
+        if strategy == EXACT:
+            cents = [to_cents(share) for share in shares]
+            if any(c < 0 for c in cents):
+                raise ValueError("Split values must not be negative")
+            if sum(cents) != total_cents:
+                raise ValueError("Split values do not add up to the cost value")
+        else:
+            if strategy == PERCENT and sum(Decimal(str(s)) for s in shares) != 100:
+                raise ValueError("Split percentages must add up to 100")
+            cents = allocate_cents(total_cents, _scaled_weights(shares))
+
+    return [
+        SplitDTO(participant_id=participant_id, split_value=from_cents(c))
+        for participant_id, c in zip(participant_ids, cents)
+    ]
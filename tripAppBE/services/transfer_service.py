@@ -0,0 +1,137 @@
+from decimal import Decimal
+
+import numpy as np
+from django.db.models import F, Value
+from django.db.models.functions import Coalesce
+
+from tripAppBE.models import Splited, Trip, TripParticipant
+from tripAppBE.services.money import from_cents, cents_sum
+
+
+# ======================================================
+# NET POSITIONS
+# ======================================================
+
+def get_net_positions(trip_id):
+    """
+    Saldo netto każdego uczestnika tripu w walucie głównej (w groszach).
+    Jedno zapytanie GROUP BY (wierzyciel, dłużnik) po otwartych splitach,
+    reszta to np.add.at po indeksach uczestników.
+    Zwraca (participant_ids: ndarray, net_cents: ndarray) – dodatnie = ma dostać.
+    """
+    rows = (
+        Splited.objects
+        .filter(trip_id=trip_id, payment=False)
+        .exclude(participant_id=F("payer_id"))
+        .values_list("payer_id", "participant_id")
+        .annotate(total=cents_sum(Coalesce("to_pay_back_value_main_current", Value(Decimal("0.00")))))
+        .order_by()
+    )
+    rows = list(rows)
+    if not rows:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+
+    creditors = np.fromiter((r[0] for r in rows), dtype=np.int64, count=len(rows))
+    debtors = np.fromiter((r[1] for r in rows), dtype=np.int64, count=len(rows))
+    cents = np.fromiter((r[2] for r in rows), dtype=np.int64, count=len(rows))
+
+    participant_ids, index = np.unique(np.concatenate([creditors, debtors]), return_inverse=True)
+    net = np.zeros(len(participant_ids), dtype=np.int64)
+    np.add.at(net, index[:len(rows)], cents)
+    np.subtract.at(net, index[len(rows):], cents)
+    return participant_ids, net
+
+
+# ======================================================
+# SOLVER
+# ======================================================
+
+def _match_equal_amounts(debtor_ids, debts, creditor_ids, credits):
+    """
+    Najpierw paruje dłużników i wierzycieli o identycznych kwotach (jeden przelew zamyka dwie osoby).
+    Zwraca (transfery, pozostali dłużnicy, pozostali wierzyciele).
+    """
+    common = np.intersect1d(debts, credits)
+    if common.size == 0:
+        return [], (debtor_ids, debts), (creditor_ids, credits)
+
+    used_d = np.zeros(debts.size, dtype=bool)
+    used_c = np.zeros(credits.size, dtype=bool)
+    transfers = []
+    for amount in common:
+        d_idx = np.flatnonzero(debts == amount)
+        c_idx = np.flatnonzero(credits == amount)
+        k = min(d_idx.size, c_idx.size)
+        used_d[d_idx[:k]] = True
+        used_c[c_idx[:k]] = True
+        transfers.extend(zip(debtor_ids[d_idx[:k]], creditor_ids[c_idx[:k]], np.full(k, amount)))
+
+    return (
+        transfers,
+        (debtor_ids[~used_d], debts[~used_d]),
+        (creditor_ids[~used_c], credits[~used_c]),
+    )
+
+
+def minimize_transfers(participant_ids, net_cents):
+    """
+    Redukuje salda netto do prawie minimalnej liczby przelewów.
+    1) równe kwoty dłużnik/wierzyciel → jeden przelew,
+    2) reszta: zachłanne dopasowanie największych sald, zwektoryzowane przez
+       scalenie sum skumulowanych (każdy punkt podziału = jeden przelew),
+       co daje najwyżej (dłużnicy + wierzyciele - 1) przelewów.
+    Zwraca listę (from_id, to_id, cents).
+    """
+    participant_ids = np.asarray(participant_ids, dtype=np.int64)
+    net_cents = np.asarray(net_cents, dtype=np.int64)
+
+    debtor_mask = net_cents < 0
+    creditor_mask = net_cents > 0
+    transfers, (debtor_ids, debts), (creditor_ids, credits) = _match_equal_amounts(
+        participant_ids[debtor_mask], -net_cents[debtor_mask],
+        participant_ids[creditor_mask], net_cents[creditor_mask],
+    )
+    if debts.size == 0 or credits.size == 0:
+        return [(int(f), int(t), int(v)) for f, t, v in transfers]
+
+    d_order = np.argsort(-debts, kind="stable")
+    c_order = np.argsort(-credits, kind="stable")
+    debtor_ids, debts = debtor_ids[d_order], debts[d_order]
+    creditor_ids, credits = creditor_ids[c_order], credits[c_order]
+
+    debt_edges = np.cumsum(debts)
+    credit_edges = np.cumsum(credits)
+    edges = np.union1d(debt_edges, credit_edges)
+    edges = edges[edges <= min(debt_edges[-1], credit_edges[-1])]
+
+    amounts = np.diff(edges, prepend=0)
+    from_idx = np.searchsorted(debt_edges, edges, side="left")
+    to_idx = np.searchsorted(credit_edges, edges, side="left")
+
+    transfers.extend(zip(debtor_ids[from_idx], creditor_ids[to_idx], amounts))
+    return [(int(f), int(t), int(v)) for f, t, v in transfers if v > 0]
+
+
+def get_suggested_transfers(trip_id):
+    """
+    Sugerowane przelewy zamykające wszystkie długi tripu w walucie głównej.
+    """
+    trip = Trip.objects.filter(trip_id=trip_id).only("default_currency").first()
+    if not trip:
+        return []
+
+    participant_ids, net_cents = get_net_positions(trip_id)
+    transfers = minimize_transfers(participant_ids, net_cents)
+    if not transfers:
+        return []
+
+    nicknames = dict(TripParticipant.objects.filter(trip_id=trip_id).values_list("id", "nickname"))
+    return [
+        {
+            "from": {"id": from_id, "nickname": nicknames.get(from_id)},
+            "to": {"id": to_id, "nickname": nicknames.get(to_id)},
+            "value": from_cents(cents),
+            "currency": trip.default_currency,
+        }
+        for from_id, to_id, cents in transfers
+    ]
@@ -2,6 +2,8 @@ import random
 
 from django.db import transaction, IntegrityError
 from tripAppBE.models import Trip, TripParticipant
+from tripAppBE.services.cost_service import _bump_trip_version
+from tripAppBE.services.ledger_service import clear_participant_ledger
 
 
 # ======================================================
@@ -69,10 +71,14 @@ def delete_trip(trip_id, user):
 # ======================================================
 
 def remove_participant_from_trip(trip_id, participant_id):
-    deleted, _ = TripParticipant.objects.filter(
-        trip_id=trip_id,
-        id=participant_id
-    ).delete()
+    # usunięcie uczestnika kasuje też jego splity → nowa wersja tripu (cache podsumowań)
+    with transaction.atomic():
+        _bump_trip_version(trip_id=trip_id)
+        clear_participant_ledger(trip_id, participant_id)
+        deleted, _ = TripParticipant.objects.filter(
+            trip_id=trip_id,
+            id=participant_id
+        ).delete()
 
     if deleted == 0:
         return {"ok": False, "message": "Participant not found"}
@@ -102,6 +108,7 @@ def join_trip(join_code, user):
 
             participant.user_id = user.id
             participant.save(update_fields=["user"])
+            _bump_trip_version(trip_id=participant.trip_id)
 
             return {
                 "ok": True,
@@ -123,7 +130,8 @@ def get_trip_list(user):
     return (
         Trip.objects
         .filter(participants__user_id=user.id)
-        .only("trip_id", "name", "trip_owner_id")
+        # pola TripType – bez doładowywania odroczonych pól per trip
+        .only("trip_id", "trip_code", "name", "description", "created_at", "trip_owner_id", "default_currency")
         .order_by("-created_at")
         .distinct()
     )
@@ -131,13 +139,12 @@ def get_trip_list(user):
 
 def get_trip_details(user, trip_id):
     """
-    Szczegóły tripa + uczestnicy
+    Szczegóły tripa (uczestników ładuje loader GraphQL)
     """
     return (
         Trip.objects
         .filter(participants__user_id=user.id, trip_id=trip_id)
         .select_related("trip_owner")
-        .prefetch_related("participants__user")
         .get()
     )
 
@@ -159,6 +166,7 @@ def add_placeholder_to_trip(trip_id, nickname):
                     Join_code=generate_code(),
                     user=None
                 )
+                _bump_trip_version(trip_id=trip_id)
 
             return {"ok": True, "message": "Placeholder added"}
 
@@ -185,6 +193,7 @@ def remove_user_from_participant_and_regenerate_code(trip_id, participant_id):
 
                 if updated == 0:
                     return {"ok": False, "message": "Participant not found"}
+                _bump_trip_version(trip_id=trip_id)
 
                 return {
                     "ok": True,
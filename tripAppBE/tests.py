@@ -1,3 +1,1088 @@
-from django.test import TestCase
+import json
+import threading
+import time
+from datetime import date, timedelta
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import StringIO
+from types import SimpleNamespace
+from unittest import mock, skipUnless
 
-# Create your tests here.
+import requests
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings, skipUnlessDBFeature
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from tripAppBE.management.commands.partition_by_trip import is_partitioned, partition_sql
+from tripAppBE.models import (
+    BalanceLedger, Cost, CostEvent, CurrencyChangeJob, CurrencyRate, Payment, Splited, Trip, TripBalanceSnapshot,
+    TripParticipant,
+)
+from tripAppBE.services import (
+    convert_currency_service, cost_service, currency_change_service, import_service, ledger_service, split_service,
+)
+from tripAppBE.services.ledger_service import ZERO, diff_ledger
+
+TRIP_LIST_QUERY = "{ tripList { tripId name participants { id nickname joinCode user { id username } } } }"
+
+
+class TripListQueryCountTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="owner", password="secret")
+        self.client.force_login(self.user)
+
+    def _add_trips(self, count, participants=4):
+        start = Trip.objects.count()
+        for i in range(start, start + count):
+            trip = Trip.objects.create(
+                trip_code=f"T{i:07d}", trip_owner=self.user, name=f"trip {i}", description="", default_currency="PLN"
+            )
+            TripParticipant.objects.create(trip=trip, user=self.user, nickname="owner", Join_code=f"O{i:07d}")
+            for j in range(participants - 1):
+                member = User.objects.create_user(username=f"u{i}_{j}")
+                TripParticipant.objects.create(trip=trip, user=member, nickname=member.username, Join_code=f"M{i:04d}{j:03d}")
+
+    def _query_trip_list(self):
+        response = self.client.post("/graphql/", json.dumps({"query": TRIP_LIST_QUERY}), content_type="application/json")
+        body = response.json()
+        self.assertNotIn("errors", body)
+        return body["data"]["tripList"]
+
+    def test_trip_list_participants_and_users_are_batched(self):
+        self._add_trips(2)
+        with self.assertNumQueries(5) as small:
+            trips = self._query_trip_list()
+        self.assertEqual(len(trips), 2)
+
+        self._add_trips(20)
+        # sesja + user, tripy, uczestnicy, użytkownicy – niezależnie od liczby tripów
+        with self.assertNumQueries(len(small.captured_queries)):
+            trips = self._query_trip_list()
+
+        self.assertEqual(len(trips), 22)
+        for trip in trips:
+            self.assertEqual(len(trip["participants"]), 4)
+            self.assertTrue(all(p["user"]["username"] for p in trip["participants"]))
+
+
+class QueryPlanTest(TestCase):
+    def test_service_queries_use_indexes(self):
+        out = StringIO()
+        try:
+            call_command("check_query_plans", costs=300, stdout=out)
+        except CommandError as e:
+            self.fail(f"{e}\n{out.getvalue()}")
+
+
+def _split(participant, value):
+    return SimpleNamespace(participant_id=participant.id, split_value=Decimal(value))
+
+
+UPDATE_PAYMENTS_MUTATION = """
+mutation($payments: [PaymentInput!]!) {
+  updatePayments(payments: $payments) { ok message results { ok } }
+}
+"""
+
+
+class PaymentQueryCountTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="owner", password="secret")
+        self.client.force_login(self.user)
+        self.trip = Trip.objects.create(
+            trip_code="TQRY0001", trip_owner=self.user, name="payments", description="", default_currency="PLN"
+        )
+        self.payer = TripParticipant.objects.create(trip=self.trip, user=self.user, nickname="owner", Join_code="QRY00001")
+
+    def _add_cost(self, debtors):
+        splits = [_split(self.payer, "10")] + [_split(debtor, "10") for debtor in debtors]
+        result = cost_service.add_cost(
+            self.trip.trip_id, "cost", self.payer.id, Decimal(10 * len(splits)), splits, "PLN", ""
+        )
+        return result["cost"]
+
+    def _add_debtors(self, count):
+        start = TripParticipant.objects.filter(trip=self.trip).count()
+        return [
+            TripParticipant.objects.create(trip=self.trip, nickname=f"d{i}", Join_code=f"QRY{i:05d}")
+            for i in range(start, start + count)
+        ]
+
+    def _update_payments(self, cost, debtors, value):
+        payments = [
+            {"costId": cost.cost_id, "participantId": debtor.id, "payBackValue": value, "currency": "PLN"}
+            for debtor in debtors
+        ]
+        response = self.client.post(
+            "/graphql/", json.dumps({"query": UPDATE_PAYMENTS_MUTATION, "variables": {"payments": payments}}),
+            content_type="application/json",
+        )
+        body = response.json()
+        self.assertNotIn("errors", body)
+        self.assertTrue(all(item["ok"] for item in body["data"]["updatePayments"]["results"]))
+
+    def _statements(self, call):
+        # bez SAVEPOINT / RELEASE z transaction.atomic – liczymy tylko pracę na danych
+        with CaptureQueriesContext(connection) as ctx:
+            result = call()
+        self.assertTrue(result["ok"])
+        return [q["sql"] for q in ctx.captured_queries if "SAVEPOINT" not in q["sql"]]
+
+    def test_update_payment_does_not_touch_other_splits(self):
+        small = self._add_debtors(1)
+        large = self._add_debtors(30)
+        # wersja tripu, SELECT ... FOR UPDATE, UPDATE splitu, INSERT spłaty, zdarzenie, UPDATE ledgera
+        # – tyle samo dla 2 i 31 splitów
+        for debtors in (small, large):
+            cost = self._add_cost(debtors)
+            statements = self._statements(lambda: cost_service.update_payment(cost.cost_id, debtors[0].id, 4))
+            self.assertEqual(len(statements), 6, statements)
+
+    def test_update_payment_updates_cost_only_when_split_status_changes(self):
+        debtors = self._add_debtors(2)
+        cost = self._add_cost(debtors)
+
+        # spłata całości zmienia status splitu – dochodzi przycięcie wyzerowanego wiersza ledgera
+        # (SELECT + DELETE) i UPDATE kosztu
+        statements = self._statements(lambda: cost_service.update_payment(cost.cost_id, debtors[0].id, 10))
+        self.assertEqual(len(statements), 9, statements)
+        self.assertTrue(statements[-1].startswith('UPDATE "tripAppBE_cost"'), statements[-1])
+        cost.refresh_from_db()
+        self.assertFalse(cost.payment)
+
+        self._statements(lambda: cost_service.update_payment(cost.cost_id, debtors[1].id, 10))
+        cost.refresh_from_db()
+        self.assertTrue(cost.payment)
+
+    def test_update_payments_is_batched(self):
+        debtors = self._add_debtors(30)
+        cost = self._add_cost(debtors)
+
+        with self.assertNumQueries(19) as one:
+            self._update_payments(cost, debtors[:1], 2)
+        # jeden SELECT ... FOR UPDATE, bulk_update i jedno odświeżenie ledgera – niezależnie od liczby spłat
+        with self.assertNumQueries(len(one.captured_queries)):
+            self._update_payments(cost, debtors, 5)
+
+        split = Splited.objects.get(cost=cost, participant=debtors[-1])
+        self.assertEqual(split.pay_back_value, Decimal("5.00"))
+
+
+# SQLite blokuje całą bazę – równoległe transakcje testujemy tylko na bazie z blokadami wierszy
+@skipUnlessDBFeature("has_select_for_update")
+class ConcurrentPaymentsTest(TransactionTestCase):
+    THREADS = 8
+
+    def setUp(self):
+        owner = User.objects.create_user(username="payer")
+        self.trip = Trip.objects.create(
+            trip_code="TPAY0001", trip_owner=owner, name="payments", description="", default_currency="PLN"
+        )
+        self.payer = TripParticipant.objects.create(trip=self.trip, user=owner, nickname="payer", Join_code="PAY00001")
+        self.debtor = TripParticipant.objects.create(trip=self.trip, nickname="debtor", Join_code="PAY00002")
+        self.cost = self._add_cost("100")
+
+    def _add_cost(self, value):
+        result = cost_service.add_cost(
+            self.trip.trip_id, "cost", self.payer.id, Decimal(value) * 2,
+            [_split(self.payer, value), _split(self.debtor, value)], "PLN", "",
+        )
+        return result["cost"]
+
+    def _run_concurrently(self, calls):
+        barrier = threading.Barrier(len(calls))
+        errors = []
+
+        def run(call):
+            try:
+                barrier.wait()
+                call()
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=run, args=(call,)) for call in calls]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+
+    def test_parallel_payments_and_ledger_refreshes_keep_ledger_consistent(self):
+        payments = self.THREADS - 2
+        calls = [lambda: cost_service.record_payment(self.cost.cost_id, self.debtor.id, 5)] * payments
+        # add_cost odświeża ledger tej samej pary (refresh_ledger) w trakcie spłat
+        calls += [lambda: self._add_cost("10")] * 2
+        version = Trip.objects.get(pk=self.trip.pk).version
+
+        self._run_concurrently(calls)
+
+        split = Splited.objects.get(cost=self.cost, participant=self.debtor)
+        self.assertEqual(split.pay_back_value, Decimal("5.00") * payments)
+        self.assertEqual(Payment.objects.filter(split=split).count(), payments)
+        self.assertEqual(diff_ledger([self.trip.trip_id]), [])
+        # record_payment podbija wersję po commicie, add_cost w swojej transakcji
+        self.assertEqual(Trip.objects.get(pk=self.trip.pk).version, version + len(calls))
+
+    def test_update_payment_and_record_payment_do_not_deadlock(self):
+        results = []
+        calls = [lambda: results.append(cost_service.record_payment(self.cost.cost_id, self.debtor.id, 5))] * 4
+        calls += [lambda: results.append(cost_service.update_payment(self.cost.cost_id, self.debtor.id, 50))] * 4
+
+        self._run_concurrently(calls)
+
+        self.assertTrue(all(result["ok"] for result in results), results)
+        split = Splited.objects.get(cost=self.cost, participant=self.debtor)
+        # korekty update_payment trzymają sumę wpisów równą spłaconej kwocie
+        paid = sum(Payment.objects.filter(split=split).values_list("amount", flat=True))
+        self.assertEqual(paid, split.pay_back_value)
+        self.assertEqual(diff_ledger([self.trip.trip_id]), [])
+
+
+class _RatesServer:
+    """
+    Lokalny serwer HTTP udający API kursów: liczy zapytania, odpowiada z opóźnieniem.
+    Ścieżka jak w CURRENCY_RATES['URL']: /{version}/{currency}.json. Kolejne zapytania
+    dostają kody ze `statuses`, po ich wyczerpaniu 200.
+    """
+
+    def __init__(self, delay=0.2, statuses=()):
+        self.delay = delay
+        self.statuses = list(statuses)
+        self.paths = []
+        self._lock = threading.Lock()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                with server._lock:
+                    server.paths.append(self.path)
+                    status = server.statuses.pop(0) if server.statuses else 200
+                time.sleep(server.delay)
+                if status != 200:
+                    self.send_response(status)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                version, currency = self.path.strip("/").removesuffix(".json").split("/")
+                rate_date = "2026-01-01" if version == "latest" else version
+                body = json.dumps({"date": rate_date, currency: {"usd": 1.1, "pln": 4.3}}).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self._httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self._httpd.server_port}/{{version}}/{{currency}}.json"
+
+    @property
+    def calls(self):
+        with self._lock:
+            return len(self.paths)
+
+    def __enter__(self):
+        threading.Thread(target=self._httpd.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+
+class SingleFlightRatesTest(TransactionTestCase):
+    CALLERS = 20
+
+    def setUp(self):
+        convert_currency_service.rate_cache.reset()
+        convert_currency_service.circuit_breaker.reset()
+
+    def test_parallel_callers_share_one_upstream_request(self):
+        barrier = threading.Barrier(self.CALLERS)
+        results = []
+
+        def fetch():
+            try:
+                barrier.wait()
+                results.append(convert_currency_service.fetch_currency_rates("EUR"))
+            finally:
+                connection.close()
+
+        with _RatesServer() as server, override_settings(CURRENCY_RATES={"URL": server.url}):
+            threads = [threading.Thread(target=fetch) for _ in range(self.CALLERS)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual(server.paths, ["/latest/eur.json"])
+        self.assertEqual(len(results), self.CALLERS)
+        self.assertTrue(all(rates == {"date": "2026-01-01", "usd": 1.1, "pln": 4.3} for rates in results))
+
+    def test_followers_wait_for_the_leaders_retries(self):
+        # lider: 503, backoff, 200 – razem dłużej niż blokada + jeden timeout zapytania
+        config = {"URL": None, "LOCK_TIMEOUT_SECONDS": 0.2, "REQUEST_TIMEOUT_SECONDS": 1, "RETRIES": 1,
+                  "BACKOFF_SECONDS": 0.2, "BACKOFF_MAX_SECONDS": 0.2}
+        barrier = threading.Barrier(self.CALLERS)
+        results = []
+
+        def fetch():
+            try:
+                barrier.wait()
+                results.append(convert_currency_service.fetch_currency_rates("EUR"))
+            finally:
+                connection.close()
+
+        with _RatesServer(delay=0.7, statuses=[503]) as server, \
+                override_settings(CURRENCY_RATES={**config, "URL": server.url}):
+            threads = [threading.Thread(target=fetch) for _ in range(self.CALLERS)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual(server.calls, 2)
+        self.assertTrue(all(rates["date"] == "2026-01-01" for rates in results), results)
+
+
+class CircuitBreakerTest(SimpleTestCase):
+    def setUp(self):
+        self.breaker = convert_currency_service.CircuitBreaker()
+
+    def test_opens_after_threshold_and_rejects_until_reset(self):
+        self.breaker.record_failure(2)
+        self.assertTrue(self.breaker.allow(60))
+        self.breaker.record_failure(2)
+        self.assertTrue(self.breaker.is_open)
+        self.assertFalse(self.breaker.allow(60))
+
+    def test_half_open_lets_one_trial_through(self):
+        self.breaker.record_failure(1)
+        # po czasie resetu: dokładnie jedno zapytanie próbne
+        self.assertTrue(self.breaker.allow(0))
+        self.assertFalse(self.breaker.allow(0))
+
+        # nieudana próba otwiera obwód od nowa
+        self.breaker.record_failure(1)
+        self.assertTrue(self.breaker.is_open)
+        self.assertFalse(self.breaker.allow(60))
+
+        # udana próba go zamyka
+        self.assertTrue(self.breaker.allow(0))
+        self.breaker.record_success()
+        self.assertFalse(self.breaker.is_open)
+        self.assertTrue(self.breaker.allow(60))
+        self.assertTrue(self.breaker.allow(60))
+
+
+class RetryTest(SimpleTestCase):
+    CONFIG = {
+        "REQUEST_TIMEOUT_SECONDS": 1, "RETRIES": 2, "BACKOFF_SECONDS": 0, "BACKOFF_MAX_SECONDS": 0,
+    }
+
+    def _get(self, server):
+        url = server.url.format(version="latest", currency="eur")
+        return convert_currency_service._get_with_retries(url, self.CONFIG)
+
+    def test_retries_server_errors_until_success(self):
+        with _RatesServer(delay=0, statuses=[503, 429]) as server:
+            response = self._get(server)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(server.calls, 3)
+
+    def test_gives_up_after_the_last_attempt(self):
+        with _RatesServer(delay=0, statuses=[500, 502, 503, 200]) as server:
+            with self.assertRaises(requests.HTTPError):
+                self._get(server)
+        self.assertEqual(server.calls, 3)
+
+    def test_does_not_retry_client_errors(self):
+        with _RatesServer(delay=0, statuses=[404]) as server:
+            with self.assertRaises(requests.HTTPError):
+                self._get(server)
+        self.assertEqual(server.calls, 1)
+
+    def test_retries_timeouts(self):
+        with _RatesServer(delay=0.3) as server:
+            with self.assertRaises(requests.Timeout):
+                convert_currency_service._get_with_retries(
+                    server.url.format(version="latest", currency="eur"), {**self.CONFIG, "REQUEST_TIMEOUT_SECONDS": 0.1}
+                )
+        self.assertEqual(server.calls, 3)
+
+    def test_fetch_budget_covers_every_attempt_and_backoff(self):
+        config = {"REQUEST_TIMEOUT_SECONDS": 5, "RETRIES": 2, "BACKOFF_SECONDS": 0.2, "BACKOFF_MAX_SECONDS": 2}
+        self.assertAlmostEqual(convert_currency_service._fetch_budget(config), 3 * 5 + 0.2 + 0.4)
+        self.assertAlmostEqual(convert_currency_service._fetch_budget({**config, "BACKOFF_MAX_SECONDS": 0.3}), 15.5)
+
+
+RATES_DATE = date(2026, 1, 15)
+
+
+class ReconcilePendingConversionsTest(TestCase):
+    def setUp(self):
+        convert_currency_service.rate_cache.reset()
+        owner = User.objects.create_user(username="owner")
+        self.trip = Trip.objects.create(
+            trip_code="TREC0001", trip_owner=owner, name="reconcile", description="", default_currency="PLN"
+        )
+        self.payer = TripParticipant.objects.create(trip=self.trip, user=owner, nickname="owner", Join_code="REC00001")
+        self.debtor = TripParticipant.objects.create(trip=self.trip, nickname="debtor", Join_code="REC00002")
+        CurrencyRate.objects.create(base_currency="usd", rate_date=RATES_DATE, rates={"pln": 4.0, "eur": 0.8})
+
+    def _pending_cost(self, currency):
+        # koszt zapisany bez kursu – jak przy niedostępnym API
+        cost = cost_service.add_cost(
+            self.trip.trip_id, currency, self.payer.id, Decimal("20"),
+            [_split(self.payer, "10"), _split(self.debtor, "10")], "PLN", "",
+        )["cost"]
+        Cost.objects.filter(cost_id=cost.cost_id).update(
+            payed_currency=currency, rate_date=RATES_DATE, conversion_pending=True, overall_value_main_currency=None
+        )
+        Splited.objects.filter(cost_id=cost.cost_id).update(
+            split_value_main_current=None, to_pay_back_value_main_current=None, pay_back_value_main_current=None
+        )
+        return cost
+
+    def test_unknown_currency_does_not_block_other_groups(self):
+        unknown = self._pending_cost("XYZ")
+        known = self._pending_cost("EUR")
+
+        result = cost_service.reconcile_pending_conversions()
+
+        self.assertEqual((result["converted"], result["pending"]), (1, 1))
+        self.assertTrue(Cost.objects.get(cost_id=unknown.cost_id).conversion_pending)
+        known = Cost.objects.get(cost_id=known.cost_id)
+        self.assertFalse(known.conversion_pending)
+        self.assertEqual(known.overall_value_main_currency, Decimal("100.00"))
+        self.assertEqual(diff_ledger([self.trip.trip_id]), [])
+
+
+SPLITED_PARTITION_SQL = [
+    'ALTER TABLE "tripAppBE_splited" RENAME TO "tripAppBE_splited_unpartitioned"',
+    'CREATE TABLE "tripAppBE_splited" (LIKE "tripAppBE_splited_unpartitioned" INCLUDING DEFAULTS INCLUDING CONSTRAINTS) '
+    'PARTITION BY HASH (trip_id)',
+    'CREATE SEQUENCE "tripAppBE_splited_id_part_seq" OWNED BY "tripAppBE_splited"."id"',
+    'ALTER TABLE "tripAppBE_splited" ALTER COLUMN "id" SET DEFAULT nextval(\'"tripAppBE_splited_id_part_seq"\')',
+    'CREATE TABLE "tripAppBE_splited_p0" PARTITION OF "tripAppBE_splited" FOR VALUES WITH (MODULUS 2, REMAINDER 0)',
+    'CREATE TABLE "tripAppBE_splited_p1" PARTITION OF "tripAppBE_splited" FOR VALUES WITH (MODULUS 2, REMAINDER 1)',
+    'INSERT INTO "tripAppBE_splited" SELECT * FROM "tripAppBE_splited_unpartitioned"',
+    'SELECT setval(\'"tripAppBE_splited_id_part_seq"\', '
+    'COALESCE((SELECT MAX("id") FROM "tripAppBE_splited_unpartitioned"), 0) + 1, false)',
+    'DROP TABLE "tripAppBE_splited_unpartitioned" CASCADE',
+    'ALTER TABLE "tripAppBE_splited" ADD PRIMARY KEY (trip_id, "id")',
+    'CREATE INDEX "tripAppBE_splited_trip_id_c9c3f763" ON "tripAppBE_splited" ("trip_id")',
+    'CREATE INDEX "tripAppBE_splited_cost_id_324a0c54" ON "tripAppBE_splited" ("cost_id")',
+    'CREATE INDEX "splited_participant_trip_idx" ON "tripAppBE_splited" ("participant_id", "trip_id")',
+    'CREATE INDEX "splited_payer_trip_idx" ON "tripAppBE_splited" ("payer_id", "trip_id")',
+    'CREATE INDEX "splited_cost_participant_idx" ON "tripAppBE_splited" ("cost_id", "participant_id")',
+    'CREATE INDEX "splited_payer_participant_idx" ON "tripAppBE_splited" ("payer_id", "participant_id", "payment")',
+    'CREATE INDEX "splited_open_idx" ON "tripAppBE_splited" ("trip_id", "participant_id", "payer_id") WHERE NOT "payment"',
+    'ALTER TABLE "tripAppBE_splited" ADD CONSTRAINT "tripAppBE_splited_trip_id_part_fk" '
+    'FOREIGN KEY ("trip_id") REFERENCES "tripAppBE_trip" ("trip_id") DEFERRABLE INITIALLY DEFERRED',
+    'ALTER TABLE "tripAppBE_splited" ADD CONSTRAINT "tripAppBE_splited_participant_id_part_fk" '
+    'FOREIGN KEY ("participant_id") REFERENCES "tripAppBE_tripparticipant" ("id") DEFERRABLE INITIALLY DEFERRED',
+    'ALTER TABLE "tripAppBE_splited" ADD CONSTRAINT "tripAppBE_splited_payer_id_part_fk" '
+    'FOREIGN KEY ("payer_id") REFERENCES "tripAppBE_tripparticipant" ("id") DEFERRABLE INITIALLY DEFERRED',
+    # FK do partycjonowanego kosztu złożony z kluczem partycjonowania
+    'ALTER TABLE "tripAppBE_splited" ADD CONSTRAINT "tripAppBE_splited_cost_id_part_fk" '
+    'FOREIGN KEY ("trip_id", "cost_id") REFERENCES "tripAppBE_cost" ("trip_id", "cost_id") DEFERRABLE INITIALLY DEFERRED',
+]
+
+
+class PartitionByTripTest(TestCase):
+    def _statements(self, model):
+        # bez wchodzenia w kontekst – SQLite nie otwiera edytora schematu wewnątrz transakcji testu
+        return partition_sql(model, 2, connection.SchemaEditorClass(connection, collect_sql=True))
+
+    def test_splited_partition_sql_snapshot(self):
+        self.assertEqual(self._statements(Splited), SPLITED_PARTITION_SQL)
+
+    @skipUnless(connection.vendor == "postgresql", "partition_by_trip runs only on PostgreSQL")
+    def test_dry_run_prints_cost_then_splited(self):
+        out = StringIO()
+        call_command("partition_by_trip", "--partitions", "2", stdout=out)
+
+        self.assertEqual(out.getvalue().strip(), ";\n".join(self._statements(Cost) + SPLITED_PARTITION_SQL) + ";")
+        # dry run niczego nie zmienia
+        self.assertFalse(is_partitioned(Splited))
+
+    @skipUnless(connection.vendor != "postgresql", "PostgreSQL accepts the command")
+    def test_rejects_other_databases(self):
+        with self.assertRaises(CommandError):
+            call_command("partition_by_trip", stdout=StringIO())
+
+
+class CostsPageTest(TestCase):
+    def setUp(self):
+        owner = User.objects.create_user(username="owner")
+        self.trip = Trip.objects.create(
+            trip_code="TPAG0001", trip_owner=owner, name="pages", description="", default_currency="PLN"
+        )
+        self.payer = TripParticipant.objects.create(trip=self.trip, user=owner, nickname="owner", Join_code="PAG00001")
+        self.other = TripParticipant.objects.create(trip=self.trip, nickname="other", Join_code="PAG00002")
+        self.sparse = TripParticipant.objects.create(trip=self.trip, nickname="sparse", Join_code="PAG00003")
+
+        self.sparse_costs = []
+        for i in range(12):
+            debtor = self.sparse if i % 4 == 0 else self.other
+            cost = cost_service.add_cost(
+                self.trip.trip_id, f"cost {i}", self.payer.id, Decimal("20"),
+                [_split(self.payer, "10"), _split(debtor, "10")], "PLN", "",
+            )["cost"]
+            if debtor == self.sparse:
+                self.sparse_costs.append(cost.cost_id)
+
+    def _all_pages(self, participant_id):
+        cost_ids, after = [], None
+        while True:
+            page = cost_service.get_costs_page(participant_id, self.trip.trip_id, first=2, after=after)
+            cost_ids += [cost.cost_id for cost in page["costs"]]
+            if not page["has_next_page"]:
+                return cost_ids
+            after = cost_service.encode_cost_cursor(page["costs"][-1])
+
+    def test_sparse_and_dense_plans_return_the_same_pages(self):
+        expected = sorted(self.sparse_costs, reverse=True)
+
+        self.assertEqual(self._all_pages(self.sparse.id), expected)
+        # próg 1 → każdy uczestnik idzie ścieżką keysetu po całym tripie
+        with mock.patch.object(cost_service, "SPARSE_PARTICIPANT_SPLITS", 1):
+            self.assertEqual(self._all_pages(self.sparse.id), expected)
+            self.assertEqual(len(self._all_pages(self.payer.id)), 12)
+
+
+class LedgerTest(TestCase):
+    def setUp(self):
+        owner = User.objects.create_user(username="owner")
+        self.trip = Trip.objects.create(
+            trip_code="TLED0001", trip_owner=owner, name="ledger", description="", default_currency="PLN"
+        )
+        self.payer = TripParticipant.objects.create(trip=self.trip, user=owner, nickname="owner", Join_code="LED00000")
+
+    def _add_debtors(self, count):
+        return TripParticipant.objects.bulk_create([
+            TripParticipant(trip=self.trip, nickname=f"d{i}", Join_code=f"LED{i + 1:05d}")
+            for i in range(count)
+        ])
+
+    def _add_cost(self, debtors, value="10", payer=None):
+        payer = payer or self.payer
+        splits = [_split(payer, value)] + [_split(debtor, value) for debtor in debtors]
+        return cost_service.add_cost(
+            self.trip.trip_id, "cost", payer.id, Decimal(value) * len(splits), splits, "PLN", ""
+        )["cost"]
+
+    def test_refresh_of_many_debtors_of_one_creditor_does_not_rebuild_the_trip(self):
+        debtors = self._add_debtors(ledger_service.MAX_GROUPS_PER_REFRESH + 50)
+
+        with mock.patch.object(ledger_service, "rebuild_ledger", wraps=ledger_service.rebuild_ledger) as rebuild:
+            self._add_cost(debtors)
+
+        rebuild.assert_not_called()
+        self.assertEqual(BalanceLedger.objects.filter(trip=self.trip).count(), len(debtors))
+        self.assertEqual(diff_ledger([self.trip.trip_id]), [])
+
+    def test_refresh_leaves_other_pairs_untouched(self):
+        first, second = self._add_debtors(2)
+        self._add_cost([first])
+        # para spoza odświeżanej grupy – gdyby refresh przeliczał cały trip, wróciłaby do 10.00
+        BalanceLedger.objects.filter(debtor=first).update(amount=Decimal("99.00"))
+
+        self._add_cost([second])
+
+        self.assertEqual(BalanceLedger.objects.get(debtor=first).amount, Decimal("99.00"))
+        self.assertEqual(BalanceLedger.objects.get(debtor=second).amount, Decimal("10.00"))
+
+    def test_paid_pair_is_pruned_with_an_event(self):
+        debtor, = self._add_debtors(1)
+        cost = self._add_cost([debtor])
+
+        cost_service.update_payment(cost.cost_id, debtor.id, 10)
+
+        self.assertFalse(BalanceLedger.objects.filter(trip=self.trip).exists())
+        event = CostEvent.objects.filter(trip=self.trip, kind=CostEvent.PAYMENT).get()
+        self.assertEqual((event.debtor_id, event.creditor_id, event.amount), (debtor.id, self.payer.id, Decimal("-10.00")))
+        self.assertEqual(diff_ledger([self.trip.trip_id]), [])
+
+    def test_verify_ledger_reports_and_fixes_differences(self):
+        debtor, = self._add_debtors(1)
+        self._add_cost([debtor])
+        BalanceLedger.objects.filter(trip=self.trip).update(amount=Decimal("1.00"))
+
+        out = StringIO()
+        with self.assertRaises(CommandError):
+            call_command("verify_ledger", "--trip", str(self.trip.trip_id), stdout=out)
+        self.assertIn(f"{debtor.id} → {self.payer.id} PLN", out.getvalue())
+
+        call_command("verify_ledger", "--trip", str(self.trip.trip_id), "--fix", stdout=StringIO())
+        self.assertEqual(diff_ledger([self.trip.trip_id]), [])
+        call_command("verify_ledger", stdout=out)
+        self.assertIn("Ledger matches splits", out.getvalue())
+
+
+class ImportCostsTest(TestCase):
+    def setUp(self):
+        convert_currency_service.rate_cache.reset()
+        owner = User.objects.create_user(username="owner")
+        self.trip = Trip.objects.create(
+            trip_code="TIMP0001", trip_owner=owner, name="import", description="", default_currency="PLN"
+        )
+        self.payer = TripParticipant.objects.create(trip=self.trip, user=owner, nickname="owner", Join_code="IMP00001")
+        self.debtor = TripParticipant.objects.create(trip=self.trip, nickname="debtor", Join_code="IMP00002")
+        CurrencyRate.objects.create(base_currency="usd", rate_date=RATES_DATE, rates={"pln": 4.0})
+
+    def _row(self, value, currency="PLN", split_value=None):
+        return {
+            "title": "imported", "payer_id": self.payer.id, "value": value, "currency": currency,
+            "date": RATES_DATE.isoformat(),
+            "splits": [{"participant_id": self.debtor.id, "split_value": value if split_value is None else split_value}],
+        }
+
+    def test_values_the_column_cannot_hold_reject_only_their_row(self):
+        rows = [
+            self._row("12.50"),
+            self._row("1e30"),
+            self._row("123456789.00"),
+            self._row("-1"),
+            self._row("10", split_value="NaN"),
+            # 50 mln USD po kursie 4.0 nie mieści się w kolumnie PLN
+            self._row("50000000", currency="USD"),
+            self._row("99999999.99"),
+        ]
+
+        result = import_service.import_costs(self.trip.trip_id, iter(rows), batch_size=3)
+
+        self.assertEqual((result["imported"], result["failed"]), (2, 5))
+        self.assertEqual([error["row"] for error in result["errors"]], [2, 3, 4, 5, 6])
+        self.assertEqual(
+            sorted(Cost.objects.filter(trip=self.trip).values_list("overall_value", flat=True)),
+            [Decimal("12.50"), Decimal("99999999.99")],
+        )
+        self.assertEqual(diff_ledger([self.trip.trip_id]), [])
+
+
+class RateHistoryGapTest(TestCase):
+    IMPORT_DATE = RATES_DATE + timedelta(days=5)
+
+    def setUp(self):
+        convert_currency_service.rate_cache.reset()
+        convert_currency_service.circuit_breaker.reset()
+        owner = User.objects.create_user(username="owner")
+        self.trip = Trip.objects.create(
+            trip_code="TGAP0001", trip_owner=owner, name="gap", description="", default_currency="PLN"
+        )
+        self.payer = TripParticipant.objects.create(trip=self.trip, user=owner, nickname="owner", Join_code="GAP00001")
+        self.debtor = TripParticipant.objects.create(trip=self.trip, nickname="debtor", Join_code="GAP00002")
+        CurrencyRate.objects.create(base_currency="usd", rate_date=RATES_DATE, rates={"pln": 4.0})
+
+    def _import(self, server, **config):
+        row = {
+            "title": "imported", "payer_id": self.payer.id, "value": "10", "currency": "USD",
+            "date": self.IMPORT_DATE.isoformat(), "splits": [{"participant_id": self.debtor.id, "split_value": "10"}],
+        }
+        with override_settings(CURRENCY_RATES={"URL": server.url, "BACKOFF_SECONDS": 0, **config}):
+            result = import_service.import_costs(self.trip.trip_id, iter([row]))
+        self.assertEqual(result["imported"], 1)
+        return Cost.objects.get(trip=self.trip)
+
+    def test_table_past_the_gap_is_fetched_for_the_cost_date(self):
+        with _RatesServer(delay=0) as server:
+            cost = self._import(server)
+        self.assertEqual(server.paths, [f"/{self.IMPORT_DATE.isoformat()}/usd.json"])
+        self.assertEqual(cost.overall_value_main_currency, Decimal("43.00"))
+        self.assertTrue(CurrencyRate.objects.filter(base_currency="usd", rate_date=self.IMPORT_DATE).exists())
+
+    def test_failed_fetch_leaves_the_cost_pending(self):
+        with _RatesServer(delay=0, statuses=[503] * 3) as server:
+            cost = self._import(server)
+        self.assertTrue(cost.conversion_pending)
+        self.assertIsNone(cost.overall_value_main_currency)
+
+    def test_table_within_the_gap_is_used_without_a_request(self):
+        with _RatesServer(delay=0) as server:
+            cost = self._import(server, HISTORY_MAX_GAP_DAYS=7)
+        self.assertEqual(server.calls, 0)
+        self.assertEqual(cost.overall_value_main_currency, Decimal("40.00"))
+
+
+class PrefetchRatesTest(TransactionTestCase):
+    def setUp(self):
+        convert_currency_service.rate_cache.reset()
+        convert_currency_service.circuit_breaker.reset()
+        owner = User.objects.create_user(username="owner")
+        trip = Trip.objects.create(
+            trip_code="TPRE0001", trip_owner=owner, name="prefetch", description="", default_currency="PLN"
+        )
+        Cost.objects.create(
+            trip=trip, cost_name="museum", overall_value=Decimal("10"), description="",
+            payed_currency="EUR", overall_value_main_currency=Decimal("43"),
+        )
+
+    def test_warms_latest_and_history_and_reports_missing_currencies(self):
+        today = timezone.localdate()
+        # testowa baza SQLite w pamięci zgłasza "table is locked" zamiast czekać na zapis innego wątku
+        workers = 1 if connection.vendor == "sqlite" else 2
+        with _RatesServer(delay=0) as server, override_settings(CURRENCY_RATES={"URL": server.url}):
+            report = convert_currency_service.prefetch_rates(days=2, max_workers=workers)
+
+        self.assertEqual(sorted(server.paths), sorted([
+            "/latest/usd.json",
+            f"/{(today - timedelta(days=1)).isoformat()}/usd.json",
+            f"/{(today - timedelta(days=2)).isoformat()}/usd.json",
+        ]))
+        # stub zna tylko usd i pln – eur z kosztu tripu nie jest pokryte
+        self.assertEqual(report, {"usd": {"date": "2026-01-01", "missing": ["eur"], "history": {"stored": 2, "failed": 0}}})
+        self.assertEqual(CurrencyRate.objects.filter(base_currency="usd").count(), 3)
+
+    def test_upstream_failure_is_reported_not_raised(self):
+        config = {"RETRIES": 0, "BREAKER_FAILURE_THRESHOLD": 10}
+        with _RatesServer(delay=0, statuses=[503] * 2) as server, \
+                override_settings(CURRENCY_RATES={**config, "URL": server.url}):
+            out = StringIO()
+            err = StringIO()
+            call_command("prefetch_rates", "--days", "1", "--workers", "1", stdout=out, stderr=err)
+
+        self.assertEqual(server.calls, 2)
+        self.assertIn("usd: rates unavailable", err.getvalue())
+        self.assertFalse(CurrencyRate.objects.exists())
+
+
+class SettlementTest(TestCase):
+    def setUp(self):
+        owner = User.objects.create_user(username="owner")
+        self.trip = Trip.objects.create(
+            trip_code="TSET0001", trip_owner=owner, name="settle", description="", default_currency="PLN"
+        )
+        self.a = TripParticipant.objects.create(trip=self.trip, user=owner, nickname="a", Join_code="SET00001")
+        self.b = TripParticipant.objects.create(trip=self.trip, nickname="b", Join_code="SET00002")
+        self.c = TripParticipant.objects.create(trip=self.trip, nickname="c", Join_code="SET00003")
+
+    def _add_cost(self, payer, debtors, value="10"):
+        splits = [_split(payer, value)] + [_split(debtor, value) for debtor in debtors]
+        return cost_service.add_cost(
+            self.trip.trip_id, "cost", payer.id, Decimal(value) * len(splits), splits, "PLN", ""
+        )["cost"]
+
+    def _open(self, debtor, payer):
+        return Splited.objects.filter(participant=debtor, payer=payer, payment=False).count()
+
+    def test_settlement_closes_only_the_pair_in_both_directions(self):
+        shared = self._add_cost(self.a, [self.b, self.c])
+        back = self._add_cost(self.b, [self.a])
+
+        result = cost_service.fully_settlement_with_participant(self.trip.trip_id, self.a.id, self.b.id)
+
+        self.assertTrue(result["ok"])
+        self.assertEqual((self._open(self.b, self.a), self._open(self.a, self.b)), (0, 0))
+        self.assertEqual(self._open(self.c, self.a), 1)
+        settled = Splited.objects.get(cost=shared, participant=self.b)
+        self.assertEqual((settled.pay_back_value, settled.to_pay_back_value), (Decimal("10.00"), Decimal("0.00")))
+        # koszt z otwartym splitem c zostaje nieopłacony
+        self.assertFalse(Cost.objects.get(cost_id=shared.cost_id).payment)
+        self.assertTrue(Cost.objects.get(cost_id=back.cost_id).payment)
+
+        self.assertEqual(list(BalanceLedger.objects.values_list("debtor_id", "creditor_id")), [(self.c.id, self.a.id)])
+        self.assertTrue(CostEvent.objects.filter(kind=CostEvent.SETTLEMENT, debtor_id=self.b.id).exists())
+        self.assertEqual(diff_ledger([self.trip.trip_id]), [])
+
+    def test_settlement_in_one_currency_leaves_other_currencies_open(self):
+        pln = self._add_cost(self.a, [self.b])
+        eur = self._add_cost(self.a, [self.b])
+        Cost.objects.filter(cost_id=eur.cost_id).update(payed_currency="EUR")
+        ledger_service.rebuild_ledger([self.trip.trip_id])
+
+        cost_service.fully_settlement_with_participant(self.trip.trip_id, self.b.id, self.a.id, currency="EUR")
+
+        self.assertTrue(Splited.objects.get(cost=eur, participant=self.b).payment)
+        self.assertFalse(Splited.objects.get(cost=pln, participant=self.b).payment)
+        self.assertEqual(list(BalanceLedger.objects.values_list("currency", flat=True)), ["PLN"])
+        self.assertEqual(diff_ledger([self.trip.trip_id]), [])
+
+    def test_settle_trip_closes_everything_in_constant_queries(self):
+        self._add_cost(self.a, [self.b])
+        with CaptureQueriesContext(connection) as small:
+            cost_service.settle_trip(self.trip.trip_id)
+
+        for _ in range(10):
+            self._add_cost(self.a, [self.b, self.c])
+            self._add_cost(self.c, [self.a, self.b])
+        with CaptureQueriesContext(connection) as large:
+            result = cost_service.settle_trip(self.trip.trip_id)
+
+        self.assertEqual(result["message"], "Trip settled, 40 splits closed")
+        self.assertEqual(len(large.captured_queries), len(small.captured_queries))
+        self.assertFalse(Splited.objects.filter(trip=self.trip, payment=False).exists())
+        self.assertFalse(Cost.objects.filter(trip=self.trip, payment=False).exists())
+        self.assertFalse(BalanceLedger.objects.filter(trip=self.trip).exists())
+
+
+class _ShareInput(dict):
+    """
+    Jak SplitParticipantInput z mutacji: dict z dostępem przez atrybuty.
+    """
+    __getattr__ = dict.get
+
+
+class SplitStrategyTest(TestCase):
+    def setUp(self):
+        owner = User.objects.create_user(username="owner")
+        self.trip = Trip.objects.create(
+            trip_code="TSPL0001", trip_owner=owner, name="split", description="", default_currency="PLN"
+        )
+        self.members = [
+            TripParticipant.objects.create(trip=self.trip, nickname=f"p{i}", Join_code=f"SPL{i:05d}")
+            for i in range(3)
+        ]
+
+    def _compute(self, strategy, value, shares=None):
+        inputs = None
+        if shares is not None:
+            inputs = [_ShareInput(participant_id=m.id, share=share) for m, share in zip(self.members, shares)]
+        splits = split_service.compute_splits(self.trip.trip_id, strategy, Decimal(value), inputs)
+        return [(split.participant_id, split.split_value) for split in splits]
+
+    def test_equal_split_gives_leftover_cents_to_the_first_participants(self):
+        self.assertEqual(self._compute(split_service.EQUAL, "100.00"), [
+            (self.members[0].id, Decimal("33.34")),
+            (self.members[1].id, Decimal("33.33")),
+            (self.members[2].id, Decimal("33.33")),
+        ])
+
+    def test_shares_use_largest_remainders(self):
+        # 100001 gr × 1/6, 2/6, 3/6 → reszty 5, 4, 3 – dwa brakujące grosze dla p0 i p1
+        self.assertEqual(
+            [value for _, value in self._compute(split_service.SHARES, "1000.01", [1, 2, 3])],
+            [Decimal("166.67"), Decimal("333.34"), Decimal("500.00")],
+        )
+        # udziały ułamkowe skalowane do wspólnych wag całkowitych
+        self.assertEqual(
+            [value for _, value in self._compute(split_service.SHARES, "10.00", ["0.5", "1.5", "0"])],
+            [Decimal("2.50"), Decimal("7.50"), Decimal("0.00")],
+        )
+
+    def test_percent_and_exact_must_add_up(self):
+        # 9999 gr × 333, 333, 334 / 1000 → reszty 667, 667, 666
+        self.assertEqual(
+            [value for _, value in self._compute(split_service.PERCENT, "99.99", ["33.3", "33.3", "33.4"])],
+            [Decimal("33.30"), Decimal("33.30"), Decimal("33.39")],
+        )
+        with self.assertRaisesMessage(ValueError, "Split percentages must add up to 100"):
+            self._compute(split_service.PERCENT, "10", [50, 40, 5])
+        with self.assertRaisesMessage(ValueError, "Split values do not add up to the cost value"):
+            self._compute(split_service.EXACT, "10", ["5", "4", "0.99"])
+
+    def test_invalid_input_is_rejected(self):
+        outsider = TripParticipant.objects.create(trip=Trip.objects.create(
+            trip_code="TSPL0002", trip_owner=self.trip.trip_owner, name="other", description="", default_currency="PLN"
+        ), nickname="x", Join_code="SPL99999")
+        cases = [
+            ("Unknown split strategy", lambda: self._compute("halves", "10")),
+            ("Cost value must be positive", lambda: self._compute(split_service.EQUAL, "0")),
+            ("needs participants with shares", lambda: self._compute(split_service.SHARES, "10")),
+            ("at most 6 decimal places", lambda: self._compute(split_service.SHARES, "10", ["0.0000001", "1", "1"])),
+            ("Participant is not part of this trip", lambda: split_service.compute_splits(
+                self.trip.trip_id, split_service.EQUAL, Decimal("10"), [_ShareInput(participant_id=outsider.id)]
+            )),
+            ("Participant listed more than once", lambda: split_service.compute_splits(
+                self.trip.trip_id, split_service.EQUAL, Decimal("10"),
+                [_ShareInput(participant_id=self.members[0].id)] * 2,
+            )),
+        ]
+        for message, call in cases:
+            with self.subTest(message), self.assertRaisesMessage(ValueError, message):
+                call()
+
+    def test_allocation_of_huge_amounts_does_not_overflow(self):
+        total = 10 ** 17
+        cents = split_service.allocate_cents(total, [10 ** 6, 1, 3])
+        self.assertEqual(sum(int(c) for c in cents), total)
+
+
+class CurrencyChangeJobTest(TestCase):
+    def setUp(self):
+        convert_currency_service.rate_cache.reset()
+        owner = User.objects.create_user(username="owner")
+        self.trip = Trip.objects.create(
+            trip_code="TCUR0001", trip_owner=owner, name="currency", description="", default_currency="PLN"
+        )
+        self.payer = TripParticipant.objects.create(trip=self.trip, user=owner, nickname="owner", Join_code="CUR00001")
+        self.debtor = TripParticipant.objects.create(trip=self.trip, nickname="debtor", Join_code="CUR00002")
+        self.costs = [
+            cost_service.add_cost(
+                self.trip.trip_id, f"c{i}", self.payer.id, Decimal("40"),
+                [_split(self.payer, "20"), _split(self.debtor, "20")], "PLN", "",
+            )["cost"]
+            for i in range(3)
+        ]
+        # świeża tabela usd: 1 PLN = 0.25 EUR
+        CurrencyRate.objects.create(base_currency="usd", rate_date=timezone.localdate(), rates={"pln": 4.0, "eur": 1.0})
+        # jak start_currency_change, ale bez wątku w tle
+        Trip.objects.filter(trip_id=self.trip.trip_id).update(default_currency="EUR")
+        self.job = CurrencyChangeJob.objects.create(
+            trip=self.trip, from_currency="PLN", to_currency="EUR", total_costs=len(self.costs)
+        )
+
+    def _age(self, seconds, **fields):
+        CurrencyChangeJob.objects.filter(id=self.job.id).update(
+            updated_at=timezone.now() - timedelta(seconds=seconds), **fields
+        )
+
+    def _main_values(self):
+        return [
+            Cost.objects.get(cost_id=cost.cost_id).overall_value_main_currency for cost in self.costs
+        ]
+
+    def test_claim_is_exclusive_until_the_job_goes_stale(self):
+        claim = currency_change_service._claim
+        self.assertTrue(claim(self.job.id, "first", include_failed=False, stale_seconds=300))
+        self.assertFalse(claim(self.job.id, "second", include_failed=False, stale_seconds=300))
+
+        self._age(600)
+        self.assertTrue(claim(self.job.id, "second", include_failed=False, stale_seconds=300))
+        self.job.refresh_from_db()
+        self.assertEqual((self.job.status, self.job.runner), (CurrencyChangeJob.RUNNING, "second"))
+
+        self._age(600, status=CurrencyChangeJob.FAILED)
+        self.assertFalse(claim(self.job.id, "third", include_failed=False, stale_seconds=300))
+        self.assertTrue(claim(self.job.id, "third", include_failed=True, stale_seconds=300))
+
+    def test_job_running_elsewhere_is_left_alone(self):
+        self._age(0, status=CurrencyChangeJob.RUNNING, runner="other")
+
+        self.assertIsNone(currency_change_service.run_currency_change_job(self.job.id))
+        self.assertEqual(self._main_values(), [Decimal("40.00")] * 3)
+
+    def test_resume_continues_from_the_cursor_of_an_abandoned_job(self):
+        # proces padł po pierwszym chunku: koszt 0 przeliczony, kursor za nim
+        currency_change_service._claim(self.job.id, "dead", include_failed=False, stale_seconds=300)
+        self.assertTrue(currency_change_service._convert_chunk(self.job.id, "dead", 1, {}))
+        self.assertEqual(self._main_values(), [Decimal("10.00"), Decimal("40.00"), Decimal("40.00")])
+        self._age(600)
+
+        out = StringIO()
+        call_command("resume_currency_changes", "--stale-after", "60", stdout=out)
+
+        self.assertIn("Resumed 1 job(s)", out.getvalue())
+        self.job.refresh_from_db()
+        self.assertEqual((self.job.status, self.job.last_cost_id), (CurrencyChangeJob.DONE, self.costs[-1].cost_id))
+        # koszt 0 nie był przeliczany drugi raz
+        self.assertEqual(self.job.converted_costs, len(self.costs))
+        self.assertEqual(self._main_values(), [Decimal("10.00")] * 3)
+        self.assertEqual(
+            set(BalanceLedger.objects.filter(trip=self.trip).values_list("amount", "amount_main")),
+            {(Decimal("60.00"), Decimal("15.00"))},
+        )
+        self.assertEqual(diff_ledger([self.trip.trip_id]), [])
+
+    def test_failed_job_is_retried_only_on_request(self):
+        self._age(0, status=CurrencyChangeJob.FAILED, error="rates unavailable")
+
+        out = StringIO()
+        call_command("resume_currency_changes", stdout=out)
+        self.assertIn("No currency changes to resume", out.getvalue())
+
+        call_command("resume_currency_changes", "--failed", stdout=out)
+        self.job.refresh_from_db()
+        self.assertEqual((self.job.status, self.job.error), (CurrencyChangeJob.DONE, ""))
+        self.assertEqual(self._main_values(), [Decimal("10.00")] * 3)
+
+
+LEDGER_AS_OF_QUERY = """
+query($tripId: ID!, $at: DateTime!) {
+  ledgerAsOf(tripId: $tripId, at: $at) { debtorNickname creditorNickname value { currency value } }
+}
+"""
+
+
+class LedgerHistoryTest(TestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user(username="owner")
+        self.trip = Trip.objects.create(
+            trip_code="THIS0001", trip_owner=self.owner, name="history", description="", default_currency="PLN"
+        )
+        self.payer = TripParticipant.objects.create(
+            trip=self.trip, user=self.owner, nickname="owner", Join_code="HIS00001"
+        )
+        self.debtor = TripParticipant.objects.create(trip=self.trip, nickname="debtor", Join_code="HIS00002")
+        self.start = timezone.now() - timedelta(hours=3)
+
+    def _add_cost(self, value, at):
+        cost = cost_service.add_cost(
+            self.trip.trip_id, "cost", self.payer.id, Decimal(value) * 2,
+            [_split(self.payer, value), _split(self.debtor, value)], "PLN", "",
+        )["cost"]
+        # zdarzenia kosztu przesunięte w przeszłość
+        CostEvent.objects.filter(cost_id=cost.cost_id).update(created_at=at)
+        return cost
+
+    def _debt(self, ledger):
+        return ledger.get((self.debtor.id, self.payer.id, "PLN"), (ZERO, ZERO))[0]
+
+    def test_as_of_replays_the_event_tail_on_top_of_the_snapshot(self):
+        self._add_cost("10", self.start)
+        later = self._add_cost("20", self.start + timedelta(hours=1))
+        # snapshot między kosztami: obejmuje tylko pierwszy
+        snapshot = ledger_service.take_snapshot(
+            self.trip.trip_id, now=self.start + timedelta(minutes=30, seconds=ledger_service.SNAPSHOT_SETTLE_SECONDS)
+        )
+        self.assertEqual(snapshot.balances, [[self.debtor.id, self.payer.id, "PLN", "10.00", "10.00"]])
+        cost_service.update_payment(later.cost_id, self.debtor.id, 4)
+
+        def history(at):
+            return self._debt(ledger_service.get_ledger_as_of(self.trip.trip_id, at))
+
+        self.assertEqual(history(self.start - timedelta(minutes=1)), ZERO)
+        self.assertEqual(history(self.start + timedelta(minutes=10)), Decimal("10.00"))
+        self.assertEqual(history(self.start + timedelta(hours=2)), Decimal("30.00"))
+        # teraz: z uwzględnieniem spłaty – zgodne z ledgerem
+        now = ledger_service.get_ledger_as_of(self.trip.trip_id, timezone.now())
+        self.assertEqual(self._debt(now), Decimal("26.00"))
+        self.assertEqual(now, {
+            (row.debtor_id, row.creditor_id, row.currency): (row.amount, row.amount_main)
+            for row in BalanceLedger.objects.filter(trip=self.trip)
+        })
+
+    def test_snapshot_only_when_new_settled_events_exist(self):
+        self._add_cost("10", self.start)
+        self.assertEqual(ledger_service.trips_due_for_snapshot(min_events=1), [self.trip.trip_id])
+
+        self.assertIsNotNone(ledger_service.take_snapshot(self.trip.trip_id))
+        self.assertIsNone(ledger_service.take_snapshot(self.trip.trip_id))
+        self.assertEqual(ledger_service.trips_due_for_snapshot(min_events=1), [])
+
+        # świeże zdarzenia czekają SNAPSHOT_SETTLE_SECONDS
+        self._add_cost("5", timezone.now())
+        self.assertEqual(ledger_service.trips_due_for_snapshot(min_events=1), [self.trip.trip_id])
+        self.assertIsNone(ledger_service.take_snapshot(self.trip.trip_id))
+
+    def test_query_before_the_migration_baseline_is_an_error(self):
+        TripBalanceSnapshot.objects.create(trip=self.trip, as_of=self.start, last_event_id=0, balances=[])
+        self._add_cost("10", self.start + timedelta(minutes=5))
+        self.client.force_login(self.owner)
+
+        def query(at):
+            response = self.client.post(
+                "/graphql/",
+                json.dumps({"query": LEDGER_AS_OF_QUERY, "variables": {"tripId": self.trip.trip_id, "at": at.isoformat()}}),
+                content_type="application/json",
+            )
+            return response.json()
+
+        body = query(self.start - timedelta(hours=1))
+        self.assertIn("Balance history starts at", body["errors"][0]["message"])
+
+        body = query(self.start + timedelta(hours=1))
+        self.assertNotIn("errors", body)
+        entry, = body["data"]["ledgerAsOf"]
+        self.assertEqual((entry["debtorNickname"], entry["creditorNickname"]), ("debtor", "owner"))
+        self.assertEqual(Decimal(str(entry["value"]["value"])), Decimal("10"))
@@ -1,7 +1,8 @@
 from django.urls import path
 from django.views.decorators.csrf import csrf_exempt
-from graphene_django.views import GraphQLView
+from tripAppBE.views import import_costs_view, TripGraphQLView
 
 urlpatterns = [
-    path('graphql/', csrf_exempt(GraphQLView.as_view(graphiql=True))),
+    path('graphql/', csrf_exempt(TripGraphQLView.as_view(graphiql=True))),
+    path('import/<int:trip_id>/', csrf_exempt(import_costs_view)),
 ]
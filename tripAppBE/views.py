@@ -1,3 +1,41 @@
-from django.shortcuts import render
+from django.http import JsonResponse
+from django.views.decorators.http import require_POST
+from graphene_django.views import GraphQLView
 
-# Create your views here.
+from tripAppBE.models import TripParticipant
+from tripAppBE.schema.loaders import Loaders
+from tripAppBE.services.import_service import import_costs, iter_rows, FORMATS
+
+
+@require_POST
+def import_costs_view(request, trip_id):
+    """
+    POST multipart z plikiem `file` (CSV albo JSON lines) → import kosztów do tripu.
+    Format z parametru `format` albo z rozszerzenia pliku.
+    """
+    if not request.user.is_authenticated:
+        return JsonResponse({"ok": False, "message": "Authentication required"}, status=401)
+
+    if not TripParticipant.objects.filter(trip_id=trip_id, user=request.user).exists():
+        return JsonResponse({"ok": False, "message": "User is not a participant in this trip."}, status=403)
+
+    upload = request.FILES.get("file")
+    if upload is None:
+        return JsonResponse({"ok": False, "message": "Missing file"}, status=400)
+
+    file_format = request.GET.get("format") or upload.name.rsplit(".", 1)[-1].lower()
+    if file_format not in FORMATS:
+        return JsonResponse({"ok": False, "message": f"Unsupported format, use one of {', '.join(FORMATS)}"}, status=400)
+
+    result = import_costs(trip_id, iter_rows(upload.file, file_format))
+    return JsonResponse(result, status=200 if result["ok"] else 404)
+
+
+class TripGraphQLView(GraphQLView):
+    """
+    GraphQLView z loaderami na czas requestu (context.loaders).
+    """
+
+    def get_context(self, request):
+        request.loaders = Loaders()
+        return request